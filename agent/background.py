@@ -0,0 +1,86 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+BACKGROUND_TASK_TTL = float(os.getenv("BACKGROUND_TASK_TTL", "1800"))
+BACKGROUND_MAX_TASKS = int(os.getenv("BACKGROUND_MAX_TASKS", "512"))
+
+
+def _consume_result(task: asyncio.Task) -> None:
+    # Failures surface when the result is awaited; never as
+    # "exception was never retrieved" for results nobody asked for.
+    if not task.cancelled():
+        task.exception()
+
+
+def _reusable(task: asyncio.Task) -> bool:
+    """Still running, or finished with a result; failed and cancelled tasks are retried."""
+    return not task.done() or (not task.cancelled() and task.exception() is None)
+
+
+class BackgroundTasks:
+    """
+    Named tasks per session that can outlive the graph run that started
+    them, e.g. a report prefetched in one turn and used in the next.
+    Each (session, name) slot holds one task for one `key`; starting a
+    different key, or asking for one, cancels the stale task. Slots expire
+    after `ttl` seconds and at most `max_tasks` are kept.
+    """
+
+    def __init__(self, ttl: float = BACKGROUND_TASK_TTL, max_tasks: int = BACKGROUND_MAX_TASKS):
+        self.ttl = ttl
+        self.max_tasks = max_tasks
+        self._slots: "OrderedDict[Tuple[Any, str], Tuple[str, asyncio.Task, float]]" = OrderedDict()
+
+    def start(self, session: Any, name: str, key: str, factory: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """The task for `key`, started with `factory()` unless already running."""
+        self._expire()
+        slot = (session, name)
+        entry = self._slots.get(slot)
+        if entry is not None and entry[0] == key and _reusable(entry[1]):
+            self._slots.move_to_end(slot)
+            return entry[1]
+        self.cancel(session, name)
+        task = asyncio.create_task(factory())
+        task.add_done_callback(_consume_result)
+        task.add_done_callback(lambda task: self._finished(slot, task))
+        self._slots[slot] = (key, task, time.monotonic())
+        while len(self._slots) > self.max_tasks:
+            _, (_, oldest, _) = self._slots.popitem(last=False)
+            oldest.cancel()
+        return task
+
+    def take(self, session: Any, name: str, key: str) -> Optional[asyncio.Task]:
+        """
+        Remove and return the task for `key`; a task for any other key is
+        stale and cancelled.
+        """
+        self._expire()
+        entry = self._slots.pop((session, name), None)
+        if entry is None:
+            return None
+        if entry[0] != key or not _reusable(entry[1]):
+            entry[1].cancel()
+            return None
+        return entry[1]
+
+    def _finished(self, slot: Tuple[Any, str], task: asyncio.Task) -> None:
+        # A failed or cancelled task leaves its slot, so the next start retries.
+        entry = self._slots.get(slot)
+        if entry is not None and entry[1] is task and not _reusable(task):
+            del self._slots[slot]
+
+    def cancel(self, session: Any, name: str) -> None:
+        entry = self._slots.pop((session, name), None)
+        if entry is not None:
+            entry[1].cancel()
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for slot in [s for s, (_, _, started) in self._slots.items() if now - started > self.ttl]:
+            self._slots.pop(slot)[1].cancel()
+
+
+background_tasks = BackgroundTasks()
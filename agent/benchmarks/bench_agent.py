@@ -0,0 +1,279 @@
+"""
+End-to-end benchmark of the compiled agent graph against local Tavily and
+OpenAI stand-ins (benchmarks/fake_servers.py); no API keys or network.
+
+    cd agent
+    python benchmarks/bench_agent.py [--profile realistic] [--iterations 3]
+        [--concurrency 1] [--cache cold|warm] [--report]
+        [--out results.json] [--baseline previous.json --tolerance 0.2]
+
+Every fixture query runs through `graph.ainvoke` as a new conversation and
+is timed per pipeline stage (classification, search, extract, url_rewrite,
+distill, llm_structuring, combine, emit) from the spans in metrics.py. For
+each stage `wall_s` is the time at least one of its spans was running and
+`total_s` the summed span time across retailers and pages.
+
+With --out the runs and their p50/p95 summary are written as JSON. With
+--baseline the summary is compared with an earlier result file and the
+script exits with status 1 when total time or any stage's p50 wall time
+regressed by more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import warnings
+from typing import Any, Dict, List
+
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, AGENT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_servers import DEFAULT_FIXTURE, FakeServers, PROFILES, load_fixture, load_profile  # noqa: E402
+
+# Regressions smaller than this many seconds are noise, whatever the ratio.
+MIN_REGRESSION_S = 0.005
+
+EDIT_ACTION = {
+    "name": "edit_product_canvas",
+    "description": "Edit the products in the canvas and wishlist",
+    "parameters": {"type": "object", "properties": {}},
+}
+
+
+def configure_env(servers: FakeServers, workdir: str, cache: str, ui_delays: bool) -> None:
+    """Point the agent at the stand-ins. Must run before the agent modules are imported."""
+    os.environ.update({
+        "TAVILY_API_KEY": "bench",
+        "OPENAI_API_KEY": "bench",
+        "TAVILY_API_BASE_URL": servers.tavily_url,
+        "OPENAI_BASE_URL": servers.openai_url,
+        "OPENAI_HTTP2": "0",
+        "AGENT_CACHE_DIR": os.path.join(workdir, "cache"),
+        "CHECKPOINT_DB": os.path.join(workdir, "checkpoints.sqlite3"),
+    })
+    if cache == "cold":
+        for name in ("EXTRACT_CACHE_TTL", "STRUCTURED_CACHE_TTL", "REPORT_CACHE_TTL"):
+            os.environ[name] = "0"
+    if not ui_delays:
+        os.environ["UI_STEP_DELAY"] = "0"
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def describe(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+        "mean": statistics.fmean(values) if values else 0.0,
+        "max": max(values) if values else 0.0,
+    }
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    ok = [r for r in runs if r["error"] is None]
+    stage_names = sorted({s for r in ok for s in r["stages"]})
+    summary = {
+        "runs": len(runs),
+        "errors": len(runs) - len(ok),
+        "total_s": describe([r["total_s"] for r in ok]),
+        "products": describe([r["products"] for r in ok]),
+        "stages": {
+            stage: {
+                "wall_s": describe([r["stages"].get(stage, {}).get("wall_s", 0.0) for r in ok]),
+                "total_s": describe([r["stages"].get(stage, {}).get("total_s", 0.0) for r in ok]),
+                "count": describe([r["stages"].get(stage, {}).get("count", 0) for r in ok]),
+            }
+            for stage in stage_names
+        },
+    }
+    if any("report_s" in r for r in ok):
+        summary["report_s"] = describe([r["report_s"] for r in ok if "report_s" in r])
+    return summary
+
+
+def compare(summary: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Human-readable regressions of `summary` against `baseline`."""
+    checks = [("total", summary["total_s"]["p50"], baseline["total_s"]["p50"])]
+    if "report_s" in summary and "report_s" in baseline:
+        checks.append(("report", summary["report_s"]["p50"], baseline["report_s"]["p50"]))
+    for stage, base in baseline.get("stages", {}).items():
+        cur = summary["stages"].get(stage)
+        if cur is not None:
+            checks.append((stage, cur["wall_s"]["p50"], base["wall_s"]["p50"]))
+    regressions = []
+    for name, cur, base in checks:
+        if cur > base * (1 + tolerance) and cur - base > MIN_REGRESSION_S:
+            regressions.append(f"{name}: p50 {base * 1000:.1f} ms -> {cur * 1000:.1f} ms ({(cur / base - 1) * 100 if base else float('inf'):+.0f}%)")
+    return regressions
+
+
+def git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=AGENT_DIR, capture_output=True, text=True, timeout=5).stdout.strip()
+    except Exception:
+        return ""
+
+
+async def run_query(graph, query: str, iteration: int, with_report: bool) -> Dict[str, Any]:
+    # Imported here: the agent modules read their settings from the
+    # environment at import time, after configure_env.
+    from langchain_core.messages import AIMessage, HumanMessage
+    from metrics import start_trace
+
+    trace = start_trace()
+    config = {"configurable": {"thread_id": f"bench-{uuid.uuid4().hex}"}}
+    state = {
+        "messages": [HumanMessage(content=query)],
+        "products": [], "favorites": [], "buffer_products": [], "wishlist": [], "logs": [],
+        "report": None, "show_results": False,
+        "canvas_logs": {"title": "", "subtitle": ""},
+        "copilotkit": {"actions": [EDIT_ACTION]},
+    }
+    run: Dict[str, Any] = {"query": query, "iteration": iteration, "error": None}
+    start = time.perf_counter()
+    try:
+        result = await graph.ainvoke(state, config)
+        run["total_s"] = time.perf_counter() - start
+        run["products"] = len(result.get("buffer_products") or [])
+        if with_report and result.get("buffer_products"):
+            # Accept the results, then ask for the report of the canvas.
+            report_start = time.perf_counter()
+            await graph.ainvoke({
+                "messages": [AIMessage(content="")],
+                "products": result["buffer_products"][:5],
+            }, config)
+            run["report_s"] = time.perf_counter() - report_start
+    except Exception as e:
+        run["total_s"] = time.perf_counter() - start
+        run["products"] = 0
+        run["error"] = repr(e)
+    run["stages"] = trace.stages()
+    return run
+
+
+async def bench(args, servers: FakeServers) -> List[Dict[str, Any]]:
+    from shopping_assistant import graph
+    from clients import close_clients
+
+    queries = servers.fixture["queries"]
+    runs: List[Dict[str, Any]] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(query: str, iteration: int) -> None:
+        async with semaphore:
+            # Each run is its own task, so its trace lives in its own context.
+            runs.append(await asyncio.create_task(run_query(graph, query, iteration, args.report)))
+
+    try:
+        for iteration in range(args.iterations):
+            await asyncio.gather(*(one(q, iteration) for q in queries))
+    finally:
+        await close_clients()
+    return runs
+
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    print(f"\n{summary['runs']} runs, {summary['errors']} errors; total p50 {summary['total_s']['p50'] * 1000:.0f} ms, "
+          f"p95 {summary['total_s']['p95'] * 1000:.0f} ms; {summary['products']['mean']:.1f} products per search")
+    if "report_s" in summary:
+        print(f"report p50 {summary['report_s']['p50'] * 1000:.0f} ms")
+    print(f"{'stage':<16}{'wall p50':>10}{'wall p95':>10}{'span sum p50':>14}{'spans':>8}")
+    for stage, s in summary["stages"].items():
+        print(f"{stage:<16}{s['wall_s']['p50'] * 1000:>8.1f}ms{s['wall_s']['p95'] * 1000:>8.1f}ms"
+              f"{s['total_s']['p50'] * 1000:>12.1f}ms{s['count']['mean']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixture", default=DEFAULT_FIXTURE, help="fixture file or recorded corpus directory")
+    parser.add_argument("--profile", default="realistic", help=f"one of {', '.join(PROFILES)} or a JSON file of Profile fields")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--cache", choices=["cold", "warm"], default="cold", help="cold disables the extraction/structured/report caches")
+    parser.add_argument("--report", action="store_true", help="also generate the report for each search")
+    parser.add_argument("--ui-delays", action="store_true", help="keep the UI_STEP_DELAY pauses")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--verbose", action="store_true", help="keep the agent's own print output")
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore")
+    fixture = load_fixture(args.fixture)
+    profile = load_profile(args.profile)
+    servers = FakeServers(fixture, profile, seed=args.seed).start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="agent-bench-") as workdir:
+            configure_env(servers, workdir, args.cache, args.ui_delays)
+            stdout = sys.stdout
+            if not args.verbose:
+                sys.stdout = open(os.devnull, "w")
+            try:
+                runs = asyncio.run(bench(args, servers))
+            finally:
+                if sys.stdout is not stdout:
+                    sys.stdout.close()
+                    sys.stdout = stdout
+        stats = servers.request_stats()
+    finally:
+        servers.stop()
+
+    summary = summarize(runs)
+    result = {
+        "meta": {
+            "fixture": os.path.relpath(args.fixture, AGENT_DIR),
+            "profile": args.profile,
+            "profile_settings": profile._asdict(),
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "cache": args.cache,
+            "report": args.report,
+            "ui_delays": args.ui_delays,
+            "seed": args.seed,
+            "git_rev": git_rev(),
+            "python": platform.python_version(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "requests": stats,
+        "summary": summary,
+        "runs": runs,
+    }
+    print_summary(summary)
+    for run in runs:
+        if run["error"]:
+            print(f"error in {run['query']!r}: {run['error']}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=1)
+        print(f"Results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(summary, baseline["summary"], args.tolerance)
+        if regressions:
+            print(f"\nRegressions against {args.baseline} (tolerance {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+CPU microbenchmarks of the page post-processing helpers on a page corpus.
+
+    cd agent
+    python benchmarks/bench_helpers.py [--corpus benchmarks/fixtures/laptops.json]
+        [--scale 1] [--repeat 5] [--out helpers.json]
+        [--baseline previous.json --tolerance 0.2]
+
+--corpus is a fixture file or a corpus directory recorded with
+RECORD_CORPUS=<dir> (see recorder.py). --scale repeats every page that many
+times, e.g. --scale 25 brings the synthetic fixture pages to the ~200k
+characters of real listing pages.
+
+For each helper the median time over --repeat runs is reported with its
+throughput (MB/s of page text, or products/s) and the peak memory it
+allocated, measured with tracemalloc in a separate run. With --baseline the
+script exits with status 1 when a helper got slower or allocates more than
+--tolerance above the baseline.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import tracemalloc
+import warnings
+from typing import Any, Callable, Dict, List
+
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, AGENT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Importing the agent builds the graph; keep its checkpointer off disk.
+os.environ.setdefault("CHECKPOINTER", "memory")
+warnings.filterwarnings("ignore")
+
+from fake_servers import DEFAULT_FIXTURE, load_fixture, products_from_prompt  # noqa: E402
+from url_tokens import PLACEHOLDER_BASES  # noqa: E402
+from structured_data import parse_target_structured  # noqa: E402
+from shopping_assistant import (  # noqa: E402
+    apply_url_mappings_to_products,
+    combine_products_from_sites,
+    find_target_pdps_in_html,
+    replace_urls_with_product_and_image_links,
+    retailer_of,
+)
+
+# Regressions smaller than this are noise, whatever the ratio.
+MIN_REGRESSION_S = 0.0005
+MIN_REGRESSION_KB = 64
+
+
+def timeit(fn: Callable[[], Any], repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t)
+    return statistics.median(samples)
+
+
+def peak_kb(fn: Callable[[], Any]) -> float:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def load_pages(corpus: str, scale: int) -> List[Dict[str, str]]:
+    fixture = load_fixture(corpus)
+    pages = []
+    for url, page in fixture["pages"].items():
+        retailer = retailer_of(url)
+        if retailer not in PLACEHOLDER_BASES:
+            continue
+        pages.append({"url": url, "retailer": retailer, "raw": "\n".join([page["raw_content"]] * scale)})
+    return pages
+
+
+def prepare(pages: List[Dict[str, str]], defaults: Dict[str, Any]) -> Dict[str, Any]:
+    """Tokenized pages and the products a model would extract from them."""
+    by_site: Dict[str, List[Dict[str, Any]]] = {}
+    tokenized, products = [], []
+    for page in pages:
+        product_base, image_base = PLACEHOLDER_BASES[page["retailer"]]
+        text, pairs, _, _ = replace_urls_with_product_and_image_links(page["raw"], product_base, image_base)
+        tokenized.append(text)
+        # Each page is tokenized on its own, so key the mappings by page.
+        page_products = products_from_prompt(text, defaults, limit=10 ** 6)
+        products.append((page_products, dict(pairs)))
+        by_site.setdefault(page["retailer"], []).extend(page_products)
+    return {"tokenized": tokenized, "products": products, "by_site": by_site}
+
+
+def run_benchmarks(pages: List[Dict[str, str]], defaults: Dict[str, Any], repeat: int) -> Dict[str, Dict[str, Any]]:
+    data = prepare(pages, defaults)
+    target_pages = [p for p in pages if p["retailer"] == "target.com"] or pages
+    target_tokenized = [t for p, t in zip(pages, data["tokenized"]) if p["retailer"] == "target.com"] or data["tokenized"]
+    n_products = sum(len(p) for p, _ in data["products"])
+    by_site = {site: data["by_site"].get(site, []) for site in ("target.com", "amazon.com", "ebay.com")}
+    n_site_products = sum(len(v) for v in by_site.values())
+
+    def combine():
+        random.seed(0)
+        combine_products_from_sites({site: list(v) for site, v in by_site.items()})
+
+    helpers = {
+        "replace_urls_with_product_and_image_links": (
+            lambda: [replace_urls_with_product_and_image_links(p["raw"], *PLACEHOLDER_BASES[p["retailer"]]) for p in pages],
+            sum(len(p["raw"]) for p in pages), 0,
+        ),
+        "parse_target_structured": (
+            lambda: [parse_target_structured(t) for t in target_tokenized],
+            sum(len(t) for t in target_tokenized), 0,
+        ),
+        "find_target_pdps_in_html": (
+            lambda: [find_target_pdps_in_html(p["raw"], p["url"]) for p in target_pages],
+            sum(len(p["raw"]) for p in target_pages), 0,
+        ),
+        "apply_url_mappings_to_products": (
+            lambda: [apply_url_mappings_to_products(products, mapping) for products, mapping in data["products"]],
+            0, n_products,
+        ),
+        "combine_products_from_sites": (combine, 0, n_site_products),
+    }
+
+    results = {}
+    for name, (fn, chars, products) in helpers.items():
+        fn()  # warm up
+        seconds = timeit(fn, repeat)
+        results[name] = {
+            "seconds": seconds,
+            "input_mb": chars / 1e6,
+            "mb_per_s": chars / 1e6 / seconds if chars and seconds else None,
+            "products": products,
+            "products_per_s": products / seconds if products and seconds else None,
+            "peak_kb": peak_kb(fn),
+        }
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    regressions = []
+    for name, base in baseline.items():
+        cur = results.get(name)
+        if cur is None:
+            continue
+        if cur["seconds"] > base["seconds"] * (1 + tolerance) and cur["seconds"] - base["seconds"] > MIN_REGRESSION_S:
+            regressions.append(f"{name}: {base['seconds'] * 1000:.2f} ms -> {cur['seconds'] * 1000:.2f} ms")
+        if cur["peak_kb"] > base["peak_kb"] * (1 + tolerance) and cur["peak_kb"] - base["peak_kb"] > MIN_REGRESSION_KB:
+            regressions.append(f"{name}: peak {base['peak_kb']:.0f} KB -> {cur['peak_kb']:.0f} KB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=DEFAULT_FIXTURE, help="fixture file or recorded corpus directory")
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    pages = load_pages(args.corpus, args.scale)
+    defaults = load_fixture(DEFAULT_FIXTURE)["llm"]["product_defaults"]
+    total_mb = sum(len(p["raw"]) for p in pages) / 1e6
+    print(f"{len(pages)} pages, {total_mb:.2f} MB (largest {max(len(p['raw']) for p in pages) / 1e3:.0f}k chars)")
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")  # the helpers print progress
+    try:
+        results = run_benchmarks(pages, defaults, args.repeat)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    print(f"{'helper':<44}{'time':>10}{'MB/s':>9}{'products/s':>13}{'peak':>10}")
+    for name, r in results.items():
+        mbps = f"{r['mb_per_s']:.1f}" if r["mb_per_s"] else "-"
+        pps = f"{r['products_per_s']:.0f}" if r["products_per_s"] else "-"
+        print(f"{name:<44}{r['seconds'] * 1000:>8.2f}ms{mbps:>9}{pps:>13}{r['peak_kb']:>8.0f}KB")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "meta": {
+                    "corpus": args.corpus,
+                    "pages": len(pages),
+                    "scale": args.scale,
+                    "repeat": args.repeat,
+                    "python": platform.python_version(),
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                },
+                "helpers": results,
+            }, f, indent=1)
+        print(f"Results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["helpers"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions against {args.baseline} (tolerance {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
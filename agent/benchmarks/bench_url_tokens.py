@@ -0,0 +1,116 @@
+"""
+Microbenchmarks for URL tokenization and placeholder restore on large pages.
+
+    cd agent
+    python benchmarks/bench_url_tokens.py [--chars 200000] [--repeat 5]
+
+Compares the UrlTokenizer/dict based restore with the linear scan that
+apply_url_mappings_to_products used to do over the mappings list.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from url_tokens import SearchUrlIndex, PLACEHOLDER_BASES  # noqa: E402
+
+
+def make_page(chars: int, seed: int = 0) -> str:
+    """Synthetic listing markdown, roughly one URL every ~90 characters."""
+    rnd = random.Random(seed)
+    parts = []
+    size = 0
+    i = 0
+    while size < chars:
+        i += 1
+        n = rnd.randint(1, 4000)
+        if i % 3 == 0:
+            part = f"![image](https://m.media-amazon.com/images/I/{n:06d}._AC_UL320_.jpg) "
+        elif i % 3 == 1:
+            part = f"[Product {n} with a long descriptive title](https://www.amazon.com/Item-{n}/dp/B0{n:08d}?ref=sr_1_{i}), "
+        else:
+            part = f"$ {n % 900 + 9}.99 4.{n % 10} out of 5 stars ({n} ratings)\n"
+        parts.append(part)
+        size += len(part)
+    return "".join(parts)
+
+
+def timeit(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t)
+    return statistics.median(samples)
+
+
+def legacy_restore(products, mappings):
+    out = []
+    for product in products:
+        p = product.copy()
+        mapping = next((m for m in mappings if p["product_url"] in m), None)
+        if mapping:
+            p["product_url"] = mapping[1]
+        if p["image_urls"]:
+            mapping = next((m for m in mappings if p["image_urls"][0] in m), None)
+            p["image_urls"] = [mapping[1]] if mapping else []
+        out.append(p)
+    return out
+
+
+def dict_restore(products, to_original):
+    out = []
+    for product in products:
+        p = product.copy()
+        p["product_url"] = to_original.get(p["product_url"], p["product_url"])
+        p["image_urls"] = [to_original.get(u, u) for u in p["image_urls"]]
+        out.append(p)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chars", type=int, default=200000)
+    parser.add_argument("--pages", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pages = [make_page(args.chars, seed) for seed in range(args.pages)]
+    total_mb = sum(len(p) for p in pages) / 1e6
+
+    def tokenize_all():
+        index = SearchUrlIndex()
+        tokenizer = index.tokenizer("amazon.com")
+        return index, [tokenizer.tokenize(p) for p in pages]
+
+    t_tokenize = timeit(tokenize_all, args.repeat)
+    index, tokenized = tokenize_all()
+    print(f"tokenize      {args.pages} x {args.chars} chars: {t_tokenize * 1000:8.1f} ms  ({total_mb / t_tokenize:6.1f} MB/s)")
+
+    page = tokenized[-1]
+    t_local = timeit(lambda: page.to_global(page.local_text), args.repeat)
+    print(f"to_global     1 page:                 {t_local * 1000:8.1f} ms")
+
+    product_base, image_base = PLACEHOLDER_BASES["amazon.com"]
+    placeholders = list(index.to_original)
+    products = [
+        {
+            "product_url": product_base.format(i + 1),
+            "image_urls": [image_base.format(i + 1), image_base.format(i + 2)],
+        }
+        for i in range(0, min(len(placeholders) // 2, 200))
+    ]
+    mappings = [[k, v] for k, v in index.to_original.items()]
+    t_legacy = timeit(lambda: legacy_restore(products, mappings), args.repeat)
+    t_dict = timeit(lambda: dict_restore(products, index.to_original), args.repeat)
+    print(f"restore       {len(products)} products, {len(mappings)} mappings")
+    print(f"  linear scan:                        {t_legacy * 1000:8.2f} ms")
+    print(f"  index:                              {t_dict * 1000:8.2f} ms  ({t_legacy / max(t_dict, 1e-9):.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+"""
+Local stand-ins for the Tavily and OpenAI APIs used by the benchmarks.
+
+Both replay a fixture file (see fixtures/laptops.json) or a corpus
+directory recorded with RECORD_CORPUS (see recorder.py):
+
+    search       retailer -> result URLs, returned by /search for include_domains
+    pages        URL -> {"raw_content", "images"}, returned by /extract
+    completions  recorded model completions by completion_key (corpus only)
+    llm          canned model answers: the classification reply, the chat
+                 name, defaults for the review fields of extracted products
+                 and a report skeleton
+
+A chat request whose messages match a recorded completion gets that
+completion back, with its URL placeholders mapped onto the request's.
+Otherwise extraction completions are built from the prompt itself: every
+markdown link `[title](placeholder)` becomes a product with the image and
+price placeholders that follow it, so the agent's URL restore and validation
+run on real placeholders. Latency, streaming speed and error rates come from
+a Profile.
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import asyncio
+import multiprocessing
+import urllib.request
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.requests import ClientDisconnect
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recorder import CORPUS_VERSION, PLACEHOLDER_RE, completion_key  # noqa: E402
+
+DEFAULT_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "laptops.json")
+
+
+class Profile(NamedTuple):
+    """
+    Latencies are (mean, jitter) in seconds, drawn from a normal
+    distribution clipped at 0. `llm_chars_per_s` paces streamed and
+    non-streamed completions (0 = instant); streamed ones arrive in chunks
+    of `llm_chunk_chars`. Error rates are the share of requests answered
+    with a 429 or 500.
+    """
+    search: Tuple[float, float] = (0.0, 0.0)
+    extract: Tuple[float, float] = (0.0, 0.0)
+    llm_first_token: Tuple[float, float] = (0.0, 0.0)
+    llm_chars_per_s: float = 0.0
+    llm_chunk_chars: int = 16
+    search_error_rate: float = 0.0
+    extract_error_rate: float = 0.0
+    llm_error_rate: float = 0.0
+
+
+PROFILES = {
+    "instant": Profile(),
+    "realistic": Profile(
+        search=(1.5, 0.5),
+        extract=(4.0, 1.5),
+        llm_first_token=(0.8, 0.3),
+        llm_chars_per_s=400.0,
+    ),
+    "flaky": Profile(
+        search=(1.5, 0.5),
+        extract=(4.0, 1.5),
+        llm_first_token=(0.8, 0.3),
+        llm_chars_per_s=400.0,
+        search_error_rate=0.05,
+        extract_error_rate=0.05,
+        llm_error_rate=0.03,
+    ),
+}
+
+
+def load_profile(name_or_path: str) -> Profile:
+    """A built-in profile by name, or one read from a JSON file of Profile fields."""
+    if name_or_path in PROFILES:
+        return PROFILES[name_or_path]
+    with open(name_or_path) as f:
+        fields = json.load(f)
+    return Profile(**{k: tuple(v) if isinstance(v, list) else v for k, v in fields.items()})
+
+
+def load_fixture(path: str) -> Dict[str, Any]:
+    """A fixture file, or a recorded corpus directory in the same shape."""
+    if os.path.isdir(path):
+        return load_corpus(path)
+    with open(path) as f:
+        fixture = json.load(f)
+    if fixture.get("version") != 1:
+        raise ValueError(f"Unsupported fixture version in {path}: {fixture.get('version')}")
+    return fixture
+
+
+def _read_dir(path: str) -> List[Dict[str, Any]]:
+    items = []
+    for name in sorted(os.listdir(path)) if os.path.isdir(path) else []:
+        if name.endswith(".json"):
+            with open(os.path.join(path, name)) as f:
+                items.append((name[:-5], json.load(f)))
+    return items
+
+
+def load_corpus(root: str) -> Dict[str, Any]:
+    with open(os.path.join(root, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != CORPUS_VERSION:
+        raise ValueError(f"Unsupported corpus version in {root}: {manifest.get('version')}")
+    with open(DEFAULT_FIXTURE) as f:
+        canned = json.load(f)["llm"]
+    return {
+        "version": 1,
+        "description": f"Corpus recorded {manifest.get('created', '')} in {root}",
+        "queries": manifest["queries"],
+        "search": manifest["search"],
+        "pages": {page["url"]: page for _, page in _read_dir(os.path.join(root, "pages"))},
+        "completions": dict(_read_dir(os.path.join(root, "completions"))),
+        "llm": {**canned, **manifest.get("llm", {})},
+    }
+
+
+LINK_RE = re.compile(r"\[([^\]\[]{12,300})\]\((https://(?:amzn|tgt|ebay)\.com/url\d+)\)")
+IMAGE_RE = re.compile(r"https://(?:amzn|tgt|ebay)\.com/img/url\d+")
+PRICE_RE = re.compile(r"\$\s?(\d[\d,]*\.\d{2})")
+
+
+def products_from_prompt(prompt: str, defaults: Dict[str, Any], limit: int = 20) -> List[Dict[str, Any]]:
+    """What a model would extract from a tokenized page: one product per titled link."""
+    detail = "PRODUCT DETAIL PAGE" in prompt
+    products, seen = [], set()
+    links = list(LINK_RE.finditer(prompt))
+    for i, m in enumerate(links):
+        title, url = m.group(1).strip(), m.group(2)
+        if url in seen or title.startswith("!"):
+            continue
+        seen.add(url)
+        end = links[i + 1].start() if i + 1 < len(links) else len(prompt)
+        window = prompt[max(0, m.start() - 300):end]
+        price = PRICE_RE.search(prompt, m.end(), end)
+        price_text = f"${price.group(1)}" if price else "$0.00"
+        products.append({
+            "title": title,
+            "product_url": url,
+            "image_urls": IMAGE_RE.findall(window)[:2],
+            "price_text": price_text,
+            "price_value": float(price_text[1:].replace(",", "")),
+            "price_currency": "USD",
+            **defaults,
+        })
+        if len(products) >= (1 if detail else limit):
+            break
+    return products
+
+
+class FakeServers:
+    """
+    Runs the Tavily and OpenAI stand-ins on 127.0.0.1 in a child process,
+    so serving them takes neither event loop time nor the GIL from the
+    agent being measured. `request_stats()` counts requests per endpoint.
+    """
+
+    def __init__(self, fixture: Dict[str, Any], profile: Profile, seed: int = 0):
+        self.fixture = fixture
+        self.profile = profile
+        self.rnd = random.Random(seed)
+        self.stats: Dict[str, int] = {}
+        self.tavily_url = ""
+        self.openai_url = ""
+        self._process: Optional[multiprocessing.Process] = None
+
+    # -- shared -----------------------------------------------------------
+
+    def _count(self, key: str) -> None:
+        self.stats[key] = self.stats.get(key, 0) + 1
+
+    async def _delay(self, latency: Tuple[float, float]) -> None:
+        mean, jitter = latency
+        wait = max(0.0, self.rnd.gauss(mean, jitter)) if mean or jitter else 0.0
+        if wait:
+            await asyncio.sleep(wait)
+
+    def _fails(self, rate: float) -> Optional[JSONResponse]:
+        if rate <= 0 or self.rnd.random() >= rate:
+            return None
+        status = self.rnd.choice([429, 500])
+        self._count(f"error_{status}")
+        return JSONResponse({"detail": {"error": "injected failure"}, "error": {"message": "injected failure", "type": "server_error"}},
+                            status_code=status, headers={"retry-after-ms": "200"})
+
+    # -- Tavily -----------------------------------------------------------
+
+    def tavily_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.get("/_stats")
+        async def stats():
+            return self.stats
+
+        @app.post("/search")
+        async def search(request: Request):
+            body = await request.json()
+            self._count("tavily_search")
+            await self._delay(self.profile.search)
+            failure = self._fails(self.profile.search_error_rate)
+            if failure is not None:
+                return failure
+            urls = []
+            for domain in body.get("include_domains") or list(self.fixture["search"]):
+                urls += self.fixture["search"].get(domain, [])
+            urls = urls[: body.get("max_results") or 5]
+            return {
+                "query": body.get("query"),
+                "results": [{"url": u, "title": u, "content": "", "score": 0.9} for u in urls],
+                "response_time": 0.0,
+            }
+
+        @app.post("/extract")
+        async def extract(request: Request):
+            body = await request.json()
+            self._count("tavily_extract")
+            await self._delay(self.profile.extract)
+            failure = self._fails(self.profile.extract_error_rate)
+            if failure is not None:
+                return failure
+            results, failed = [], []
+            for url in body.get("urls") or []:
+                page = self.fixture["pages"].get(url)
+                if page is None:
+                    failed.append({"url": url, "error": "not in fixture"})
+                else:
+                    results.append({"url": url, "raw_content": page["raw_content"], "images": page.get("images", [])})
+            return {"results": results, "failed_results": failed, "response_time": 0.0}
+
+        return app
+
+    # -- OpenAI -----------------------------------------------------------
+
+    def recorded_completion(self, model: str, messages: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """The recorded completion for this request, on this request's placeholders."""
+        completions = self.fixture.get("completions")
+        if not completions:
+            return None
+        key, mapping = completion_key(model, messages)
+        recorded = completions.get(key)
+        if recorded is None:
+            return None
+        original = {normalized: placeholder for placeholder, normalized in mapping.items()}
+        content = PLACEHOLDER_RE.sub(lambda m: original.get(m.group(0), m.group(0)), recorded.get("content") or "")
+        return {**recorded, "content": content}
+
+    def completion_for(self, messages: List[Dict[str, Any]]) -> Tuple[str, str]:
+        """(call site, completion text) for a chat request."""
+        def text(m):
+            c = m.get("content")
+            return c if isinstance(c, str) else json.dumps(c)
+
+        first = text(messages[0]) if messages else ""
+        last = text(messages[-1]) if messages else ""
+        llm = self.fixture["llm"]
+        if first.startswith("You are a precise web data extractor"):
+            return "extract", json.dumps({"products": products_from_prompt(last, llm["product_defaults"])}, separators=(",", ":"))
+        if first.startswith("You are a product review analyst"):
+            m = re.search(r"PRODUCTS:\n(.*?)\n\nRAW_WEB_PAGE:", last, re.S)
+            items = json.loads(m.group(1)) if m else []
+            review = {k: llm["product_defaults"][k] for k in llm["product_defaults"] if k not in ("availability",)}
+            return "enrich", json.dumps({"products": [{"index": p["index"], **review} for p in items]}, separators=(",", ":"))
+        if first.startswith("You are a Products report generator"):
+            titles = [p.get("title", "") for p in json.loads(last)] if last.startswith("[") else []
+            report = json.loads(json.dumps(llm["report"]))
+            for i, section in enumerate(("top_pick", "best_performance", "best_value_for_money")):
+                if titles:
+                    report[section]["name"] = titles[i % len(titles)]
+            report["products_specifications"] = [{"name": t, "specifications": {"processor": "-", "ram": "-", "storage": "-", "display": "-", "battery": "-"}} for t in titles]
+            return "report", json.dumps(report)
+        if "name generator" in first:
+            return "chat_name", llm["chat_name"]
+        return "classification", llm["classification"]
+
+    def openai_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.post("/v1/chat/completions")
+        async def chat_completions(request: Request):
+            try:
+                body = await request.json()
+            except ClientDisconnect:
+                return Response(status_code=499)
+            site, content = self.completion_for(body.get("messages") or [])
+            self._count(f"openai_{site}")
+            recorded = self.recorded_completion(body.get("model", ""), body.get("messages") or [])
+            tool_calls = None
+            if recorded is not None:
+                self._count("openai_replayed")
+                content, tool_calls = recorded["content"], recorded.get("tool_calls")
+            await self._delay(self.profile.llm_first_token)
+            failure = self._fails(self.profile.llm_error_rate)
+            if failure is not None:
+                return failure
+            cid = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+            model = body.get("model", "gpt-4o-mini")
+            usage = {
+                "prompt_tokens": sum(len(json.dumps(m.get("content"))) for m in body.get("messages") or []) // 4,
+                "completion_tokens": len(content) // 4,
+            }
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            cps = self.profile.llm_chars_per_s
+            if not body.get("stream"):
+                if cps:
+                    await asyncio.sleep(len(content) / cps)
+                message = {"role": "assistant", "content": content}
+                if tool_calls:
+                    message["tool_calls"] = tool_calls
+                return {
+                    "id": cid, "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+                    "usage": usage,
+                }
+
+            include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+            async def events():
+                def chunk(delta, finish=None):
+                    return "data: " + json.dumps({
+                        "id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+                    }) + "\n\n"
+
+                yield chunk({"role": "assistant", "content": ""})
+                step = max(1, self.profile.llm_chunk_chars)
+                for i in range(0, len(content), step):
+                    if cps:
+                        await asyncio.sleep(step / cps)
+                    if await request.is_disconnected():
+                        # The agent stopped reading, e.g. its page quota was met.
+                        return
+                    yield chunk({"content": content[i:i + step]})
+                yield chunk({}, "stop")
+                if include_usage:
+                    yield "data: " + json.dumps({
+                        "id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                        "choices": [], "usage": usage,
+                    }) + "\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        return app
+
+    # -- lifecycle --------------------------------------------------------
+
+    async def _serve_forever(self, tavily_port: int, openai_port: int) -> None:
+        apps = ((self.tavily_app(), tavily_port), (self.openai_app(), openai_port))
+        await asyncio.gather(*(
+            uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off")).serve()
+            for app, port in apps
+        ))
+
+    def _run(self, tavily_port: int, openai_port: int) -> None:
+        asyncio.run(self._serve_forever(tavily_port, openai_port))
+
+    def start(self, timeout: float = 10.0) -> "FakeServers":
+        tavily_port, openai_port = _free_port(), _free_port()
+        self._process = multiprocessing.Process(target=self._run, args=(tavily_port, openai_port), daemon=True)
+        self._process.start()
+        deadline = time.monotonic() + timeout
+        for port in (tavily_port, openai_port):
+            while True:
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline or not self._process.is_alive():
+                        self.stop()
+                        raise RuntimeError("Fake API servers did not start")
+                    time.sleep(0.05)
+        self.tavily_url = f"http://127.0.0.1:{tavily_port}"
+        self.openai_url = f"http://127.0.0.1:{openai_port}/v1"
+        return self
+
+    def request_stats(self) -> Dict[str, int]:
+        """Requests served so far, per endpoint and call site."""
+        with urllib.request.urlopen(f"{self.tavily_url}/_stats", timeout=5) as response:
+            return json.load(response)
+
+    def stop(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(timeout=5)
+            self._process = None
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
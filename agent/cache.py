@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+CACHE_DIR = os.getenv("AGENT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+CACHE_DB_PATH = os.path.join(CACHE_DIR, "agent_cache.sqlite3")
+
+
+def content_key(*parts: Any) -> str:
+    """
+    Stable sha256 key for any JSON-serializable parts.
+    """
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class TieredCache:
+    """
+    Two-tier cache: a bounded in-memory LRU in front of a SQLite table that
+    every worker process on the host shares.
+    Entries expire after `ttl` seconds. The memory tier is bounded by entry
+    count and bytes, the disk tier by bytes, both evicting least recently
+    used entries first. A `ttl` of 0 disables the cache.
+    Values returned from the memory tier are shared; treat them as read-only.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl: float,
+        max_memory_entries: int = 256,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        max_disk_bytes: int = 512 * 1024 * 1024,
+        path: str = CACHE_DB_PATH,
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, Tuple[float, int, Any]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writes_since_trim = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    # ---- memory tier -------------------------------------------------------
+
+    def _memory_get(self, key: str) -> Optional[Any]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if expires_at < time.time():
+            self._memory_pop(key)
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_pop(self, key: str) -> None:
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry[1]
+
+    def _memory_set(self, key: str, value: Any, size: int, expires_at: float) -> None:
+        self._memory_pop(key)
+        self._memory[key] = (expires_at, size, value)
+        self._memory_bytes += size
+        while self._memory and (
+            len(self._memory) > self.max_memory_entries or self._memory_bytes > self.max_memory_bytes
+        ):
+            oldest = next(iter(self._memory))
+            self._memory_pop(oldest)
+
+    # ---- disk tier ---------------------------------------------------------
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, accessed_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _disk_get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                db.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+                db.commit()
+                return None
+            db.execute(
+                "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key),
+            )
+            db.commit()
+            return row[0], row[1]
+
+    def _disk_set(self, key: str, blob: bytes, expires_at: float) -> None:
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.namespace, key, blob, len(blob), expires_at, time.time()),
+            )
+            db.commit()
+            self._writes_since_trim += 1
+            if self._writes_since_trim >= 50:
+                self._writes_since_trim = 0
+                self._trim_disk(db)
+
+    def _trim_disk(self, db: sqlite3.Connection) -> None:
+        """
+        Drop expired rows, then least recently used rows until the
+        namespace fits in max_disk_bytes.
+        """
+        db.execute("DELETE FROM cache WHERE namespace = ? AND expires_at < ?", (self.namespace, time.time()))
+        total = 0
+        stale = []
+        for key, size in db.execute(
+            "SELECT key, size FROM cache WHERE namespace = ? ORDER BY accessed_at DESC",
+            (self.namespace,),
+        ):
+            total += size
+            if total > self.max_disk_bytes:
+                stale.append((self.namespace, key))
+        db.executemany("DELETE FROM cache WHERE namespace = ? AND key = ?", stale)
+        db.commit()
+
+    # ---- public API --------------------------------------------------------
+
+    async def get(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        value = self._memory_get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        try:
+            row = await asyncio.to_thread(self._disk_get, key)
+        except Exception as e:
+            print(f"Cache read failed for {self.namespace}: {e}")
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        blob, expires_at = row
+        value = json.loads(blob)
+        self._memory_set(key, value, len(blob), expires_at)
+        self.hits += 1
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        if not self.enabled:
+            return
+        blob = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        expires_at = time.time() + self.ttl
+        self._memory_set(key, value, len(blob), expires_at)
+        try:
+            await asyncio.to_thread(self._disk_set, key, blob, expires_at)
+        except Exception as e:
+            print(f"Cache write failed for {self.namespace}: {e}")
+
+
+extract_cache = TieredCache(
+    "tavily_extract",
+    ttl=float(os.getenv("EXTRACT_CACHE_TTL", str(6 * 60 * 60))),
+    max_memory_entries=int(os.getenv("EXTRACT_CACHE_MEMORY_ENTRIES", "256")),
+    max_disk_bytes=int(os.getenv("EXTRACT_CACHE_DISK_MB", "512")) * 1024 * 1024,
+)
+
+structured_cache = TieredCache(
+    "structured_products",
+    ttl=float(os.getenv("STRUCTURED_CACHE_TTL", str(24 * 60 * 60))),
+    max_memory_entries=int(os.getenv("STRUCTURED_CACHE_MEMORY_ENTRIES", "1024")),
+    max_disk_bytes=int(os.getenv("STRUCTURED_CACHE_DISK_MB", "128")) * 1024 * 1024,
+)
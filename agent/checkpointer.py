@@ -0,0 +1,478 @@
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.memory import MemorySaver
+
+from cache import CACHE_DIR
+
+# "sqlite" (default) or "memory" for the old in-process MemorySaver.
+CHECKPOINTER = os.getenv("CHECKPOINTER", "sqlite")
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB", os.path.join(CACHE_DIR, "checkpoints.sqlite3"))
+# Checkpoints kept per thread. Older ones are compacted away; regenerating
+# a message needs the checkpoint before it, so keep a few turns' worth.
+CHECKPOINT_KEEP = int(os.getenv("CHECKPOINT_KEEP", "24"))
+# Threads idle for longer than this are deleted (0 = keep forever).
+CHECKPOINT_TTL = float(os.getenv("CHECKPOINT_TTL", str(7 * 24 * 60 * 60)))
+# Latest checkpoint of the most recently used threads, kept serialized.
+CHECKPOINT_CACHE_THREADS = int(os.getenv("CHECKPOINT_CACHE_THREADS", "128"))
+CHECKPOINT_CACHE_MB = int(os.getenv("CHECKPOINT_CACHE_MB", "64"))
+# Expired-thread sweeps run once per this many checkpoint writes.
+SWEEP_EVERY = 200
+
+Typed = Tuple[str, bytes]
+
+
+class _HotThread:
+    """Serialized latest checkpoint of one (thread, namespace)."""
+
+    __slots__ = ("checkpoint_id", "parent_id", "checkpoint", "metadata", "blobs", "writes", "size")
+
+    def __init__(self, checkpoint_id: str, parent_id: Optional[str], checkpoint: Typed, metadata: Typed,
+                 blobs: Dict[str, Typed], writes: List[Tuple[str, str, Typed]]):
+        self.checkpoint_id = checkpoint_id
+        self.parent_id = parent_id
+        self.checkpoint = checkpoint
+        self.metadata = metadata
+        self.blobs = blobs
+        self.writes = writes
+        self.size = len(checkpoint[1]) + len(metadata[1]) + sum(len(b[1]) for b in blobs.values()) + sum(len(w[2][1]) for w in writes)
+
+
+class SqliteCheckpointer(BaseCheckpointSaver[str]):
+    """
+    LangGraph checkpointer on a SQLite (WAL) file shared by every worker
+    on the host, replacing the unbounded in-process MemorySaver.
+    Channel values are stored once per version, as MemorySaver does, so a
+    checkpoint only writes the channels that changed. Each thread keeps its
+    newest `keep` checkpoints; threads idle for `ttl` seconds are deleted.
+    The latest checkpoint of recently used threads stays in a bounded
+    in-memory LRU, checked against the database on every read so another
+    worker's writes are never masked.
+    """
+
+    def __init__(
+        self,
+        path: str = CHECKPOINT_DB_PATH,
+        keep: int = CHECKPOINT_KEEP,
+        ttl: float = CHECKPOINT_TTL,
+        max_cached_threads: int = CHECKPOINT_CACHE_THREADS,
+        max_cache_bytes: int = CHECKPOINT_CACHE_MB * 1024 * 1024,
+    ):
+        super().__init__()
+        self.path = path
+        self.keep = max(keep, 2)
+        self.ttl = ttl
+        self.max_cached_threads = max_cached_threads
+        self.max_cache_bytes = max_cache_bytes
+        self._hot: "OrderedDict[Tuple[str, str], _HotThread]" = OrderedDict()
+        self._hot_bytes = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self._puts_since_sweep = 0
+
+    # ---- storage -----------------------------------------------------------
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    thread_id TEXT NOT NULL,
+                    checkpoint_ns TEXT NOT NULL,
+                    checkpoint_id TEXT NOT NULL,
+                    parent_checkpoint_id TEXT,
+                    type TEXT NOT NULL,
+                    checkpoint BLOB NOT NULL,
+                    metadata_type TEXT NOT NULL,
+                    metadata BLOB NOT NULL,
+                    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+                );
+                CREATE TABLE IF NOT EXISTS blobs (
+                    thread_id TEXT NOT NULL,
+                    checkpoint_ns TEXT NOT NULL,
+                    channel TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    blob BLOB,
+                    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+                );
+                CREATE TABLE IF NOT EXISTS writes (
+                    thread_id TEXT NOT NULL,
+                    checkpoint_ns TEXT NOT NULL,
+                    checkpoint_id TEXT NOT NULL,
+                    task_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    channel TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    value BLOB,
+                    task_path TEXT NOT NULL DEFAULT '',
+                    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+                );
+                CREATE TABLE IF NOT EXISTS threads (
+                    thread_id TEXT PRIMARY KEY,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS threads_updated ON threads (updated_at);
+                """
+            )
+            conn.commit()
+            self._conn = conn
+            self._sweep(conn)
+        return self._conn
+
+    def _sweep(self, db: sqlite3.Connection) -> None:
+        """Delete threads idle for longer than the TTL."""
+        if self.ttl <= 0:
+            return
+        expired = [r[0] for r in db.execute("SELECT thread_id FROM threads WHERE updated_at < ?", (time.time() - self.ttl,))]
+        for thread_id in expired:
+            self._delete_thread(db, thread_id)
+        db.commit()
+        if expired:
+            print(f"Checkpointer evicted {len(expired)} idle threads")
+
+    def _delete_thread(self, db: sqlite3.Connection, thread_id: str) -> None:
+        for table in ("checkpoints", "blobs", "writes", "threads"):
+            db.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+        for key in [k for k in self._hot if k[0] == thread_id]:
+            self._hot_pop(key)
+
+    def _compact(self, db: sqlite3.Connection, thread_id: str, checkpoint_ns: str) -> None:
+        """
+        Keep the newest `keep` checkpoints of a thread, their writes and the
+        channel versions they reference. Runs once the thread is half a
+        window over the limit, so the cost is amortized.
+        """
+        ids = [r[0] for r in db.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC",
+            (thread_id, checkpoint_ns),
+        )]
+        if len(ids) <= self.keep + self.keep // 2:
+            return
+        oldest_kept = ids[self.keep - 1]
+        db.execute(
+            "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+            (thread_id, checkpoint_ns, oldest_kept),
+        )
+        db.execute(
+            "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+            (thread_id, checkpoint_ns, oldest_kept),
+        )
+        referenced = set()
+        for ctype, blob in db.execute(
+            "SELECT type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?",
+            (thread_id, checkpoint_ns),
+        ):
+            for channel, version in self.serde.loads_typed((ctype, blob))["channel_versions"].items():
+                referenced.add((channel, str(version)))
+        stale = [
+            (thread_id, checkpoint_ns, channel, version)
+            for channel, version in db.execute(
+                "SELECT channel, version FROM blobs WHERE thread_id = ? AND checkpoint_ns = ?",
+                (thread_id, checkpoint_ns),
+            )
+            if (channel, version) not in referenced
+        ]
+        db.executemany(
+            "DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+            stale,
+        )
+
+    # ---- hot thread cache --------------------------------------------------
+
+    def _hot_pop(self, key: Tuple[str, str]) -> None:
+        entry = self._hot.pop(key, None)
+        if entry is not None:
+            self._hot_bytes -= entry.size
+
+    def _hot_set(self, key: Tuple[str, str], entry: _HotThread) -> None:
+        self._hot_pop(key)
+        if entry.size > self.max_cache_bytes:
+            return
+        self._hot[key] = entry
+        self._hot_bytes += entry.size
+        while self._hot and (len(self._hot) > self.max_cached_threads or self._hot_bytes > self.max_cache_bytes):
+            self._hot_pop(next(iter(self._hot)))
+
+    def _load_hot(self, db: sqlite3.Connection, thread_id: str, checkpoint_ns: str, checkpoint_id: Optional[str]) -> Optional[_HotThread]:
+        """
+        Serialized checkpoint `checkpoint_id` (the latest when None), served
+        from the cache when it is still the latest one in the database.
+        """
+        key = (thread_id, checkpoint_ns)
+        latest, n_writes = db.execute(
+            "SELECT (SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ?1 AND checkpoint_ns = ?2), "
+            "(SELECT COUNT(*) FROM writes WHERE thread_id = ?1 AND checkpoint_ns = ?2 AND checkpoint_id = "
+            "(SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ?1 AND checkpoint_ns = ?2))",
+            (thread_id, checkpoint_ns),
+        ).fetchone()
+        if latest is None:
+            return None
+        wanted = checkpoint_id or latest
+        hot = self._hot.get(key)
+        if hot is not None and hot.checkpoint_id == latest and len(hot.writes) == n_writes:
+            self._hot.move_to_end(key)
+            if hot.checkpoint_id == wanted:
+                return hot
+        row = db.execute(
+            "SELECT parent_checkpoint_id, type, checkpoint, metadata_type, metadata FROM checkpoints "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            (thread_id, checkpoint_ns, wanted),
+        ).fetchone()
+        if row is None:
+            return None
+        entry = self._assemble(db, thread_id, checkpoint_ns, wanted, row)
+        if wanted == latest:
+            self._hot_set(key, entry)
+        return entry
+
+    def _assemble(self, db: sqlite3.Connection, thread_id: str, checkpoint_ns: str, checkpoint_id: str, row: Sequence[Any]) -> _HotThread:
+        parent_id, ctype, cblob, mtype, mblob = row
+        versions = self.serde.loads_typed((ctype, cblob))["channel_versions"]
+        blobs: Dict[str, Typed] = {}
+        for channel, version in versions.items():
+            b = db.execute(
+                "SELECT type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, str(version)),
+            ).fetchone()
+            if b is not None and b[0] != "empty":
+                blobs[channel] = (b[0], b[1])
+        writes = [
+            (task_id, channel, (wtype, value))
+            for task_id, channel, wtype, value in db.execute(
+                "SELECT task_id, channel, type, value FROM writes "
+                "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+                (thread_id, checkpoint_ns, checkpoint_id),
+            )
+        ]
+        return _HotThread(checkpoint_id, parent_id, (ctype, cblob), (mtype, mblob), blobs, writes)
+
+    def _tuple(self, thread_id: str, checkpoint_ns: str, entry: _HotThread) -> CheckpointTuple:
+        checkpoint = self.serde.loads_typed(entry.checkpoint)
+        checkpoint["channel_values"] = {k: self.serde.loads_typed(v) for k, v in entry.blobs.items()}
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": entry.checkpoint_id}},
+            checkpoint=checkpoint,
+            metadata=self.serde.loads_typed(entry.metadata),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": entry.parent_id}}
+                if entry.parent_id
+                else None
+            ),
+            pending_writes=[(task_id, channel, self.serde.loads_typed(v)) for task_id, channel, v in entry.writes],
+        )
+
+    # ---- BaseCheckpointSaver -----------------------------------------------
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with self._lock:
+            entry = self._load_hot(self._db(), thread_id, checkpoint_ns, get_checkpoint_id(config))
+        if entry is None:
+            return None
+        return self._tuple(thread_id, checkpoint_ns, entry)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        query = "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata FROM checkpoints"
+        where, params = [], []
+        if config:
+            where.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                where.append("checkpoint_ns = ?")
+                params.append(config["configurable"]["checkpoint_ns"])
+            if get_checkpoint_id(config):
+                where.append("checkpoint_id = ?")
+                params.append(get_checkpoint_id(config))
+        if before and get_checkpoint_id(before):
+            where.append("checkpoint_id < ?")
+            params.append(get_checkpoint_id(before))
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY checkpoint_id DESC"
+        with self._lock:
+            db = self._db()
+            rows = db.execute(query, params).fetchall()
+            entries = []
+            for thread_id, checkpoint_ns, checkpoint_id, *row in rows:
+                if filter:
+                    metadata = self.serde.loads_typed((row[3], row[4]))
+                    if not all(metadata.get(k) == v for k, v in filter.items()):
+                        continue
+                if limit is not None and len(entries) >= limit:
+                    break
+                entries.append((thread_id, checkpoint_ns, self._assemble(db, thread_id, checkpoint_ns, checkpoint_id, row)))
+        for thread_id, checkpoint_ns, entry in entries:
+            yield self._tuple(thread_id, checkpoint_ns, entry)
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        parent_id = config["configurable"].get("checkpoint_id")
+        c = checkpoint.copy()
+        values: Dict[str, Any] = c.pop("channel_values")  # type: ignore[misc]
+        new_blobs = {
+            k: self.serde.dumps_typed(values[k]) if k in values else ("empty", b"")
+            for k in new_versions
+        }
+        ctyped = self.serde.dumps_typed(c)
+        mtyped = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        key = (thread_id, checkpoint_ns)
+        with self._lock:
+            db = self._db()
+            db.executemany(
+                "INSERT OR REPLACE INTO blobs (thread_id, checkpoint_ns, channel, version, type, blob) VALUES (?, ?, ?, ?, ?, ?)",
+                [(thread_id, checkpoint_ns, k, str(v), *new_blobs[k]) for k, v in new_versions.items()],
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], parent_id, *ctyped, *mtyped),
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO threads (thread_id, updated_at) VALUES (?, ?)",
+                (thread_id, time.time()),
+            )
+            self._compact(db, thread_id, checkpoint_ns)
+            db.commit()
+
+            # The new checkpoint becomes the thread's hot entry, reusing the
+            # unchanged channel blobs of the previous one when it is cached.
+            previous = self._hot.get(key)
+            if previous is not None and previous.checkpoint_id == parent_id:
+                blobs = {
+                    k: new_blobs[k] if k in new_blobs else previous.blobs.get(k)
+                    for k in c["channel_versions"]
+                }
+                blobs = {k: v for k, v in blobs.items() if v is not None and v[0] != "empty"}
+                self._hot_set(key, _HotThread(checkpoint["id"], parent_id, ctyped, mtyped, blobs, []))
+            else:
+                self._hot_pop(key)
+
+            self._puts_since_sweep += 1
+            if self._puts_since_sweep >= SWEEP_EVERY:
+                self._puts_since_sweep = 0
+                self._sweep(db)
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            rows.append((thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel, *self.serde.dumps_typed(value), task_path))
+        # Special channels (errors, interrupts...) overwrite; regular writes
+        # of a task are only recorded once.
+        sql = ("INSERT OR {} INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path) "
+               "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+        with self._lock:
+            db = self._db()
+            db.executemany(sql.format("REPLACE"), [r for r in rows if r[4] < 0])
+            db.executemany(sql.format("IGNORE"), [r for r in rows if r[4] >= 0])
+            db.commit()
+            # Cheaper to reload the writes on the next read than to merge.
+            self._hot_pop((thread_id, checkpoint_ns))
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            db = self._db()
+            self._delete_thread(db, thread_id)
+            db.commit()
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        # Same zero-padded string versions as MemorySaver, so they sort as text.
+        return MemorySaver.get_next_version(self, current, channel)
+
+    def ping(self) -> None:
+        """Open the database and run a read; raises when it is unusable."""
+        with self._lock:
+            self._db().execute("SELECT 1 FROM threads LIMIT 1").fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def make_checkpointer() -> BaseCheckpointSaver:
+    if CHECKPOINTER == "memory":
+        return MemorySaver()
+    return SqliteCheckpointer()
@@ -0,0 +1,164 @@
+import os
+import asyncio
+import importlib.util
+from typing import Dict, Optional, Set
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from langchain_openai import ChatOpenAI
+
+from recorder import corpus_recorder
+from ratelimit import OPENAI_MAX_RETRIES, openai_event_hooks
+
+TAVILY_API_BASE_URL = os.getenv("TAVILY_API_BASE_URL", "https://api.tavily.com")
+TAVILY_MAX_CONNECTIONS = int(os.getenv("TAVILY_MAX_CONNECTIONS", "20"))
+# Any OpenAI-compatible endpoint, e.g. the local stand-in used by the benchmarks.
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+# HTTP/2 multiplexes many concurrent completions over one connection. Off
+# by default: httpx needs the optional `h2` package for it
+# (pip install 'httpx[http2]'), which is not a dependency of the agent.
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "0") == "1"
+if OPENAI_HTTP2 and not HTTP2_AVAILABLE:
+    print("OPENAI_HTTP2=1 but the h2 package is not installed; using HTTP/1.1")
+    OPENAI_HTTP2 = False
+
+_tavily_http: Optional[httpx.AsyncClient] = None
+_tavily_http_loop: Optional[asyncio.AbstractEventLoop] = None
+
+_openai_http: Optional[httpx.AsyncClient] = None
+_openai_client: Optional[AsyncOpenAI] = None
+_openai_loop: Optional[asyncio.AbstractEventLoop] = None
+_chat_models: Dict[str, ChatOpenAI] = {}
+# Closes of clients left behind by an event loop change, kept until done.
+_closing: Set[asyncio.Task] = set()
+
+
+def _event_hooks(extra: Optional[Dict[str, list]] = None) -> Dict[str, list]:
+    hooks = {name: list(fns) for name, fns in (extra or {}).items()}
+    # With RECORD_CORPUS set, every response is also written to the corpus.
+    if corpus_recorder is not None:
+        hooks.setdefault("response", []).append(corpus_recorder.on_response)
+    return hooks
+
+
+async def _aclose_quietly(client: httpx.AsyncClient) -> None:
+    try:
+        await client.aclose()
+    except Exception as e:
+        print(f"Closing a stale HTTP client failed: {e}")
+
+
+def _close_stale(client: Optional[httpx.AsyncClient], loop: Optional[asyncio.AbstractEventLoop]) -> None:
+    """
+    Close a client being replaced because the event loop changed, on its
+    own loop if that still runs, so its connection pool is released.
+    """
+    if client is None or client.is_closed:
+        return
+    if loop is not None and loop.is_running() and not loop.is_closed():
+        asyncio.run_coroutine_threadsafe(_aclose_quietly(client), loop)
+        return
+    task = asyncio.get_running_loop().create_task(_aclose_quietly(client))
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+def get_tavily_http() -> httpx.AsyncClient:
+    """
+    Return the process-wide pooled HTTP client used for every Tavily call.
+    Connections are kept alive between searches so each retailer request
+    reuses an open socket instead of paying for a new TLS handshake.
+    The client is rebuilt if the running event loop changes, since pooled
+    connections cannot be shared across loops.
+    """
+    global _tavily_http, _tavily_http_loop
+    loop = asyncio.get_running_loop()
+    if _tavily_http is None or _tavily_http.is_closed or _tavily_http_loop is not loop:
+        _close_stale(_tavily_http, _tavily_http_loop)
+        _tavily_http = httpx.AsyncClient(
+            base_url=TAVILY_API_BASE_URL,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {os.getenv('TAVILY_API_KEY')}",
+                "X-Client-Source": "tavily-python",
+            },
+            limits=httpx.Limits(
+                max_connections=TAVILY_MAX_CONNECTIONS,
+                max_keepalive_connections=TAVILY_MAX_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(120.0, connect=10.0),
+            event_hooks=_event_hooks(),
+        )
+        _tavily_http_loop = loop
+    return _tavily_http
+
+
+def _get_openai_http() -> httpx.AsyncClient:
+    """
+    Return the keep-alive connection pool shared by every OpenAI call,
+    raw or through LangChain. max_connections bounds the sockets a worker
+    opens no matter how many sessions are running.
+    """
+    global _openai_http, _openai_client, _openai_loop
+    loop = asyncio.get_running_loop()
+    if _openai_http is None or _openai_http.is_closed or _openai_loop is not loop:
+        _close_stale(_openai_http, _openai_loop)
+        _openai_http = DefaultAsyncHttpxClient(
+            http2=OPENAI_HTTP2,
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+            ),
+            # Model calls, the SDK's retries included, pass the rate limiter.
+            event_hooks=_event_hooks(openai_event_hooks()),
+        )
+        _openai_client = None
+        _chat_models.clear()
+        _openai_loop = loop
+    return _openai_http
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """
+    Return the process-wide AsyncOpenAI client.
+    """
+    global _openai_client
+    http_client = _get_openai_http()
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"), base_url=OPENAI_BASE_URL, max_retries=OPENAI_MAX_RETRIES, http_client=http_client
+        )
+    return _openai_client
+
+
+def get_chat_model(model: str = "gpt-4o-mini") -> ChatOpenAI:
+    """
+    Return a cached ChatOpenAI for `model` that sends its requests over the
+    same connection pool as get_openai_client().
+    """
+    http_client = _get_openai_http()
+    if model not in _chat_models:
+        _chat_models[model] = ChatOpenAI(
+            model=model, base_url=OPENAI_BASE_URL, max_retries=OPENAI_MAX_RETRIES, http_async_client=http_client
+        )
+    return _chat_models[model]
+
+
+async def close_clients() -> None:
+    """
+    Close the pooled HTTP clients. Called on server shutdown.
+    """
+    global _tavily_http, _openai_http, _openai_client
+    for client in (_tavily_http, _openai_http):
+        if client is not None and not client.is_closed:
+            await client.aclose()
+    _tavily_http = None
+    _openai_http = None
+    _openai_client = None
+    _chat_models.clear()
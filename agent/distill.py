@@ -0,0 +1,118 @@
+import os
+import re
+from typing import List, NamedTuple
+
+from url_tokens import PLACEHOLDER_BASES
+
+DISTILL_ENABLED = os.getenv("DISTILL_ENABLED", "1") == "1"
+DISTILL_MAX_CHARS = int(os.getenv("DISTILL_MAX_CHARS", "60000"))
+# Blocks longer than this are split on line breaks before scoring.
+MAX_BLOCK_CHARS = 2000
+
+BLOCK_SPLIT_RE = re.compile(r"\n\s*\n")
+PRICE_RE = re.compile(r"[$£€]\s?\d[\d,]*(?:\.\d{1,2})?|\b\d[\d,]*\.\d{2}\s?(?:USD|dollars)\b", re.IGNORECASE)
+RATING_RE = re.compile(r"out of 5|\bstars?\b|\bratings?\b|\breviews?\b|★", re.IGNORECASE)
+BOILERPLATE_RE = re.compile(
+    r"sign in|privacy|cookie|terms of (?:use|service)|conditions of use|customer service|"
+    r"back to top|gift cards?|careers|your account|help center|sitemap|all rights reserved|©",
+    re.IGNORECASE,
+)
+WORD_RE = re.compile(r"[a-z0-9]+")
+_hosts = sorted({base.split("/")[2] for bases in PLACEHOLDER_BASES.values() for base in bases})
+IMAGE_PLACEHOLDER_RE = re.compile(r"https://(?:" + "|".join(re.escape(h) for h in _hosts) + r")/img/url\d+")
+PRODUCT_PLACEHOLDER_RE = re.compile(r"https://(?:" + "|".join(re.escape(h) for h in _hosts) + r")/url\d+")
+STOPWORDS = {"get", "me", "some", "the", "for", "and", "with", "best", "good", "amazing", "find", "show", "under", "buy"}
+
+
+class Distilled(NamedTuple):
+    text: str
+    input_chars: int
+    output_chars: int
+    blocks_in: int
+    blocks_kept: int
+
+
+def split_blocks(text: str) -> List[str]:
+    """
+    Split page markdown into paragraph-like blocks; oversized blocks are
+    split further on line breaks.
+    """
+    blocks = []
+    for block in BLOCK_SPLIT_RE.split(text):
+        if not block.strip():
+            continue
+        if len(block) <= MAX_BLOCK_CHARS:
+            blocks.append(block)
+            continue
+        current = []
+        size = 0
+        for line in block.split("\n"):
+            if current and size + len(line) > MAX_BLOCK_CHARS:
+                blocks.append("\n".join(current))
+                current, size = [], 0
+            current.append(line)
+            size += len(line) + 1
+        if current:
+            blocks.append("\n".join(current))
+    return blocks
+
+
+def query_terms(query: str) -> List[str]:
+    return [w for w in dict.fromkeys(WORD_RE.findall((query or "").lower())) if len(w) > 2 and w not in STOPWORDS]
+
+
+def score_block(block: str, terms: List[str]) -> float:
+    """
+    Score a block on product signals: prices, ratings, image and product
+    placeholders and query terms. Navigation and footer text scores negative.
+    """
+    prices = len(PRICE_RE.findall(block))
+    ratings = len(RATING_RE.findall(block))
+    images = len(IMAGE_PLACEHOLDER_RE.findall(block))
+    links = len(PRODUCT_PLACEHOLDER_RE.findall(block))
+    lowered = block.lower()
+    score = 3 * min(prices, 5) + 2 * min(ratings, 3) + 2 * min(images, 3) + min(links, 2)
+    score += 2 * sum(1 for t in terms if t in lowered)
+    if BOILERPLATE_RE.search(block):
+        score -= 3
+    # Link farms without prices are menus and carousels of categories.
+    if links > 5 and prices == 0:
+        score -= 2
+    return score
+
+
+def distill_page(text: str, query: str = "", max_chars: int = DISTILL_MAX_CHARS) -> Distilled:
+    """
+    Keep the blocks of a (URL-rewritten) page that carry the most product
+    signal, in their original order, within `max_chars`.
+    Pages already under the budget are returned unchanged.
+    """
+    blocks = split_blocks(text)
+    if not DISTILL_ENABLED or len(text) <= max_chars:
+        return Distilled(text, len(text), len(text), len(blocks), len(blocks))
+
+    terms = query_terms(query)
+    own = [score_block(b, terms) for b in blocks]
+    # A product usually spans a few neighbouring blocks (title, price,
+    # rating), so half of a neighbour's positive score carries over.
+    scores = []
+    for i, s in enumerate(own):
+        prev_s = own[i - 1] if i > 0 else 0
+        next_s = own[i + 1] if i + 1 < len(own) else 0
+        scores.append(s + 0.5 * (max(prev_s, 0) + max(next_s, 0)))
+
+    ranked = sorted((i for i in range(len(blocks)) if scores[i] > 0), key=lambda i: -scores[i])
+    keep = set()
+    size = 0
+    for i in ranked:
+        block_size = len(blocks[i]) + 2
+        if size + block_size > max_chars:
+            continue
+        keep.add(i)
+        size += block_size
+
+    if not keep:
+        out = text[:max_chars]
+        return Distilled(out, len(text), len(out), len(blocks), 0)
+    out = "\n\n".join(blocks[i] for i in sorted(keep))
+    return Distilled(out, len(text), len(out), len(blocks), len(keep))
@@ -0,0 +1,128 @@
+import os
+import copy
+import time
+import asyncio
+from typing import Any, Dict, Optional, Tuple
+
+from langchain_core.callbacks.manager import adispatch_custom_event
+from langchain_core.runnables import RunnableConfig
+from copilotkit.langgraph import copilotkit_emit_state
+
+from metrics import span
+
+# Minimum gap between two state emits of one run; emits requested inside
+# the gap are coalesced into a single trailing emit.
+EMIT_MIN_INTERVAL = float(os.getenv("EMIT_MIN_INTERVAL", "0.25"))
+# Pause after each progress step so the UI shows it; 0 disables the
+# artificial delays entirely.
+UI_STEP_DELAY = float(os.getenv("UI_STEP_DELAY", "1"))
+
+# State keys the frontend renders. Messages and the CopilotKit actions are
+# never part of an intermediate emit; the SDK drops messages anyway.
+EMIT_KEYS = ("products", "favorites", "buffer_products", "preview_products", "wishlist", "logs", "canvas_logs", "show_results", "report")
+# Product lists are replaced or appended to while a node runs, never edited
+# in place, so a shallow copy is enough to detect their changes.
+SHALLOW_KEYS = {"products", "favorites", "buffer_products", "preview_products", "wishlist"}
+
+
+class StateEmitter:
+    """
+    Coalescing replacement for calling copilotkit_emit_state with the whole
+    state after every change.
+    `emit()` marks the state dirty; it is sent at most once per
+    `min_interval`, and emits in between collapse into one trailing emit.
+    Only keys that changed since the last emit are copied again, and
+    nothing is sent when no frontend key changed.
+    The state sync event replaces the frontend state, so every emit carries
+    all frontend keys; unchanged ones reuse the previous snapshot.
+    """
+
+    def __init__(self, config: RunnableConfig, state: Dict[str, Any], min_interval: float = EMIT_MIN_INTERVAL, keys: Tuple[str, ...] = EMIT_KEYS):
+        self.config = config
+        self.state = state
+        self.min_interval = min_interval
+        self.keys = keys
+        self._sent: Dict[str, Any] = {}
+        self._last_sent_at = 0.0
+        self._pending: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.requested = 0
+        self.sent = 0
+
+    def _snapshot(self, key: str, value: Any) -> Any:
+        if key in SHALLOW_KEYS and isinstance(value, list):
+            return list(value)
+        return copy.deepcopy(value)
+
+    def changed_keys(self):
+        return [k for k in self.keys if k in self.state and (k not in self._sent or self._sent[k] != self.state[k])]
+
+    async def _send(self) -> bool:
+        async with self._lock:
+            changed = self.changed_keys()
+            if not changed:
+                return False
+            with span("emit"):
+                for key in changed:
+                    self._sent[key] = self._snapshot(key, self.state[key])
+                self._last_sent_at = time.monotonic()
+                self.sent += 1
+                await copilotkit_emit_state(self.config, dict(self._sent))
+            return True
+
+    async def _trailing(self, delay: float) -> None:
+        try:
+            await asyncio.sleep(delay)
+            self._pending = None
+            await self._send()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"State emit failed: {e}")
+
+    async def emit(self) -> None:
+        """Request an emit of the current state, coalesced with others."""
+        self.requested += 1
+        if self._pending is not None:
+            return
+        wait = self._last_sent_at + self.min_interval - time.monotonic()
+        if wait <= 0:
+            await self._send()
+        else:
+            self._pending = asyncio.create_task(self._trailing(wait))
+
+    async def flush(self) -> None:
+        """Send any change right away, ignoring the rate limit."""
+        self.requested += 1
+        self.cancel()
+        await self._send()
+
+    async def step(self) -> None:
+        """Show the current progress step, then pause for UI_STEP_DELAY."""
+        await self.flush()
+        if UI_STEP_DELAY > 0:
+            await asyncio.sleep(UI_STEP_DELAY)
+
+    async def close(self) -> None:
+        """Final flush; reports how many emits were coalesced away."""
+        await self.flush()
+        print(f"State emits: {self.sent} sent for {self.requested} requested")
+
+    def cancel(self) -> None:
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+
+
+async def emit_tool_call(config: RunnableConfig, tool_call: Dict[str, Any]) -> None:
+    """
+    Stream a tool call built by the agent itself (not by a model) to the
+    frontend, like copilotkit_emit_tool_call but keeping the call's id so
+    the frontend's tool result matches the AIMessage in the history.
+    """
+    await adispatch_custom_event(
+        "copilotkit_manually_emit_tool_call",
+        {"name": tool_call["name"], "args": tool_call["args"], "id": tool_call["id"]},
+        config=config,
+    )
+    await asyncio.sleep(0.02)
@@ -0,0 +1,174 @@
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from metrics import registry
+from ratelimit import on_admitted
+
+# Send a duplicate of a model call that is slower than the LLM_HEDGE_QUANTILE
+# of its recent latencies; the first answer wins.
+LLM_HEDGE = os.getenv("LLM_HEDGE", "1") == "1"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.9"))
+# Hedge delay used until a call site has MIN_SAMPLES latencies.
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "30"))
+# A model call, hedge included, is abandoned after LLM_DEADLINE_FACTOR times
+# its site's p99 latency; there is no deadline before MIN_SAMPLES latencies.
+# LLM_DEADLINE caps it in seconds (0 = no cap).
+LLM_DEADLINE_FACTOR = float(os.getenv("LLM_DEADLINE_FACTOR", "2"))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "0"))
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+
+T = TypeVar("T")
+
+hedges = registry.counter("llm_hedges_total", "Hedged model calls by outcome", ("site", "outcome"))
+deadlines_exceeded = registry.counter("llm_deadline_exceeded_total", "Model calls abandoned at their deadline", ("site",))
+budget_seconds = registry.gauge("llm_latency_budget_seconds", "Current hedge delay and deadline (0 = none) per call site", ("site", "budget"))
+
+
+class DeadlineExceeded(Exception):
+    """
+    No attempt of a call finished before its deadline. `partial` holds
+    whatever the caller salvaged from the abandoned attempts, if anything.
+    """
+
+    def __init__(self, site: str, deadline: float):
+        super().__init__(f"{site} passed its {deadline:.1f}s deadline")
+        self.site = site
+        self.deadline = deadline
+        self.partial: Any = None
+
+
+class LatencyBudget:
+    """
+    Hedge delay and deadline of one call site, from its last LATENCY_WINDOW
+    latencies. Attempts cancelled before finishing count with the time they
+    had run, a lower bound that keeps slow calls from vanishing from the
+    window.
+    """
+
+    def __init__(self, site: str, window: int = LATENCY_WINDOW):
+        self.site = site
+        self.samples: deque = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self.samples) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def hedge_after(self) -> float:
+        q = self.quantile(LLM_HEDGE_QUANTILE)
+        hedge_after = q if q is not None else LLM_HEDGE_AFTER
+        return min(hedge_after, LLM_DEADLINE / 2) if LLM_DEADLINE else hedge_after
+
+    def deadline(self) -> Optional[float]:
+        q = self.quantile(0.99)
+        deadline = None
+        if q is not None:
+            # Leave the hedge at least as long as the first attempt had.
+            deadline = max(q * LLM_DEADLINE_FACTOR, 2 * self.hedge_after())
+        if LLM_DEADLINE:
+            deadline = min(deadline, LLM_DEADLINE) if deadline is not None else LLM_DEADLINE
+        return deadline
+
+
+_budgets: Dict[str, LatencyBudget] = {}
+
+
+def latency_budget(site: str) -> LatencyBudget:
+    budget = _budgets.get(site)
+    if budget is None:
+        budget = _budgets[site] = LatencyBudget(site)
+    return budget
+
+
+async def hedged(
+    site: str,
+    attempt: Callable[[int], Awaitable[T]],
+    hedge: bool = LLM_HEDGE,
+    can_hedge: Callable[[], bool] = lambda: True,
+) -> T:
+    """
+    Run `attempt(0)`. If it is still running after the site's hedge delay
+    (and `can_hedge()`), start `attempt(1)` alongside and return whichever
+    succeeds first; the other is cancelled. A failed attempt is ignored
+    while the other still runs. Past the deadline every attempt is
+    cancelled and DeadlineExceeded raised. Both clocks start when the rate
+    limiter sends the first attempt's request, not while it is queued.
+    """
+    budget = latency_budget(site)
+    hedge_after, deadline = budget.hedge_after(), budget.deadline()
+    budget_seconds.set(hedge_after, site=site, budget="hedge")
+    budget_seconds.set(deadline or 0, site=site, budget="deadline")
+    running: Dict[asyncio.Task, int] = {}
+    # perf_counter at which each attempt's request was first sent.
+    sent: Dict[int, float] = {}
+    first_sent = asyncio.get_running_loop().create_future()
+    launched = 0
+    error: Optional[BaseException] = None
+
+    def admitted(index: int) -> None:
+        sent.setdefault(index, time.perf_counter())
+        if not first_sent.done():
+            first_sent.set_result(None)
+
+    async def run(index: int) -> T:
+        on_admitted.set(lambda: admitted(index))
+        return await attempt(index)
+
+    def launch() -> None:
+        nonlocal launched
+        running[asyncio.create_task(run(launched))] = launched
+        launched += 1
+
+    launch()
+    try:
+        while running:
+            hedge_pending = hedge and launched == 1
+            if not first_sent.done():
+                timeout = None
+            elif hedge_pending:
+                timeout = hedge_after - (time.perf_counter() - sent[0])
+            elif deadline is not None:
+                timeout = deadline - (time.perf_counter() - sent[0])
+            else:
+                timeout = None
+            waiting = set(running) if first_sent.done() else {*running, first_sent}
+            done, _ = await asyncio.wait(waiting, timeout=None if timeout is None else max(0.0, timeout), return_when=asyncio.FIRST_COMPLETED)
+            done.discard(first_sent)
+            for task in done:
+                index = running.pop(task)
+                if not task.cancelled() and task.exception() is None:
+                    budget.observe(time.perf_counter() - sent.get(index, time.perf_counter()))
+                    if launched > 1:
+                        hedges.inc(site=site, outcome="hedge_won" if index else "first_won")
+                    return task.result()
+                if error is None and not task.cancelled():
+                    error = task.exception()
+            if done or timeout is None:
+                continue
+            elapsed = time.perf_counter() - sent[0]
+            if hedge_pending and (deadline is None or elapsed < deadline):
+                if can_hedge():
+                    hedges.inc(site=site, outcome="launched")
+                    launch()
+                else:
+                    hedge = False
+                continue
+            deadlines_exceeded.inc(site=site)
+            raise DeadlineExceeded(site, deadline)
+        if error is None:
+            raise asyncio.CancelledError()
+        raise error
+    finally:
+        now = time.perf_counter()
+        for task, index in running.items():
+            task.cancel()
+            if index in sent:
+                budget.observe(now - sent[index])
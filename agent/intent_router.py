@@ -0,0 +1,143 @@
+import os
+import re
+import math
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional
+
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER", "1") == "1"
+# Search decisions below this confidence go to the model.
+INTENT_ROUTER_MIN_CONFIDENCE = float(os.getenv("INTENT_ROUTER_MIN_CONFIDENCE", "0.85"))
+
+WORD_RE = re.compile(r"[a-z0-9]+(?:['.-][a-z0-9]+)*")
+
+# Keyword classifier for "is this a new product search". Each matching
+# feature adds its weight to the score; confidence is sigmoid(score).
+SEARCH_BIAS = -1.5
+SEARCH_FEATURES = [
+    (2.0, re.compile(r"^(?:please\s+)?(?:get|find|show|search(?:\s+for)?|look(?:ing)?\s+for|recommend|suggest|buy|shop(?:\s+for)?)\b", re.I)),
+    (1.5, re.compile(r"^(?:i\s+(?:need|want)|i'm\s+looking\s+for|im\s+looking\s+for)\b", re.I)),
+    (1.0, re.compile(r"^(?:best|top|cheap(?:est)?|affordable|budget|good)\b", re.I)),
+    (1.5, re.compile(r"\b(?:under|below|less\s+than|within|around)\s*[$£€]?\s*\d", re.I)),
+    (1.0, re.compile(r"[$£€]\s*\d|\b\d+\s*(?:dollars|usd|k)\b", re.I)),
+    (1.0, re.compile(r"\b(?:for\s+(?:gaming|work|travel|running|kids|photography|students?|office|home)|with\s+\w+)\b", re.I)),
+    (1.5, re.compile(
+        r"\b(?:laptops?|notebooks?|phones?|smartphones?|iphones?|tablets?|ipads?|headphones?|earbuds?|earphones?|"
+        r"speakers?|soundbars?|monitors?|tvs?|televisions?|cameras?|watch(?:es)?|smartwatch(?:es)?|keyboards?|mice|mouse|"
+        r"routers?|printers?|consoles?|dishwashers?|refrigerators?|fridges?|microwaves?|vacuums?|blenders?|"
+        r"air\s*fryers?|coffee\s+makers?|shoes|sneakers|backpacks?|chairs?|desks?|mattress(?:es)?|drones?|chargers?|ssds?)\b",
+        re.I,
+    )),
+    # References to what is already on screen belong to the model.
+    (-4.0, re.compile(r"\b(?:canvas|wishlist|favou?rites?|these|those|them|this\s+one|that\s+one|above|previous|compare|which\s+of)\b", re.I)),
+    (-2.5, re.compile(r"^(?:what|why|how|when|who|which|is|are|can|could|does|do|should|tell|explain)\b", re.I)),
+    (-3.0, re.compile(r"^(?:hi|hello|hey|thanks?|thank\s+you|ok(?:ay)?|cool|great|bye)\b", re.I)),
+]
+
+EDIT_RE = re.compile(
+    r"^(?:please\s+)?(?P<verb>move|add|put|save|remove|delete|drop|take)\s+(?:the\s+)?(?P<mention>.+?)"
+    r"(?:\s+(?P<prep>to|into|from|off|out\s+of)\s+(?:the\s+|my\s+)?(?P<target>wishlist|favou?rites|canvas|list))?\s*[.!]?$",
+    re.I,
+)
+# Edit phrases that name several products or none in particular.
+VAGUE_MENTION_RE = re.compile(r"\b(?:all|everything|both|these|those|them|it|cheapest|first|second|third|last|\d+(?:st|nd|rd|th))\b|,|\band\b", re.I)
+
+
+class Route(NamedTuple):
+    intent: str  # "search" or "edit"
+    confidence: float
+    tool_call: Optional[Dict[str, Any]] = None
+
+
+def _words(text: str) -> List[str]:
+    return WORD_RE.findall(text.lower())
+
+
+def search_confidence(text: str) -> float:
+    text = text.strip()
+    score = SEARCH_BIAS + sum(w for w, rx in SEARCH_FEATURES if rx.search(text))
+    return 1 / (1 + math.exp(-score))
+
+
+def match_product(mention: str, products: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    The one product whose name contains every word of `mention`, or None
+    when no product or more than one does.
+    """
+    words = [w for w in _words(mention) if w not in {"the", "a", "an", "my", "product"}]
+    if not words:
+        return None
+    matches = [p for p in products if set(words) <= set(_words(p.get("name") or ""))]
+    return matches[0] if len(matches) == 1 else None
+
+
+def edit_tool_call(kind: str, product_id: str) -> Dict[str, Any]:
+    args = {"remove_from_canvas": [], "move_to_wishlist": [], "remove_from_wishlist": []}
+    args[kind].append({"product_id": product_id})
+    return {"name": "edit_product_canvas", "args": args, "id": f"call_{uuid.uuid4().hex[:24]}", "type": "tool_call"}
+
+
+class IntentRouter:
+    """
+    Rules and a keyword classifier that settle clear-cut turns without the
+    classification model call: new product searches, and single-product
+    canvas/wishlist edits that name exactly one product. Anything else
+    returns None and goes to the model.
+    Decisions are counted in `stats` for hit-rate reporting.
+    """
+
+    def __init__(self, min_confidence: float = INTENT_ROUTER_MIN_CONFIDENCE, enabled: bool = INTENT_ROUTER_ENABLED):
+        self.min_confidence = min_confidence
+        self.enabled = enabled
+        self.stats: Counter = Counter()
+
+    def route(self, text: Any, canvas: List[Dict[str, Any]], wishlist: List[Dict[str, Any]]) -> Optional[Route]:
+        if not self.enabled or not isinstance(text, str) or not text.strip():
+            return None
+        self.stats["turns"] += 1
+        route = self._edit(text.strip(), canvas, wishlist) or self._search(text)
+        if route is None:
+            self.stats["fallback"] += 1
+        else:
+            self.stats[route.intent] += 1
+        return route
+
+    def _edit(self, text: str, canvas: List[Dict[str, Any]], wishlist: List[Dict[str, Any]]) -> Optional[Route]:
+        m = EDIT_RE.match(text)
+        if not m or VAGUE_MENTION_RE.search(m.group("mention")):
+            return None
+        verb = m.group("verb").lower()
+        prep = (m.group("prep") or "").lower()
+        target = (m.group("target") or "").lower().replace("favourites", "wishlist").replace("favorites", "wishlist")
+        removing = verb in ("remove", "delete", "drop", "take")
+        if not removing and prep in ("to", "into") and target == "wishlist":
+            kind, products = "move_to_wishlist", canvas
+        elif removing and target == "wishlist" and prep in ("from", "off", "out of"):
+            kind, products = "remove_from_wishlist", wishlist
+        elif removing and (not target or (target in ("canvas", "list") and prep in ("from", "off", "out of"))):
+            kind, products = "remove_from_canvas", canvas
+        else:
+            return None
+        product = match_product(m.group("mention"), products)
+        if product is None:
+            return None
+        return Route("edit", 1.0, edit_tool_call(kind, product["id"]))
+
+    def _search(self, text: str) -> Optional[Route]:
+        confidence = search_confidence(text)
+        if confidence < self.min_confidence:
+            return None
+        return Route("search", confidence)
+
+    def hit_rate(self) -> float:
+        turns = self.stats["turns"]
+        return (turns - self.stats["fallback"]) / turns if turns else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.stats['turns']} turns, {self.stats['search']} search, {self.stats['edit']} edit, "
+            f"{self.stats['fallback']} to model, hit rate {self.hit_rate():.0%}"
+        )
+
+
+intent_router = IntentRouter()
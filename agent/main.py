@@ -1,42 +1,54 @@
-from fastapi import FastAPI
-import uvicorn
-# from copilotkit
-from copilotkit.integrations.fastapi import add_fastapi_endpoint
-from copilotkit import CopilotKitRemoteEndpoint, LangGraphAgent
 import os
-app = FastAPI()
-from shopping_assistant import graph
+import uvicorn
 
+# The app itself is in server.py. This launcher stays light on purpose:
+# every worker process started with multiprocessing (uvicorn's workers,
+# the preprocessing pool) re-imports the main script.
 
-sdk = CopilotKitRemoteEndpoint(
-    agents=[
-        LangGraphAgent(
-            name="shopping_agent",
-            description="A shopping agent that can help you find the best products for your needs by searching various retailers",
-            graph=graph
-        )
-    ]
-)
+# "dev" runs one auto-reloading worker; "prod" runs WEB_CONCURRENCY workers
+# without the file watcher.
+SERVER_MODE = os.getenv("SERVER_MODE", "dev")
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1
+# Idle keep-alive of client connections. Keep it above the load balancer's
+# idle timeout so the proxy, not the worker, closes idle connections.
+KEEP_ALIVE_TIMEOUT = int(os.getenv("KEEP_ALIVE_TIMEOUT", "75"))
+# Seconds a stopping worker waits for running searches and streams.
+GRACEFUL_SHUTDOWN_TIMEOUT = int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", "900"))
 
-add_fastapi_endpoint(app, sdk, "/copilotkit")
 
-
-@app.get("/health")
-def health():
-    """Health check."""
-    return {"status": "ok"}
+def __getattr__(name):
+    # Keeps `uvicorn main:app` working.
+    if name == "app":
+        from server import app
+        return app
+    raise AttributeError(name)
 
 
 def main():
     """Run the uvicorn server."""
     port = int(os.getenv("PORT", "8000"))
+    if SERVER_MODE == "prod":
+        from checkpointer import CHECKPOINTER
+        if CHECKPOINTER == "memory" and WEB_CONCURRENCY > 1:
+            raise SystemExit("CHECKPOINTER=memory keeps conversations in one process; use sqlite with WEB_CONCURRENCY > 1")
+        # Every worker opens the same checkpoint database, so any of them
+        # can serve any conversation.
+        uvicorn.run(
+            "server:app",
+            host="0.0.0.0",
+            port=port,
+            workers=WEB_CONCURRENCY,
+            timeout_keep_alive=KEEP_ALIVE_TIMEOUT,
+            timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT,
+        )
+        return
     uvicorn.run(
-        "main:app",
+        "server:app",
         host="0.0.0.0",
         port=port,
         reload=True,
         timeout_keep_alive=900,  # 15 minutes = 900 seconds
-        timeout_graceful_shutdown=900,  # 15 minutes graceful shutdown
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT,
         reload_dirs=(
             ["."] +
             (["../../../sdk-python/copilotkit"]
@@ -47,4 +59,4 @@ def main():
     )
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
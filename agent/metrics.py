@@ -0,0 +1,387 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+# Pipeline stages in the order a search runs through them.
+STAGES = ("classification", "search", "extract", "url_rewrite", "distill", "llm_structuring", "combine", "emit")
+
+# Append every finished agent run, with all its spans, to this file as one
+# JSON line. Empty disables the export.
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+
+# How often the event loop lag monitor wakes up, in seconds.
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+# ---- Prometheus-style registry ---------------------------------------------
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{k}="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for k, v in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """A monotonically increasing value per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1.0, **labels: Any) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labels, key)), value
+
+
+class Gauge(Counter):
+    """A value per label combination that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, value: float = 1.0, **labels: Any) -> None:
+        self.inc(-value, **labels)
+
+
+class Histogram:
+    """Cumulative buckets, sum and count per label combination."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values: Dict[LabelValues, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            # Per bucket counts, then the +Inf count and the sum.
+            state = self._values.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += 1
+            state[-1] += value
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            labels = dict(zip(self.labels, key))
+            for bound, count in zip(self.buckets, state):
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, count
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, state[-2]
+            yield f"{self.name}_sum", labels, state[-1]
+            yield f"{self.name}_count", labels, state[-2]
+
+
+# A collector returns (name, kind, help, [(labels, value), ...]) families
+# computed at scrape time, e.g. from counters kept elsewhere.
+Family = Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]
+Collector = Callable[[], Iterable[Family]]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Any] = []
+        self.collectors: List[Collector] = []
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        metric = Gauge(name, help, labels)
+        if not labels:
+            metric.set(0)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn: Collector) -> Collector:
+        self.collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in metric.samples())
+        for fn in self.collectors:
+            try:
+                families = list(fn())
+            except Exception as e:
+                print(f"Metrics collector {getattr(fn, '__name__', fn)} failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{_format_labels({k: str(v) for k, v in labels.items()})} {_format_value(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram("agent_stage_seconds", "Duration of pipeline stage spans", ("stage", "retailer"))
+run_seconds = registry.histogram("agent_run_seconds", "Duration of agent_node runs")
+llm_seconds = registry.histogram("llm_request_seconds", "Latency of model calls", ("site", "model"))
+llm_requests = registry.counter("llm_requests_total", "Model calls by outcome", ("site", "model", "status"))
+llm_tokens = registry.counter("llm_tokens_total", "Tokens used by model calls", ("site", "model", "type"))
+tavily_seconds = registry.histogram("tavily_request_seconds", "Latency of Tavily API calls", ("endpoint",))
+tavily_requests = registry.counter("tavily_requests_total", "Tavily API calls by status", ("endpoint", "status"))
+loop_lag = registry.histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a task scheduled to wake up",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+loop_lag_last = registry.gauge("event_loop_lag_last_seconds", "Most recent event loop lag measurement")
+
+
+# ---- traces ----------------------------------------------------------------
+
+
+class Span(NamedTuple):
+    stage: str
+    labels: Dict[str, Any]
+    start: float
+    end: float
+
+
+class Trace:
+    """
+    The spans recorded during one graph run. Stages of different retailers
+    overlap, so besides the summed span time each stage also reports its
+    wall time: how long at least one of its spans was running.
+    """
+
+    def __init__(self, name: str = "run"):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.attrs: Dict[str, Any] = {}
+        self.spans: List[Span] = []
+
+    def add(self, span: Span) -> None:
+        self.spans.append(span)
+
+    def stages(self) -> Dict[str, Dict[str, float]]:
+        by_stage: Dict[str, List[Span]] = {}
+        for s in self.spans:
+            by_stage.setdefault(s.stage, []).append(s)
+        return {stage: _summarize(spans) for stage, spans in by_stage.items()}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start": self.started_at,
+            "duration_s": time.perf_counter() - self.started,
+            "attrs": self.attrs,
+            "spans": [
+                {"stage": s.stage, "labels": s.labels, "offset_s": s.start - self.started, "duration_s": s.end - s.start}
+                for s in self.spans
+            ],
+        }
+
+
+def _summarize(spans: List[Span]) -> Dict[str, float]:
+    durations = [s.end - s.start for s in spans]
+    wall = 0.0
+    cur_start = cur_end = None
+    for s in sorted(spans, key=lambda s: s.start):
+        if cur_end is None or s.start > cur_end:
+            if cur_end is not None:
+                wall += cur_end - cur_start
+            cur_start, cur_end = s.start, s.end
+        else:
+            cur_end = max(cur_end, s.end)
+    if cur_end is not None:
+        wall += cur_end - cur_start
+    return {"count": len(spans), "total_s": sum(durations), "max_s": max(durations), "wall_s": wall}
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("agent_trace", default=None)
+_trace_file_lock = threading.Lock()
+
+
+def start_trace(name: str = "run") -> Trace:
+    """Record the spans of everything started from the current context."""
+    trace = Trace(name)
+    _trace.set(trace)
+    return trace
+
+
+def annotate(**attrs: Any) -> None:
+    """Attach attributes (e.g. the thread id) to the current trace."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+def export_trace(trace: Trace, path: str = TRACE_FILE) -> None:
+    if not path:
+        return
+    line = json.dumps(trace.to_dict(), default=str)
+    try:
+        with _trace_file_lock, open(path, "a") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        print(f"Trace export to {path} failed: {e}")
+
+
+def traced(name: str) -> Callable:
+    """
+    Run the decorated coroutine function in a trace of its own, unless a
+    trace (e.g. a benchmark's) is already active. The finished trace goes
+    into agent_run_seconds and, with TRACE_FILE, to the trace file.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if _trace.get() is not None:
+                return await fn(*args, **kwargs)
+            trace = Trace(name)
+            token = _trace.set(trace)
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                _trace.reset(token)
+                run_seconds.observe(time.perf_counter() - trace.started)
+                export_trace(trace)
+        return wrapper
+    return decorator
+
+
+def record_span(stage: str, start: float, end: float, **labels: Any) -> None:
+    """Record a span timed elsewhere, e.g. in a worker process."""
+    stage_seconds.observe(end - start, stage=stage, retailer=labels.get("retailer", ""))
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(Span(stage, labels, start, end))
+
+
+@contextmanager
+def span(stage: str, **labels: Any) -> Iterator[None]:
+    """Time the enclosed block as one span of `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, start, time.perf_counter(), **labels)
+
+
+async def monitor_event_loop(interval: float = LOOP_LAG_INTERVAL) -> None:
+    """
+    Measure event loop lag until cancelled: how much later than asked a
+    sleeping task gets to run. Lag means something blocked the loop.
+    """
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - start - interval)
+        loop_lag.observe(lag)
+        loop_lag_last.set(lag)
+
+
+# ---- call-site instrumentation ---------------------------------------------
+
+
+class LlmCall:
+    """Token usage of one model call, filled in by the caller."""
+
+    def __init__(self, site: str, model: str):
+        self.site = site
+        self.model = model
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def usage(self, usage: Any) -> None:
+        """Take usage from an OpenAI `usage` object or LangChain `usage_metadata`."""
+        if usage is None:
+            return
+        if isinstance(usage, dict):
+            self.prompt_tokens += usage.get("input_tokens") or usage.get("prompt_tokens") or 0
+            self.completion_tokens += usage.get("output_tokens") or usage.get("completion_tokens") or 0
+        else:
+            self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+            self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+
+@contextmanager
+def llm_call(site: str, model: str) -> Iterator[LlmCall]:
+    """Count and time one model call made at `site`."""
+    call = LlmCall(site, model)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield call
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        end = time.perf_counter()
+        llm_seconds.observe(end - start, site=site, model=model)
+        llm_requests.inc(site=site, model=model, status=status)
+        if call.prompt_tokens:
+            llm_tokens.inc(call.prompt_tokens, site=site, model=model, type="prompt")
+        if call.completion_tokens:
+            llm_tokens.inc(call.completion_tokens, site=site, model=model, type="completion")
+        trace = _trace.get()
+        if trace is not None:
+            trace.add(Span("llm", {
+                "site": site, "model": model, "status": status,
+                "prompt_tokens": call.prompt_tokens, "completion_tokens": call.completion_tokens,
+            }, start, end))
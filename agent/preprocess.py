@@ -0,0 +1,136 @@
+import os
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from url_tokens import PLACEHOLDER_BASES, LocalPage, tokenize_local
+from distill import Distilled, distill_page
+from structured_data import extract_structured_products, parse_target_structured
+from metrics import registry
+
+# Where CPU-bound page preprocessing (URL tokenization, distilling, JSON-LD
+# and Target structured data parsing) runs: "process" (a worker process
+# pool), "thread" (a thread pool) or "inline" (on the event loop).
+PREPROCESS_EXECUTOR = os.getenv("PREPROCESS_EXECUTOR", "process")
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "2"))
+# Pages shorter than this are cheaper to process inline than to ship to
+# the pool.
+PREPROCESS_MIN_CHARS = int(os.getenv("PREPROCESS_MIN_CHARS", "20000"))
+
+preprocess_queue_depth = registry.gauge("preprocess_queue_depth", "Preprocessing jobs submitted to the executor and not finished")
+preprocess_wait = registry.histogram("preprocess_wait_seconds", "Time preprocessing jobs waited for an executor worker")
+preprocess_seconds = registry.histogram("preprocess_seconds", "Run time of preprocessing jobs", ("job",))
+
+
+class PreparedPage(NamedTuple):
+    """
+    A page tokenized with local placeholder numbering and distilled.
+    `timings` are (stage, start, end) perf_counter spans measured where the
+    work ran; the clock is system-wide, so they line up with the caller's.
+    """
+    page: LocalPage
+    distilled: Distilled
+    timings: List[Tuple[str, float, float]]
+
+
+class PageHints(NamedTuple):
+    """Products read from JSON-LD, and Target structured hints for the prompt."""
+    structured_products: List[Dict[str, Any]]
+    assist: Optional[Dict[str, Any]]
+
+
+def prepare_page(raw: str, retailer: str, query: str) -> PreparedPage:
+    product_base, image_base = PLACEHOLDER_BASES.get(retailer, PLACEHOLDER_BASES["amazon.com"])
+    t0 = time.perf_counter()
+    page = tokenize_local(raw, product_base, image_base)
+    t1 = time.perf_counter()
+    distilled = distill_page(page.text, query)
+    t2 = time.perf_counter()
+    return PreparedPage(page, distilled, [("url_rewrite", t0, t1), ("distill", t1, t2)])
+
+
+def page_hints(raw: str, local_text: str, url: str, retailer: str, target: bool) -> PageHints:
+    """
+    Structured products of the page; when there are none, Target pages
+    also get their on-page JSON parsed as hints (with local placeholders).
+    """
+    structured = extract_structured_products(raw, url, retailer)
+    assist = parse_target_structured(local_text) if target and not structured else None
+    return PageHints(structured, assist)
+
+
+def _timed(fn: Callable[..., Any], args: Tuple[Any, ...]) -> Tuple[float, float, Any]:
+    start = time.perf_counter()
+    result = fn(*args)
+    return start, time.perf_counter(), result
+
+
+def _process_context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        # Workers fork from a single-threaded server that imported this
+        # module and its pure-CPU helpers once. The app is not preloaded:
+        # main.py, which workers re-import, only launches the server.
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload([__name__, "distill", "structured_data", "url_tokens"])
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+
+class PageExecutor:
+    """
+    Runs preprocessing jobs off the event loop so a heavy page never stalls
+    streaming or other sessions on the worker. Jobs take and return plain
+    data (strings, lists, NamedTuples), so they can cross to a process pool.
+    The pool starts with `warm_up` or on first use; if a pool process dies,
+    the pool is replaced and the job runs inline.
+    """
+
+    def __init__(self, kind: str = PREPROCESS_EXECUTOR, workers: int = PREPROCESS_WORKERS, min_chars: int = PREPROCESS_MIN_CHARS):
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.min_chars = min_chars
+        self._pool: Optional[Executor] = None
+
+    def _executor(self) -> Executor:
+        if self._pool is None:
+            if self.kind == "process":
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=_process_context())
+            else:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="preprocess")
+        return self._pool
+
+    async def run(self, fn: Callable[..., Any], *args: Any, size: int = 0) -> Any:
+        """`fn(*args)` on the executor; inline for inputs under `min_chars`."""
+        if self.kind == "inline" or size < self.min_chars:
+            start = time.perf_counter()
+            result = fn(*args)
+            preprocess_seconds.observe(time.perf_counter() - start, job=fn.__name__)
+            return result
+        submitted = time.perf_counter()
+        preprocess_queue_depth.inc()
+        try:
+            start, end, result = await asyncio.get_running_loop().run_in_executor(self._executor(), _timed, fn, args)
+        except BrokenExecutor as e:
+            print(f"Preprocessing pool failed ({e}); restarting it and running {fn.__name__} inline")
+            self.shutdown()
+            start, end, result = _timed(fn, args)
+        finally:
+            preprocess_queue_depth.dec()
+        preprocess_wait.observe(max(0.0, start - submitted))
+        preprocess_seconds.observe(end - start, job=fn.__name__)
+        return result
+
+    async def warm_up(self) -> None:
+        """Start the pool ahead of the first heavy page."""
+        if self.kind != "inline":
+            await asyncio.get_running_loop().run_in_executor(self._executor(), _timed, len, ("",))
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+page_executor = PageExecutor()
@@ -0,0 +1,89 @@
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+# What a tool call or an LLM prompt needs to name a product; the full
+# record lives once in the session's product lists and is looked up by id.
+PRODUCT_REF_FIELDS = ("id", "title", "product_url")
+
+
+def product_ref(product: Dict[str, Any], fields: Sequence[str] = PRODUCT_REF_FIELDS) -> Dict[str, Any]:
+    return {k: product[k] for k in fields if k in product}
+
+
+class ProductStore:
+    """
+    The products of one session - search results, canvas and wishlist -
+    addressed by id, so tool calls and prompts can carry ids or
+    `product_ref` projections instead of full copies. The graph state
+    itself still holds full records in buffer_products, products and
+    favorites, which the frontend renders.
+    """
+
+    def __init__(self, *lists: Optional[Iterable[Dict[str, Any]]]):
+        self._by_id: Dict[str, Dict[str, Any]] = {}
+        for products in lists:
+            self.add(products or [])
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "ProductStore":
+        return cls(state.get("buffer_products"), state.get("products"), state.get("favorites"))
+
+    def add(self, products: Iterable[Dict[str, Any]]) -> List[str]:
+        ids = []
+        for product in products:
+            if isinstance(product, dict) and product.get("id"):
+                self._by_id.setdefault(product["id"], product)
+                ids.append(product["id"])
+        return ids
+
+    def get(self, product_id: str) -> Optional[Dict[str, Any]]:
+        return self._by_id.get(product_id)
+
+    def resolve(self, ids: Iterable[str]) -> List[Dict[str, Any]]:
+        """Products for `ids`, in order; unknown ids are skipped."""
+        return [self._by_id[i] for i in ids if i in self._by_id]
+
+    def refs(self, ids: Iterable[str], fields: Sequence[str] = PRODUCT_REF_FIELDS) -> List[Dict[str, Any]]:
+        return [product_ref(p, fields) for p in self.resolve(ids)]
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __contains__(self, product_id: str) -> bool:
+        return product_id in self._by_id
+
+
+def list_products_args(store: ProductStore, ids: List[str], chat_name: str, preview: int = 5) -> Dict[str, Any]:
+    """
+    Arguments of the `list_products` tool call: refs of the preview
+    products for the confirmation dialog plus the ids of every result.
+    The frontend resolves the ids against every product it has received
+    in `buffer_products`, which Accept and Show-more later split up.
+    """
+    return {
+        "products": store.refs(ids[:preview]),
+        "product_ids": list(ids),
+        "chat_name": chat_name,
+    }
+
+
+def compact_product_tool_calls(messages: List[Any]) -> int:
+    """
+    Rewrite `list_products` tool calls in the history that still embed full
+    product payloads (written before tool calls carried ids) into the id
+    form, in place. Returns the number of calls rewritten.
+    """
+    rewritten = 0
+    for message in messages:
+        for call in getattr(message, "tool_calls", None) or []:
+            args = call.get("args") or {}
+            if call.get("name") != "list_products" or "buffer_products" not in args:
+                continue
+            full = args.get("buffer_products") or []
+            store = ProductStore(full, args.get("products"))
+            call["args"] = {
+                "products": [product_ref(p) for p in args.get("products") or [] if isinstance(p, dict)],
+                "product_ids": store.add(full),
+                "chat_name": args.get("chat_name"),
+            }
+            rewritten += 1
+    return rewritten
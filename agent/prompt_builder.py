@@ -0,0 +1,138 @@
+import os
+import math
+from functools import lru_cache
+from typing import List, NamedTuple, Optional
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken ships with langchain-openai
+    tiktoken = None
+
+# Total context window per model and the share of it kept free for the
+# completion (reasoning tokens included for the gpt-5 family).
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-5-mini": 400000,
+    "gpt-5": 400000,
+    "gpt-4o-mini": 128000,
+    "gpt-4o": 128000,
+}
+MODEL_RESERVED_OUTPUT_TOKENS = {
+    "gpt-5-mini": 128000,
+    "gpt-5": 128000,
+    "gpt-4o-mini": 16384,
+    "gpt-4o": 16384,
+}
+DEFAULT_CONTEXT_WINDOW = 128000
+DEFAULT_RESERVED_OUTPUT_TOKENS = 16384
+# Optional hard cap on prompt size, below the model limit (0 = no cap).
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "0"))
+# Chat framing overhead: per message plus the assistant reply priming.
+TOKENS_PER_MESSAGE = 4
+REPLY_PRIMING_TOKENS = 3
+# Segments are counted separately, so BPE merges across their boundaries
+# are not seen; keep a small margin for that.
+SAFETY_MARGIN_TOKENS = 256
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """
+    tiktoken encoding for `model`, or None when tiktoken or its BPE files
+    are unavailable, in which case counts fall back to a conservative
+    characters-per-token estimate.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        try:
+            return tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            print(f"Token encoding unavailable for {model}: {e}")
+            return None
+    except Exception as e:
+        print(f"Token encoding unavailable for {model}: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str) -> int:
+    enc = get_encoding(model)
+    if enc is None:
+        return math.ceil(len(text) / 3)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=512)
+def segment_tokens(text: str, model: str) -> int:
+    """Token count of a prompt segment; static segments are counted once."""
+    return count_tokens(text, model)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str) -> str:
+    if max_tokens <= 0:
+        return ""
+    enc = get_encoding(model)
+    if enc is None:
+        return text[: max_tokens * 3]
+    tokens = enc.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return enc.decode(tokens[:max_tokens])
+
+
+def input_token_budget(model: str) -> int:
+    window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    reserved = MODEL_RESERVED_OUTPUT_TOKENS.get(model, DEFAULT_RESERVED_OUTPUT_TOKENS)
+    budget = window - reserved
+    if PROMPT_MAX_TOKENS:
+        budget = min(budget, PROMPT_MAX_TOKENS)
+    return budget
+
+
+class BuiltPrompt(NamedTuple):
+    text: str
+    system_tokens: int
+    header_tokens: int
+    page_tokens: int
+    total_tokens: int
+    truncated: bool
+
+
+class PromptTemplate:
+    """
+    A system message plus a user prompt made of header segments followed by
+    page content. The page is trimmed so the whole request fits the model's
+    input budget; token counts are reported on every build.
+    """
+
+    def __init__(self, system: str, model: str):
+        self.system = system
+        self.model = model
+        self._system_tokens: Optional[int] = None
+
+    @property
+    def system_tokens(self) -> int:
+        if self._system_tokens is None:
+            self._system_tokens = count_tokens(self.system, self.model) + TOKENS_PER_MESSAGE
+        return self._system_tokens
+
+    def build(self, header: List[str], page: str, max_page_tokens: Optional[int] = None) -> BuiltPrompt:
+        header_tokens = sum(segment_tokens(seg, self.model) for seg in header) + TOKENS_PER_MESSAGE
+        fixed = self.system_tokens + header_tokens + REPLY_PRIMING_TOKENS + SAFETY_MARGIN_TOKENS
+        budget = input_token_budget(self.model) - fixed
+        if max_page_tokens is not None:
+            budget = min(budget, max_page_tokens)
+        page_tokens = count_tokens(page, self.model)
+        truncated = page_tokens > budget
+        if truncated:
+            page = truncate_to_tokens(page, budget, self.model)
+            page_tokens = count_tokens(page, self.model)
+        return BuiltPrompt(
+            text="".join(header) + page,
+            system_tokens=self.system_tokens,
+            header_tokens=header_tokens,
+            page_tokens=page_tokens,
+            total_tokens=self.system_tokens + header_tokens + page_tokens + REPLY_PRIMING_TOKENS,
+            truncated=truncated,
+        )
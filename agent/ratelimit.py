@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import random
+import asyncio
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+import httpx
+
+from metrics import registry
+
+# Provider budgets of this server worker, per minute; 0 = unlimited. With
+# several workers, give each its share of the account quota.
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "0"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "0"))
+TAVILY_RPM = float(os.getenv("TAVILY_RPM", "0"))
+# Retries of a call answered with 429 or 5xx, with jittered exponential
+# backoff (or the provider's Retry-After).
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+TAVILY_MAX_RETRIES = int(os.getenv("TAVILY_MAX_RETRIES", "2"))
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+# New searches are turned away while this many calls wait for a budget.
+RATE_LIMIT_MAX_QUEUE = int(os.getenv("RATE_LIMIT_MAX_QUEUE", "64"))
+# A bucket holds this many seconds of its per-minute budget, so a burst
+# cannot spend the whole minute at once.
+BURST_SECONDS = 10.0
+
+# The session (thread id) calls are queued under, set by the agent node and
+# inherited by the tasks it starts.
+current_session: ContextVar[str] = ContextVar("rate_limit_session", default="")
+# Called when a model call of the current task leaves the queue and is sent,
+# so latency budgets (hedging.py) leave the queueing time out.
+on_admitted: ContextVar[Optional[Callable[[], None]]] = ContextVar("rate_limit_on_admitted", default=None)
+
+limiter_waiting = registry.gauge("rate_limiter_waiting", "Calls waiting for a provider budget", ("provider",))
+limiter_wait = registry.histogram("rate_limiter_wait_seconds", "Time calls waited for a provider budget", ("provider",))
+provider_throttled = registry.counter("provider_throttled_total", "Provider responses asking to slow down (429)", ("provider",))
+provider_retries = registry.counter("provider_retries_total", "Tavily calls retried after a 429, 5xx or connection error", ("provider",))
+searches_rejected = registry.counter("searches_rejected_total", "Searches turned away because provider queues were full")
+
+
+class TokenBucket:
+    """`per_minute` units refilled continuously, holding at most BURST_SECONDS worth."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until `amount` (capped at the capacity) is available."""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        # May go below zero for a call larger than the bucket; later calls
+        # then wait for it to be paid back.
+        self.level -= amount
+
+
+class RateLimiter:
+    """
+    Admission for one provider across every session on the worker: a
+    request budget and an optional token budget. Waiting calls are queued
+    per session and served round-robin, so one session's fan-out cannot
+    starve the others. A 429 from the provider holds all calls back for
+    its Retry-After.
+    """
+
+    def __init__(self, provider: str, rpm: float = 0, tpm: float = 0):
+        self.provider = provider
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.paused_until = 0.0
+        self._queues: "OrderedDict[str, Deque[Tuple[asyncio.Future, float]]]" = OrderedDict()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    async def acquire(self, tokens: float = 0, session: Optional[str] = None) -> None:
+        """Wait for this session's turn and the budget for one call of `tokens`."""
+        if self.requests is None and self.tokens is None and not self._queues and time.monotonic() >= self.paused_until:
+            return
+        session = current_session.get() if session is None else session
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(session, deque()).append((future, tokens))
+        limiter_waiting.inc(provider=self.provider)
+        start = time.perf_counter()
+        try:
+            self._dispatch()
+            await future
+        except asyncio.CancelledError:
+            queue = self._queues.get(session)
+            if queue is not None:
+                self._queues[session] = deque(entry for entry in queue if entry[0] is not future)
+                if not self._queues[session]:
+                    del self._queues[session]
+            raise
+        finally:
+            limiter_waiting.dec(provider=self.provider)
+            limiter_wait.observe(time.perf_counter() - start, provider=self.provider)
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._queues:
+            session, queue = next(iter(self._queues.items()))
+            future, tokens = queue[0]
+            if future.done():
+                # Cancelled while waiting.
+                queue.popleft()
+                if not queue:
+                    del self._queues[session]
+                continue
+            now = time.monotonic()
+            wait = max(
+                self.paused_until - now,
+                self.requests.delay(1, now) if self.requests else 0.0,
+                self.tokens.delay(tokens, now) if self.tokens else 0.0,
+            )
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(tokens)
+            queue.popleft()
+            future.set_result(None)
+            # Round robin: the session goes to the back of the line.
+            del self._queues[session]
+            if queue:
+                self._queues[session] = queue
+
+    def throttled(self, retry_after: Optional[float]) -> None:
+        """The provider answered 429: hold every call back for a while."""
+        provider_throttled.inc(provider=self.provider)
+        self.paused_until = max(self.paused_until, time.monotonic() + (retry_after if retry_after is not None else RETRY_BASE_DELAY))
+
+
+openai_limiter = RateLimiter("openai", OPENAI_RPM, OPENAI_TPM)
+tavily_limiter = RateLimiter("tavily", TAVILY_RPM)
+
+
+def overloaded() -> bool:
+    """True while so many calls are queued that a new search should wait."""
+    return openai_limiter.waiting + tavily_limiter.waiting >= RATE_LIMIT_MAX_QUEUE
+
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    """Seconds from a Retry-After (or retry-after-ms) header, if any."""
+    value = response.headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    """Delay before retry `attempt` (0-based): Retry-After, or jittered exponential."""
+    delay = retry_after(response) if response is not None else None
+    if delay is None:
+        delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.5)
+    return min(delay, RETRY_MAX_DELAY)
+
+
+def estimate_tokens(body: bytes) -> float:
+    """Rough token cost of a completion request: its prompt plus the output cap."""
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        return len(body) / 4
+    return len(body) / 4 + (payload.get("max_completion_tokens") or payload.get("max_tokens") or 0)
+
+
+async def on_openai_request(request: httpx.Request) -> None:
+    """httpx request hook: admit model calls, including the SDK's retries."""
+    if request.method == "POST" and request.url.path.endswith("/completions"):
+        await openai_limiter.acquire(estimate_tokens(request.content))
+        callback = on_admitted.get()
+        if callback is not None:
+            callback()
+
+
+async def on_openai_response(response: httpx.Response) -> None:
+    """httpx response hook: a 429 holds back every model call of the worker."""
+    if response.status_code == 429:
+        openai_limiter.throttled(retry_after(response))
+
+
+def openai_event_hooks() -> Dict[str, list]:
+    return {"request": [on_openai_request], "response": [on_openai_response]}
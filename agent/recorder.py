@@ -0,0 +1,156 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+# Directory to record Tavily pages, search results and model completions
+# into (see CorpusRecorder). Empty disables recording.
+RECORD_CORPUS = os.getenv("RECORD_CORPUS", "")
+
+# Format version of a corpus directory.
+CORPUS_VERSION = 1
+
+PLACEHOLDER_RE = re.compile(r"https://(amzn|tgt|ebay)\.com/(img/)?url(\d+)")
+
+
+def normalize_placeholders(text: str, mapping: Optional[Dict[str, str]] = None) -> Tuple[str, Dict[str, str]]:
+    """
+    Renumber URL placeholders from 1 in order of first appearance, per host
+    and kind, so the same prompt normalizes the same way whatever numbers the
+    search happened to hand out. Returns the text and the placeholder ->
+    normalized mapping; pass the mapping back in to normalize a completion
+    consistently with its prompt.
+    """
+    mapping = {} if mapping is None else mapping
+    counters: Dict[Tuple[str, bool], int] = {}
+    for placeholder in mapping.values():
+        m = PLACEHOLDER_RE.fullmatch(placeholder)
+        key = (m.group(1), bool(m.group(2)))
+        counters[key] = max(counters.get(key, 0), int(m.group(3)))
+
+    def _sub(m: re.Match) -> str:
+        placeholder = m.group(0)
+        if placeholder not in mapping:
+            key = (m.group(1), bool(m.group(2)))
+            counters[key] = counters.get(key, 0) + 1
+            mapping[placeholder] = f"https://{m.group(1)}.com/{m.group(2) or ''}url{counters[key]}"
+        return mapping[placeholder]
+
+    return PLACEHOLDER_RE.sub(_sub, text), mapping
+
+
+def completion_key(model: str, messages: List[Dict[str, Any]]) -> Tuple[str, Dict[str, str]]:
+    """Corpus key of a chat request, with the placeholder mapping used for it."""
+    normalized, mapping = normalize_placeholders(json.dumps(messages, sort_keys=True, ensure_ascii=False))
+    return hashlib.sha256(f"{model}\n{normalized}".encode("utf-8")).hexdigest(), mapping
+
+
+def url_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+
+def sse_content(body: str) -> str:
+    """Assistant text of a streamed chat completion."""
+    parts = []
+    for line in body.splitlines():
+        if not line.startswith("data: ") or line == "data: [DONE]":
+            continue
+        try:
+            chunk = json.loads(line[6:])
+        except ValueError:
+            continue
+        for choice in chunk.get("choices") or []:
+            parts.append((choice.get("delta") or {}).get("content") or "")
+    return "".join(parts)
+
+
+def _write_json(path: str, data: Any) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+class CorpusRecorder:
+    """
+    Records the Tavily and OpenAI traffic of this process into a corpus
+    directory the benchmarks replay:
+
+        manifest.json          format version, queries and search result
+                               URLs per retailer
+        pages/<key>.json       Tavily extract results (url, raw_content, images)
+        completions/<key>.json model completions keyed by model and messages,
+                               with URL placeholders normalized
+
+    Installed as an httpx response hook on the pooled clients; it reads the
+    whole response body, so streamed completions arrive in one piece while
+    recording.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(os.path.join(root, "pages"), exist_ok=True)
+        os.makedirs(os.path.join(root, "completions"), exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _update_manifest(self, query: Optional[str], domains: List[str], urls: List[str]) -> None:
+        path = os.path.join(self.root, "manifest.json")
+        with self._lock:
+            try:
+                with open(path) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = {"version": CORPUS_VERSION, "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "queries": [], "search": {}}
+            if query and query not in manifest["queries"]:
+                manifest["queries"].append(query)
+            for domain in domains:
+                known = manifest["search"].setdefault(domain, [])
+                known.extend(u for u in urls if u not in known)
+            _write_json(path, manifest)
+
+    def record_search(self, request: Dict[str, Any], response: Dict[str, Any]) -> None:
+        urls = [r["url"] for r in response.get("results", []) if r.get("url")]
+        self._update_manifest(request.get("query"), request.get("include_domains") or [], urls)
+
+    def record_extract(self, response: Dict[str, Any]) -> None:
+        for item in response.get("results", []):
+            if item.get("url") and item.get("raw_content"):
+                page = {"url": item["url"], "raw_content": item["raw_content"], "images": item.get("images") or []}
+                _write_json(os.path.join(self.root, "pages", f"{url_key(item['url'])}.json"), page)
+
+    def record_completion(self, request: Dict[str, Any], content: str, tool_calls: Optional[List[Dict[str, Any]]] = None) -> None:
+        key, mapping = completion_key(request.get("model", ""), request.get("messages") or [])
+        normalized, _ = normalize_placeholders(content, mapping)
+        record = {"model": request.get("model"), "stream": bool(request.get("stream")), "content": normalized}
+        if tool_calls:
+            record["tool_calls"] = tool_calls
+        _write_json(os.path.join(self.root, "completions", f"{key}.json"), record)
+
+    async def on_response(self, response: httpx.Response) -> None:
+        """httpx response hook."""
+        if response.status_code != 200 or response.request.method != "POST":
+            return
+        try:
+            await response.aread()
+            request = json.loads(response.request.content or b"{}")
+            path = response.request.url.path
+            if path.endswith("/search"):
+                self.record_search(request, response.json())
+            elif path.endswith("/extract"):
+                self.record_extract(response.json())
+            elif path.endswith("/chat/completions"):
+                if request.get("stream"):
+                    self.record_completion(request, sse_content(response.text))
+                else:
+                    message = response.json()["choices"][0]["message"]
+                    self.record_completion(request, message.get("content") or "", message.get("tool_calls"))
+        except Exception as e:
+            print(f"Corpus recording failed for {response.request.url}: {e}")
+
+
+corpus_recorder = CorpusRecorder(RECORD_CORPUS) if RECORD_CORPUS else None
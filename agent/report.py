@@ -0,0 +1,159 @@
+import os
+import json
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from clients import get_openai_client
+from cache import TieredCache, content_key
+from stream_json import StreamingObjectParser
+from metrics import llm_call
+
+REPORT_MODEL = "gpt-4o-mini"
+# Fields a report is written from. Review-derived fields (pros, cons,
+# insights, sentiment) and urls/images make up most of a product's size
+# and are not used by any report section.
+REPORT_PRODUCT_FIELDS = (
+    "title",
+    "price_text",
+    "rating_value",
+    "rating_count",
+    "model",
+    "availability",
+    "recommendation_score_out_of_100",
+)
+
+REPORT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "top_pick": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string"},
+                "summary": {"type": "string"},
+            }
+        },
+        "best_performance": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string"},
+                "summary": {"type": "string"},
+            }
+        },
+        "best_value_for_money": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string"},
+                "summary": {"type": "string"},
+            }
+        },
+        "products_specifications": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string"},
+                "specifications": {"type": "array", "items": {"type": "string"}},
+            }
+        }
+    }
+}
+
+SYSTEM_MSG1 = f"""You are a Products report generator
+Return STRICT JSON matching the provided JSON Schema
+
+Rules:
+- You are given a list of products.
+- You need to generate a report based on the given products.
+- You should also generate specifications for all the products that is given. Make sure to have at least 5 specifications for each product. Also the specs titles should be uniform for all the products. like processor, ram, storage, display, battery, weight, ports, os, etc. You need to use web search for the specifications.
+- The report should have the product with a top pick with a bit of summary.
+- The report should have the product with best performance with a bit of summary.
+- The report should have the product with best value for the money with a bit of summary
+
+JSON_SCHEMA:
+{json.dumps(REPORT_SCHEMA)}
+
+"""
+
+report_cache = TieredCache(
+    "reports",
+    ttl=float(os.getenv("REPORT_CACHE_TTL", str(24 * 60 * 60))),
+    max_memory_entries=int(os.getenv("REPORT_CACHE_MEMORY_ENTRIES", "256")),
+    max_disk_bytes=int(os.getenv("REPORT_CACHE_DISK_MB", "32")) * 1024 * 1024,
+)
+
+SectionCallback = Callable[[str, Any], Awaitable[None]]
+
+
+def project_products(products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        {k: p[k] for k in REPORT_PRODUCT_FIELDS if p.get(k) not in (None, "")}
+        for p in products
+        if isinstance(p, dict)
+    ]
+
+
+def report_key(products: List[Dict[str, Any]]) -> str:
+    """
+    Stable key of the report for a product set: same projected products,
+    prompt and model, same report, whatever the products' ids.
+    """
+    return content_key(REPORT_MODEL, SYSTEM_MSG1, project_products(products))
+
+
+async def generate_report(products: List[Dict[str, Any]], on_section: Optional[SectionCallback] = None) -> Dict[str, Any]:
+    """
+    Generate a report for the given products.
+    Reports are cached by report_key. With `on_section`, the completion is
+    streamed and each top-level section (top_pick, best_performance,
+    best_value_for_money, products_specifications) is passed on as soon as
+    it is complete.
+    """
+    projected = project_products(products)
+    key = report_key(products)
+    cached = await report_cache.get(key)
+    if cached is not None:
+        print("Report cache hit")
+        if on_section is not None:
+            for section, value in cached.items():
+                await on_section(section, value)
+        return cached
+
+    user = json.dumps(projected)
+    print(f"Report input: {len(user)} chars ({len(json.dumps(products))} before projection)")
+    client = get_openai_client()
+    messages = [
+        {"role": "system", "content": SYSTEM_MSG1},
+        {"role": "user", "content": user},
+    ]
+    with llm_call("generate_report", REPORT_MODEL) as call:
+        if on_section is None:
+            response = await client.chat.completions.create(
+                model=REPORT_MODEL,
+                response_format={"type": "json_object"},
+                messages=messages,
+            )
+            call.usage(response.usage)
+            content = response.choices[0].message.content
+        else:
+            stream = await client.chat.completions.create(
+                model=REPORT_MODEL,
+                response_format={"type": "json_object"},
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            parser = StreamingObjectParser()
+            parts = []
+            async for chunk in stream:
+                call.usage(chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ""
+                if not delta:
+                    continue
+                parts.append(delta)
+                for section, value in parser.feed(delta):
+                    await on_section(section, value)
+            content = "".join(parts)
+
+    report = json.loads(content)
+    if isinstance(report, dict):
+        await report_cache.set(key, report)
+    return report
@@ -0,0 +1,124 @@
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
+import asyncio
+# from copilotkit
+from copilotkit.integrations.fastapi import add_fastapi_endpoint
+from copilotkit import CopilotKitRemoteEndpoint, LangGraphAgent
+import os
+app = FastAPI()
+from shopping_assistant import graph
+from clients import close_clients
+from metrics import registry, monitor_event_loop
+from cache import extract_cache, structured_cache
+from tavily_search import extract_cache_requests
+from report import report_cache
+from intent_router import intent_router
+from speculation import speculation_stats
+from preprocess import page_executor
+
+
+sdk = CopilotKitRemoteEndpoint(
+    agents=[
+        LangGraphAgent(
+            name="shopping_agent",
+            description="A shopping agent that can help you find the best products for your needs by searching various retailers",
+            graph=graph
+        )
+    ]
+)
+
+add_fastapi_endpoint(app, sdk, "/copilotkit")
+app.add_event_handler("shutdown", close_clients)
+
+# Set once the worker has opened its checkpoint store and started its
+# preprocessing pool.
+worker_ready = asyncio.Event()
+
+
+async def check_checkpointer():
+    """Raise when the conversation checkpoint store cannot be read."""
+    ping = getattr(graph.checkpointer, "ping", None)
+    if ping is not None:
+        await asyncio.to_thread(ping)
+
+
+async def warm_up():
+    try:
+        await check_checkpointer()
+    except Exception as e:
+        print(f"Checkpoint store unavailable at startup: {e}")
+        return
+    try:
+        await page_executor.warm_up()
+    except Exception as e:
+        print(f"Preprocessing pool failed to start, pages will be processed inline: {e}")
+        page_executor.kind = "inline"
+    worker_ready.set()
+
+
+app.add_event_handler("startup", warm_up)
+
+loop_monitor: "asyncio.Task | None" = None
+
+
+async def start_loop_monitor():
+    global loop_monitor
+    loop_monitor = asyncio.create_task(monitor_event_loop())
+
+
+async def stop_background_work():
+    if loop_monitor is not None:
+        loop_monitor.cancel()
+    page_executor.shutdown()
+
+
+app.add_event_handler("startup", start_loop_monitor)
+app.add_event_handler("shutdown", stop_background_work)
+
+
+@app.get("/health")
+def health():
+    """Health check."""
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness check: 503 until the worker is warmed up and while its
+    checkpoint store is unreachable. /health only says the process is up.
+    """
+    if not worker_ready.is_set():
+        return JSONResponse({"status": "starting"}, status_code=503)
+    try:
+        await check_checkpointer()
+    except Exception as e:
+        return JSONResponse({"status": "unavailable", "error": str(e)}, status_code=503)
+    return {"status": "ready", "pid": os.getpid()}
+
+
+@registry.collector
+def agent_counters():
+    """Counters the agent keeps in its own modules, read at scrape time."""
+    caches = (structured_cache, report_cache)
+    # Extract cache lookups are broken down by retailer.
+    yield ("agent_cache_requests_total", "counter", "Cache lookups by cache, result and (extract cache) retailer", [
+        ({"cache": extract_cache.namespace, "retailer": retailer, "result": result}, count)
+        for (retailer, result), count in sorted(extract_cache_requests.items())
+    ] + [
+        ({"cache": cache.namespace, "result": result}, count)
+        for cache in caches for result, count in (("hit", cache.hits), ("miss", cache.misses))
+    ])
+    yield ("intent_router_turns_total", "counter", "Turns seen by the intent router by route", [
+        ({"route": route}, intent_router.stats[route]) for route in ("search", "edit", "fallback")
+    ])
+    yield ("speculative_search_total", "counter", "Speculative searches by outcome", [
+        ({"outcome": outcome}, count) for outcome, count in sorted(speculation_stats.items())
+    ])
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics of this worker."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
@@ -1,23 +1,38 @@
 from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, START, END, MessagesState
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.types import Command
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import AIMessage
-from copilotkit.langgraph import copilotkit_emit_state, copilotkit_customize_config, CopilotKitState
+from copilotkit.langgraph import copilotkit_customize_config, CopilotKitState
 from typing import List
 import os, json, re, asyncio
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Mapping, Union, Callable, Awaitable
 from urllib.parse import urlparse, urljoin
 import uuid
-from tavily import TavilyClient
-from openai import AsyncOpenAI
+from clients import get_openai_client, get_chat_model
+from tavily_search import search_retailers, extract_with_cache, retry_budget
+from cache import structured_cache, content_key
+from url_tokens import UrlTokenizer, SearchUrlIndex
+from preprocess import page_executor, prepare_page, page_hints
+from prompt_builder import PromptTemplate, BuiltPrompt
+from validation import ProductSalvager
+from stream_json import StreamingArrayParser
+from emitter import StateEmitter, emit_tool_call
+from intent_router import intent_router
+from speculation import SpeculativeSearch, SPECULATIVE_SEARCH, SPECULATIVE_EXTRACT
+from background import background_tasks
+from report import generate_report, report_key
+from checkpointer import make_checkpointer
+from product_store import ProductStore, list_products_args, compact_product_tool_calls
+from metrics import span, record_span, traced, annotate, llm_call
+from ratelimit import current_session, overloaded, searches_rejected, openai_limiter
+from hedging import hedged, DeadlineExceeded
+from openai import RateLimitError
+from tavily.errors import UsageLimitExceededError
 from bs4 import BeautifulSoup
 from jsonschema import Draft202012Validator, ValidationError
 from dotenv import load_dotenv
 import re
 from urllib.parse import unquote
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import random
 load_dotenv()
@@ -30,53 +45,88 @@ class AgentState(CopilotKitState):
     products: List
     favorites: List
     buffer_products: List
+    # Products streamed to the canvas while a search is still running.
+    preview_products: List
     wishlist: List
     logs: List
     report: str
     show_results: bool
     canvas_logs : dict = { "title" : "", "subtitle" : "" }
+    # Set once the thread's history has been through compact_history.
+    history_compacted: bool
 
 
+@traced("agent_node")
 async def agent_node(state: AgentState, config: RunnableConfig) -> AgentState:
     """
     This is the chat node of the agent.
     It is a function that takes in the state of the agent and the config and returns the state of the agent.
     """
+    speculation = None
     try:
         if config is None:
             config = RunnableConfig(recursion_limit=25)
         else:
             # Use CopilotKit's custom config functions to properly set up streaming
             config = copilotkit_customize_config(config, emit_messages=False, emit_tool_calls=True)
+        emitter = StateEmitter(config, state)
         state["canvas_logs"] = {
             "title" : f"Parsing your request",
             "subtitle" : "Deciding to run product search or not"
         }
-        await copilotkit_emit_state(config, state)
-        await asyncio.sleep(0)
+        await emitter.flush()
         if not os.getenv("TAVILY_API_KEY"):
             raise RuntimeError("Missing TAVILY_API_KEY")
         if not os.getenv("OPENAI_API_KEY"):
             raise RuntimeError("Missing OPENAI_API_KEY")
+        thread_id = (config.get("configurable") or {}).get("thread_id")
+        annotate(thread_id=thread_id)
+        # Provider calls of this turn queue fairly against other sessions'.
+        current_session.set(str(thread_id))
         if state['messages'][-1].type == 'ai':
-            result =await generate_report(state["products"])
+            # Sections are shown as they stream in. A report prefetched for
+            # exactly this canvas is reused; one for a canvas that has
+            # changed since is cancelled.
+            state["report"] = {}
+            await emitter.flush()
+
+            async def publish_section(section: str, value: Any) -> None:
+                state["report"] = {**state["report"], section: value}
+                await emitter.emit()
+
+            prefetched = background_tasks.take(thread_id, "report", report_key(state["products"]))
+            print(f"Report prefetch {'hit' if prefetched else 'miss'}")
+            result = None
+            if prefetched is not None:
+                try:
+                    # Shielded: a cancelled turn must not take the prefetch
+                    # down with it and then pass for an invalidated one.
+                    result = await asyncio.shield(prefetched)
+                except asyncio.CancelledError:
+                    if asyncio.current_task().cancelling() or not prefetched.cancelled():
+                        raise
+                except Exception as e:
+                    print(f"Prefetched report failed: {e}")
+            if result is None:
+                result = await generate_report(state["products"], on_section=publish_section)
+            state["report"] = result
+            await emitter.close()
             print(result, "result")
             return Command(
                 goto=END,
                 update={
                     **state,
-                    "report" : json.loads(result)
+                    "report" : result
                 }
             )
-        model = ChatOpenAI(model="gpt-4o-mini")
+        model = get_chat_model("gpt-4o-mini")
         state["logs"].append({
             "message" : "Analyzing user query",
             "status" : "processing"
         })
-        await copilotkit_emit_state(config, state)
-        await asyncio.sleep(1)
+        await emitter.step()
         state["logs"][-1]["status"] = "completed"
-        await copilotkit_emit_state(config, state)
+        await emitter.emit()
         query = state["messages"][-1].content
         products_for_prompt = []
         wishlist_for_prompt = []
@@ -95,7 +145,7 @@ async def agent_node(state: AgentState, config: RunnableConfig) -> AgentState:
                 state["messages"].append(AIMessage(id=state["messages"][-2].tool_calls[0]['id'], type="ai",  content='Some more products also has been added to be shown in the canvas'))
                 state["logs"] = []
                 state["show_results"] = True
-                await copilotkit_emit_state(config, state)
+                await emitter.close()
                 return Command(
                     goto=END,
                     update={
@@ -106,7 +156,7 @@ async def agent_node(state: AgentState, config: RunnableConfig) -> AgentState:
             if(state["messages"][-1].content == "Rejected"):
                 state["messages"].append(AIMessage(id=state["messages"][-2].tool_calls[0]['id'], type="ai",  content='You have rejected the products. Please try any other product search.'))
                 state["logs"] = []
-                await copilotkit_emit_state(config, state)
+                await emitter.close()
                 return Command(
                     goto=END,
                     update={
@@ -117,7 +167,7 @@ async def agent_node(state: AgentState, config: RunnableConfig) -> AgentState:
             if(state["messages"][-1].content == "Accepted"):
                 state["messages"].append(AIMessage(id=state["messages"][-2].tool_calls[0]['id'], type="ai",  content='The top 5 products have been added to the canvas.'))
                 state["logs"] = []
-                await copilotkit_emit_state(config, state)
+                await emitter.close()
                 return Command(
                     goto=END,
                     update={
@@ -130,7 +180,7 @@ async def agent_node(state: AgentState, config: RunnableConfig) -> AgentState:
             state["logs"] = []
             if len(state["products"]) > 0:
                 state["show_results"] = True
-            await copilotkit_emit_state(config, state)
+            await emitter.close()
                 
             return Command(
                 goto=END,
@@ -156,15 +206,49 @@ async def agent_node(state: AgentState, config: RunnableConfig) -> AgentState:
         """
         # system_message = ''
         state["copilotkit"]["actions"] = list(filter(lambda x: x['name'] == "edit_product_canvas", state["copilotkit"]["actions"]))
-        response0 = await model.bind_tools([
-            *state["copilotkit"]["actions"]
-        ]).ainvoke([
-            system_message,
-            *messages
-        ],config=config)
+        # Clear-cut searches and single-product edits skip the classification call.
+        can_edit = bool(state["copilotkit"]["actions"])
+        with span("classification", source="router"):
+            route = intent_router.route(query, products_for_prompt if can_edit else [], wishlist_for_prompt if can_edit else [])
+        print(f"Intent router: {route.intent + f' ({route.confidence:.2f})' if route else 'model'}; {intent_router.summary()}")
+        max_search_results = 6
+        target_follow = 6
+
+        async def extract_urls(urls: List[str], retailer: str) -> List[Dict[str, Any]]:
+            try:
+                print(f"Extracting urls for {retailer}. Started at {datetime.now()}")
+                with span("extract", retailer=retailer):
+                    return await extract_with_cache(urls, retailer, extract_depth="advanced", include_images=True, timeout=EXTRACT_TIMEOUT)
+            except Exception as e:
+                print(f"Error extracting urls: {e}")
+                return []
+
+        # When the model has to classify the turn, the search can already
+        # run alongside it; it is discarded unless the answer is SEARCH.
+        if route is None and SPECULATIVE_SEARCH:
+            speculation = SpeculativeSearch(
+                lambda: search_retailers(query, RETAILERS, max_results=max_search_results),
+                extract_urls if SPECULATIVE_EXTRACT else None,
+            )
+        if route is not None and route.intent == "edit":
+            await emit_tool_call(config, route.tool_call)
+            response0 = AIMessage(content='', tool_calls=[route.tool_call])
+        elif route is not None:
+            response0 = AIMessage(content='SEARCH')
+        else:
+            with span("classification", source="model"), llm_call("classification", model.model_name) as call:
+                response0 = await model.bind_tools([
+                    *state["copilotkit"]["actions"]
+                ]).ainvoke([
+                    system_message,
+                    *messages
+                ],config=config)
+                call.usage(response0.usage_metadata)
+        if speculation is not None and not (response0.content or "").startswith('SEARCH'):
+            speculation.discard()
         if hasattr(response0, "tool_calls") and response0.tool_calls and response0.content == '':        
             state["logs"] = []
-            await copilotkit_emit_state(config, state)
+            await emitter.close()
             state["messages"].append(AIMessage(id=str(uuid.uuid4()), type="ai",  tool_calls=response0.tool_calls, content=''))
             return Command(
                 goto=END,
@@ -176,7 +260,7 @@ async def agent_node(state: AgentState, config: RunnableConfig) -> AgentState:
         if (not response0.content.startswith('SEARCH')):
             state["messages"].append(AIMessage(id=str(uuid.uuid4()), type="ai",  content=response0.content))
             state["logs"] = []
-            await copilotkit_emit_state(config, state)
+            await emitter.close()
             return Command(
                 goto=END,
                 update={
@@ -184,43 +268,42 @@ async def agent_node(state: AgentState, config: RunnableConfig) -> AgentState:
                     "messages" : state["messages"]
                 }
             )
-        
-        
-        
-        
-        
+        if overloaded():
+            # Provider queues are full; a new search would only deepen them.
+            searches_rejected.inc()
+            if speculation is not None:
+                speculation.discard()
+            state["messages"].append(AIMessage(id=str(uuid.uuid4()), type="ai", content=BUSY_MESSAGE))
+            state["logs"] = []
+            await emitter.close()
+            return Command(
+                goto=END,
+                update={
+                    "buffer_products" : state["buffer_products"],
+                    "messages" : state["messages"]
+                }
+            )
+
         query = state["messages"][-1].content
-        max_search_results = 6
-        target_follow = 6
         state["show_results"] = False
-        await copilotkit_emit_state(config, state)
-        tv = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+        state["preview_products"] = []
+        # The chat name depends on the query only; generate it alongside the search.
+        chat_name_task = background_tasks.start(thread_id, "chat_name", query, lambda: generate_name_for_chat(query))
+        await emitter.emit()
         results_all: List[Dict[str, Any]] = []
-        total_mappings_list = []
+        url_index = SearchUrlIndex()
         state["logs"].append({
             "message" : "Identifying the sites to search",
             "status" : "processing"
         })
-        await copilotkit_emit_state(config, state)
-        await asyncio.sleep(1)
+        await emitter.step()
         state["logs"][-1]["status"] = "completed"
-        await copilotkit_emit_state(config, state)
-        # 1) Broad search across retailers
-        urls = {}
-        for retailer in RETAILERS:
-            search = tv.search(
-                query=query,
-                include_domains=[retailer],
-                include_answer=False,
-                include_images=False,
-                include_raw_content=False,
-                search_depth="advanced",
-                max_results=max_search_results,
-            )
-                
-            urls[retailer] = [r["url"] for r in search.get("results", []) if r.get("url")]
-            if not urls[retailer]:
-                continue
+        await emitter.emit()
+        # 1) Broad search across retailers, all retailers in flight at once
+        if speculation is not None:
+            urls = await speculation.result()
+        else:
+            urls = await search_retailers(query, RETAILERS, max_results=max_search_results)
 
         state["logs"].append({
             "message" : "Extracting the sites",
@@ -230,135 +313,166 @@ async def agent_node(state: AgentState, config: RunnableConfig) -> AgentState:
             "title" : "Checking Amazon, eBay and Target for matching products",
             "subtitle" : "Tavily extraction in progress...."
         }
-        await copilotkit_emit_state(config, state)
-        await asyncio.sleep(1)
-        # 2) First extract pass
-        
-        
-        def extract_urls(urls: List[str], retailer: str) -> Dict[str, Any]:
-            try:
-                print(f"Extracting urls for {retailer}. Started at {datetime.now()}")
-                ext1 = tv.extract(urls, extract_depth="advanced", include_images=True, timeout=120)
-                return [ext1, retailer]
-            except Exception as e:
-                print(f"Error extracting urls: {e}")
-                return None
+        await emitter.step()
+        # 2) Extract each retailer and structure its pages as soon as its
+        # extract batch lands, without waiting for the other retailers.
         ext_results = {}
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            futures = {executor.submit(extract_urls, urls[retailer], retailer) : retailer for retailer in RETAILERS}
-            
-            for future in as_completed(futures):
-                result = future.result()
-                ext_results[result[1]] = result[0].get("results", [])
-                if result == None:
-                    print("Condition met! Cancelling remaining tasks...")
-                    # Cancel all futures not yet started
-                    for f in futures:
-                        f.cancel()
-                    break
-
-        
-        
-        
-        state["logs"][-1]["status"] = "completed"
-        await copilotkit_emit_state(config, state)
-        
-        target_listing_pdps: List[str] = []
-        done = False
-        state["logs"].append({
-            "message" : "Processing the data",
-            "status" : "processing"
-        })
-        await copilotkit_emit_state(config, state)
-        # await asyncio.sleep(1)
+        extract_retailers = [retailer for retailer in RETAILERS if urls.get(retailer)]
+        extracted_count = 0
         products_from_each_site= {
             "target.com" : [],
             "amazon.com" : [],
             "ebay.com" : []
         }
-        
-        retailer_counters = {
-            "target.com": {"product": 0, "image": 0},
-            "amazon.com": {"product": 0, "image": 0},
-            "ebay.com": {"product": 0, "image": 0}
-        }
-        async def process_data(ext_results1: Dict[str, Any], retailer: str, retailer_counters: Dict[str, Dict[str, int]]) -> str:
+        structure_semaphore = asyncio.Semaphore(STRUCTURE_CONCURRENCY)
+        streamed_products: List[Dict[str, Any]] = []
+        # The same products with placeholder URLs, for a search that passes
+        # STRUCTURE_DEADLINE before their pages finish.
+        streamed_by_site: Dict[str, List[Dict[str, Any]]] = {site: [] for site in products_from_each_site}
+
+        async def publish_product(product: Dict[str, Any], retailer: str) -> None:
+            # Push each product to the canvas preview as soon as it is
+            # validated, long before the whole pipeline has finished.
+            streamed_by_site[retailer].append(product)
+            restored = apply_url_mappings_to_products([product], url_index.to_original)[0]
+            restored["id"] = str(uuid.uuid4())
+            streamed_products.append(restored)
+            state["preview_products"] = list(streamed_products)
+            state["canvas_logs"] = {
+                "title" : f"Found {len(streamed_products)} products so far",
+                "subtitle" : restored["title"]
+            }
+            await emitter.emit()
+
+        async def structure_page(item: Dict[str, Any], retailer: str) -> List[Dict[str, Any]]:
+            url = item["url"]
+            raw = item.get("raw_content") or ""
+            if not raw:
+                return []
+            # Tokenizing and distilling run on the preprocessing executor with
+            # page-local placeholder numbers; the search-wide numbers are
+            # assigned here, synchronously, so pages never share numbers.
+            prepared = await page_executor.run(prepare_page, raw, retailer, query, size=len(raw))
+            for stage, start, end in prepared.timings:
+                record_span(stage, start, end, retailer=retailer)
+            page = url_index.tokenizer(retailer).adopt(prepared.page)
+            dom = retailer_of(url)
+            detail_hint = is_pdp(url)
+            distilled = prepared.distilled._replace(text=page.to_global(prepared.distilled.text))
+            print(f"Distilled {url}: {distilled.input_chars} -> {distilled.output_chars} chars ({distilled.blocks_kept}/{distilled.blocks_in} blocks)")
+            # Cache keys use the page-local numbering so the same page hits
+            # whatever position it had in this search.
+            page_key = structured_cache_key(prepared.distilled.text, detail_hint)
+            streamed = False
+            cacheable = True
+            try:
+                cached = await structured_cache.get(page_key)
+                if cached is not None:
+                    print(f"Structured cache hit for {url}")
+                    data = json.loads(page.to_global(json.dumps(cached)))
+                else:
+                    # Fast path: products straight from schema.org JSON-LD,
+                    # with the model used at most to add review fields.
+                    hints = await page_executor.run(
+                        page_hints, raw, prepared.page.text, url, retailer, "target.com" in dom, size=len(raw)
+                    )
+                    structured_products = hints.structured_products
+                    if structured_products and not STRUCTURED_DATA_ENRICH:
+                        print(f"Structured data for {url}: {len(structured_products)} products, LLM skipped")
+                        data = {"products": fill_missing_review_fields(structured_products)}
+                    else:
+                        async with structure_semaphore:
+                            if len(products_from_each_site[retailer]) > 2:
+                                return []
+                            if structured_products:
+                                print(f"Structured data for {url}: {len(structured_products)} products, enriching reviews")
+                                try:
+                                    with span("llm_structuring", retailer=retailer, mode="enrich"):
+                                        data = {"products": await enrich_products(structured_products, distilled.text)}
+                                except Exception as e:
+                                    print(f"Review enrichment failed for {url}: {e}")
+                                    data = {"products": fill_missing_review_fields(structured_products)}
+                            else:
+                                print(f"Calling LLM for {url}")
+                                assist = json.loads(page.to_global(json.dumps(hints.assist))) if hints.assist else None
+                                prompt = build_extraction_prompt(distilled.text, url, assist=assist, detail_hint=detail_hint)
+                                print(f"Prompt for {url}: {prompt.total_tokens} tokens (page {prompt.page_tokens}{', truncated' if prompt.truncated else ''})")
+                                try:
+                                    with span("llm_structuring", retailer=retailer, mode="extract"):
+                                        data = await call_llm(prompt.text, on_product=(lambda product: publish_product(product, retailer)) if STREAM_PRODUCTS else None)
+                                except DeadlineExceeded as e:
+                                    # Keep what was streamed, but don't cache a partial page.
+                                    data, cacheable = e.partial, False
+                                    print(f"{e} for {url}; keeping {len(data['products'])} products")
+                                streamed = STREAM_PRODUCTS
+                    if cacheable:
+                        await structured_cache.set(
+                            page_key,
+                            json.loads(page.to_local(json.dumps(data))),
+                        )
+                print(f"Completed extracting {url}")
+            except Exception as e:
+                # If LLM fails, skip this page
+                print(f"LLM 1st-pass failed for {url}: {e}")
+                return []
+
+            data.setdefault("source_url", url)
+            data.setdefault("retailer", dom)
+            if not streamed:
+                for product in data["products"]:
+                    await publish_product(product, retailer)
+            return data["products"]
+
+        async def process_data(retailer: str) -> str:
+            nonlocal extracted_count
+            speculative = speculation.extraction(retailer) if speculation is not None else None
+            ext_results[retailer] = await (speculative or extract_urls(urls[retailer], retailer))
+            extracted_count += 1
+            if extracted_count == len(extract_retailers):
+                state["logs"][-1]["status"] = "completed"
+                state["logs"].append({
+                    "message" : "Processing the data",
+                    "status" : "processing"
+                })
+                await emitter.emit()
             print(f"Processing data for {retailer}. Started at {datetime.now()}")
-            for item in ext_results1:
-                url = item["url"]
-                raw = item.get("raw_content") or ""
-                if not raw:
-                    return None
-                product_base = ""
-                image_base = ""
-                if retailer == "target.com":
-                    product_base = "https://tgt.com/url{}"
-                    image_base = "https://tgt.com/img/url{}"
-                elif retailer == "amazon.com":
-                    product_base = "https://amzn.com/url{}"
-                    image_base = "https://amzn.com/img/url{}"
-                elif retailer == "ebay.com":
-                    product_base = "https://ebay.com/url{}"
-                    image_base = "https://ebay.com/img/url{}"
-                modiefied_text, mappings_list, updated_product_counter, updated_image_counter = replace_urls_with_product_and_image_links(text= raw, product_base= product_base, image_base=image_base, product_counter=retailer_counters[retailer]["product"], image_counter=retailer_counters[retailer]["image"])
-                # modiefied_text, mappings_list = replace_urls_with_product_and_image_links(raw)
-                retailer_counters[retailer]["product"] = updated_product_counter
-                retailer_counters[retailer]["image"] = updated_image_counter
-                # total_mappings_list.extend(mappings_list)
-                total_mappings_list.extend(mappings_list)
-                dom = retailer_of(url)
-                detail_hint = is_pdp(url)
-                assist = parse_target_structured(modiefied_text) if "target.com" in dom else None
-                prompt = build_llm_prompt(modiefied_text, url, assist=assist, detail_hint=detail_hint)
-                try:
+            page_tasks = [asyncio.create_task(structure_page(item, retailer)) for item in ext_results[retailer]]
+            try:
+                for next_page in asyncio.as_completed(page_tasks):
+                    products_from_each_site[retailer] += await next_page
                     if len(products_from_each_site[retailer]) > 2:
+                        # Quota reached: the remaining pages are no longer needed.
                         break
-                    print(f"Calling LLM for {url}")
-                    # state["canvas_logs"] = {
-                    #     "title" : "Structuring product content from site's markdown",
-                    #     "subtitle" : "LLM processing in progress...."
-                    # }
-                    # await copilotkit_emit_state(config, state)
-                    # await asyncio.sleep(2)
-                    # state["canvas_logs"] = {
-                    #     "title" : f"Processing the Markdown content from {unquote(url)}",
-                    #     "subtitle" : "LLM processing in progress...."
-                    # }
-                    # await copilotkit_emit_state(config, state)
-                    # await asyncio.sleep(0)
-                    data = await call_llm(prompt)
-                    print(f"Completed extracting {url}")
-                    done = True
-                except Exception as e:
-                    # If LLM fails, skip this page
-                    print(f"LLM 1st-pass failed for {url}: {e}")
-                    continue
-
-                data.setdefault("source_url", url)
-                data.setdefault("retailer", dom)
-                products_from_each_site[retailer] += data["products"]
+            finally:
+                for task in page_tasks:
+                    task.cancel()
             return "Completed"
 
         async def logs_function():
             print("Placeholder parallel task started")
             try:
                 print("logs started")
-                # Build a flat list of URLs from ext_results
-                urls_only = []
-                try:
-                    for retailer, items in (ext_results or {}).items():
-                        if not isinstance(items, list):
-                            continue
-                        for item in items:
-                            candidate_url = item.get("url") if isinstance(item, dict) else (item if isinstance(item, str) else None)
-                            if isinstance(candidate_url, str) and candidate_url.startswith("http"):
-                                urls_only.append(candidate_url)
-                except Exception as inner_e:
-                    print(f"Error extracting urls_only: {inner_e}")
-
-                print(f"Extracted {len(urls_only)} URLs")
                 while True :
+                    # Build a flat list of URLs from ext_results; it fills in
+                    # as each retailer's extraction lands.
+                    urls_only = []
+                    try:
+                        for retailer, items in (ext_results or {}).items():
+                            if not isinstance(items, list):
+                                continue
+                            for item in items:
+                                candidate_url = item.get("url") if isinstance(item, dict) else (item if isinstance(item, str) else None)
+                                if isinstance(candidate_url, str) and candidate_url.startswith("http"):
+                                    urls_only.append(candidate_url)
+                    except Exception as inner_e:
+                        print(f"Error extracting urls_only: {inner_e}")
+                    if not urls_only:
+                        await asyncio.sleep(1)
+                        continue
                     for url in urls_only:
+                        if streamed_products:
+                            # Real progress ("Found N products so far") takes over.
+                            return
                         if(random.random() < 0.3):
                             state["canvas_logs"]={
                                 "title" : f"Processing the Markdown content from {unquote(url)}",
@@ -375,55 +489,77 @@ async def agent_node(state: AgentState, config: RunnableConfig) -> AgentState:
                                 "subtitle" : "LLM processing in progress...."
                             }
                         
-                        await copilotkit_emit_state(config, state)
+                        await emitter.emit()
                         await asyncio.sleep(4)
             except Exception as e:
                 print(f"Placeholder parallel task failed: {e}")
-                # return f"Placeholder task failed: {e}"
 
-        
-        # for retailer in ext_results:
-        tasks = [asyncio.create_task(process_data(ext_results[retailer], retailer, retailer_counters)) for retailer in ext_results]
-        # tasks.append(placeholder_parallel_task())  # Add the placeholder task to run in parallel
+        tasks = [asyncio.create_task(process_data(retailer)) for retailer in extract_retailers]
         gather_task = asyncio.gather(*tasks, return_exceptions=True)
         logs_task = asyncio.create_task(logs_function())
-        results = await gather_task
+        try:
+            results = await asyncio.wait_for(gather_task, STRUCTURE_DEADLINE)
+        except asyncio.TimeoutError:
+            # Backstop over the per-call deadlines: go on with the products
+            # of the finished pages and those already streamed from the
+            # unfinished ones, which the user has seen in the preview.
+            for retailer, streamed in streamed_by_site.items():
+                seen = {(p.get("product_url"), p.get("title")) for p in products_from_each_site[retailer]}
+                products_from_each_site[retailer] += [p for p in streamed if (p.get("product_url"), p.get("title")) not in seen]
+            print(f"Extraction passed its {STRUCTURE_DEADLINE:.0f}s deadline; continuing with {sum(map(len, products_from_each_site.values()))} products")
+            results = []
         
         logs_task.cancel()
         
         for i, result in enumerate(results):
             if isinstance(result, Exception):
                 print(f"Task failed with exception: {result}")
-            elif result is None:
-                print("Condition met in one of the tasks")
+        if not extract_retailers:
+            state["logs"][-1]["status"] = "completed"
+            state["logs"].append({
+                "message" : "Processing the data",
+                "status" : "processing"
+            })
         
         
-        results_all = combine_products_from_sites(products_from_each_site)
+        with span("combine"):
+            results_all = combine_products_from_sites(products_from_each_site)
         print(len(results_all), "results_all here")
         
         for item in results_all:
             item["id"] = str(uuid.uuid4())
         state["logs"][-1]["status"] = "completed"
-        await copilotkit_emit_state(config, state)
+        await emitter.emit()
         
-        updated_products = apply_url_mappings_to_products(results_all, total_mappings_list)
+        with span("url_rewrite", op="restore"):
+            updated_products = apply_url_mappings_to_products(results_all, url_index.to_original)
         print(len(updated_products), "updated_products here")
         state["buffer_products"] = updated_products
         # state["buffer_products"] = results_all
         print("HERE")
-        chat_name = await generate_name_for_chat(query)
+        chat_name = await chat_name_task
         print(chat_name, "chat_name here")
         # await copilotkit_emit_state(config, state)
-        state["messages"].append(AIMessage(id=str(uuid.uuid4()), tool_calls=[{"name": "list_products", "args": {"products": state["buffer_products"][:5], "buffer_products" : state["buffer_products"], "chat_name" : chat_name}, "id": str(uuid.uuid4())}], type="ai",  content=''))
+        # The tool call carries ids and the preview refs only; the products
+        # themselves travel once, in buffer_products.
+        product_store = ProductStore(state["buffer_products"])
+        product_ids = [product["id"] for product in state["buffer_products"]]
+        state["messages"].append(AIMessage(id=str(uuid.uuid4()), tool_calls=[{"name": "list_products", "args": list_products_args(product_store, product_ids, chat_name), "id": str(uuid.uuid4())}], type="ai",  content=''))
+        if REPORT_PREFETCH and product_ids:
+            # Accepting the results puts the preview products on the canvas;
+            # have their report ready for when it is asked for.
+            preview = product_store.resolve(product_ids[:5])
+            background_tasks.start(thread_id, "report", report_key(preview), lambda: generate_report(preview))
         state["logs"] = []
         # await copilotkit_emit_state(config, state)
         state["show_results"] = True
-        await copilotkit_emit_state(config, state)
+        await emitter.close()
         return Command(
             goto=END,
             update={
                 "messages": state["messages"],
                 "buffer_products" : state["buffer_products"],
+                "preview_products" : [],
                 "report" : None,
                 "canvas_logs" : {
                     "title" : "Awaiting confirmation from the user",
@@ -433,7 +569,14 @@ async def agent_node(state: AgentState, config: RunnableConfig) -> AgentState:
         )
     except Exception as e:
         print(e, "error")
-        if hasattr(e, 'code') and e.code == "context_length_exceeded":
+        if "emitter" in locals():
+            emitter.cancel()
+        if speculation is not None:
+            speculation.close()
+        if isinstance(e, (RateLimitError, UsageLimitExceededError)):
+            state["messages"].append(AIMessage(content=BUSY_MESSAGE, id=str(uuid.uuid4()), type="ai"))
+            state["logs"] = []
+        elif hasattr(e, 'code') and e.code == "context_length_exceeded":
             error_message = AIMessage(content="Context length limit exceeded. Please try your query in a new chat.", id=str(uuid.uuid4()), type="ai")
             state["logs"] = []
             state["messages"].append(error_message)
@@ -454,48 +597,49 @@ async def agent_node(state: AgentState, config: RunnableConfig) -> AgentState:
     
 
 
-async def generate_report(products: List[Dict[str, Any]]) -> str:
-    """
-    Generate a report for the given products.
-    """
-    client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    response = await client.chat.completions.create(
-        model="gpt-4o-mini",
-        response_format= {"type": "json_object"},
-        messages=[
-            {"role": "system", "content": SYSTEM_MSG1},
-            {"role": "user", "content": json.dumps(products)}
-        ]
-    )
-    return response.choices[0].message.content
-
-
-
 async def generate_name_for_chat(query: str) -> str:
     """
     Generate a report for the given products.
     """
     try:
-        client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": SYSTEM_MSG2},
-                {"role": "user", "content": query}
-            ]
-        )
+        client = get_openai_client()
+        with llm_call("generate_name_for_chat", "gpt-4o-mini") as call:
+            response = await client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": SYSTEM_MSG2},
+                    {"role": "user", "content": query}
+                ]
+            )
+            call.usage(response.usage)
         return response.choices[0].message.content
     except Exception as e:
         print(e, "error")
         raise e
 
+def compact_history(state: AgentState) -> Dict[str, Any]:
+    """
+    Runs once per thread, before its first turn through agent_node: rewrites
+    list_products tool calls written before tool calls carried product ids.
+    """
+    compacted = compact_product_tool_calls(state["messages"])
+    if compacted:
+        print(f"Compacted {compacted} list_products tool calls to product ids")
+    return {"messages": state["messages"] if compacted else [], "history_compacted": True}
+
+
+def entry_node(state: AgentState) -> str:
+    return "agent" if state.get("history_compacted") else "compact_history"
+
+
 workflow = StateGraph(AgentState)
+workflow.add_node("compact_history", compact_history)
 workflow.add_node("agent", agent_node)
-workflow.set_entry_point("agent")
-workflow.add_edge(START, "agent")
+workflow.add_conditional_edges(START, entry_node, ["compact_history", "agent"])
+workflow.add_edge("compact_history", "agent")
 workflow.add_edge("agent", END)
 
-memory = MemorySaver()
+memory = make_checkpointer()
 graph = workflow.compile(checkpointer=memory)
 
 
@@ -558,39 +702,33 @@ PRODUCTS_SCHEMA = {
     "required": ["products"],
     "additionalProperties": False,
 }
-REPORT_SCHEMA = {
+REVIEW_FIELDS = [
+    "pros",
+    "cons",
+    "key_insights_from_reviews",
+    "review_sentiment",
+    "recommendation_score_out_of_100",
+    "would_buy_again_score_out_of_100",
+]
+ENRICH_SCHEMA = {
     "type": "object",
     "properties": {
-        "top_pick": {
-            "type": "object",
-            "properties": {
-                "name": {"type": "string"},
-                "summary": {"type": "string"},
-            }
-        },
-        "best_performance": {
-            "type": "object",
-            "properties": {
-                "name": {"type": "string"},
-                "summary": {"type": "string"},
-            }
-        },
-        "best_value_for_money": {
-            "type": "object",
-            "properties": {
-                "name": {"type": "string"},
-                "summary": {"type": "string"},
-            }
+        "products": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["index"],
+                "properties": {
+                    "index": {"type": "integer"},
+                    **{k: PRODUCTS_SCHEMA["properties"]["products"]["items"]["properties"][k] for k in REVIEW_FIELDS},
+                },
+            },
         },
-        "products_specifications": {
-            "type": "object",
-            "properties": {
-                "name": {"type": "string"},
-                "specifications": {"type": "array", "items": {"type": "string"}},
-            }
-        }
-    }
+    },
+    "required": ["products"],
 }
+ENRICH_VALIDATOR = Draft202012Validator(ENRICH_SCHEMA)
+product_salvager = ProductSalvager(PRODUCTS_SCHEMA)
 SYSTEM_MSG = """You are a precise web data extractor
 Return STRICT JSON matching the provided JSON Schema.
 
@@ -605,22 +743,6 @@ Rules:
 - Output ONLY minified JSON, no commentary.
 - If the content has a product detail which is not relevant to other product details, then don't include that odd product detail in the product details.
 """
-SYSTEM_MSG1 = f"""You are a Products report generator
-Return STRICT JSON matching the provided JSON Schema
-
-Rules:
-- You are given a list of products.
-- You need to generate a report based on the given products.
-- You should also generate specifications for all the products that is given. Make sure to have at least 5 specifications for each product. Also the specs titles should be uniform for all the products. like processor, ram, storage, display, battery, weight, ports, os, etc. You need to use web search for the specifications.
-- The report should have the product with a top pick with a bit of summary.
-- The report should have the product with best performance with a bit of summary.
-- The report should have the product with best value for the money with a bit of summary
-
-JSON_SCHEMA:
-{json.dumps(REPORT_SCHEMA)}
-
-"""
-
 SYSTEM_MSG2 = """
 You are a name generator for a chat. You will be given a user query and you need to generate a name for the chat based on the query.
 # RULES:
@@ -629,6 +751,39 @@ You are a name generator for a chat. You will be given a user query and you need
 - The name of the chat should be professional and should not be too casual.
 """
 
+SYSTEM_MSG3 = """You are a product review analyst
+Return STRICT JSON matching the provided JSON Schema.
+
+Rules:
+- You are given products already extracted from a web page, each with an index, and the page content.
+- For every product return its index with "pros" and "cons" as array of strings. Make sure to have 2 pros and 2 cons. If you cant find pros and cons from the text data, Generate it yourself.
+- Provide at least 5 "key_insights_from_reviews" and "review_sentiment" (scores in [0,1]), "recommendation_score_out_of_100" and "would_buy_again_score_out_of_100".
+- Do not repeat titles, prices, urls or any other field.
+- Output ONLY minified JSON, no commentary.
+"""
+
+
+LLM_EXTRACTION_MODEL = "gpt-5-mini"
+# Products found in JSON-LD are sent to the model only to add review
+# fields (pros, cons, insights); set to 0 to skip that call entirely.
+STRUCTURED_DATA_ENRICH = os.getenv("STRUCTURED_DATA_ENRICH", "1") == "1"
+# Page content sent along with the enrichment call.
+ENRICH_MAX_CHARS = int(os.getenv("ENRICH_MAX_CHARS", "20000"))
+# Stream extraction completions and push products to the canvas one by one.
+STREAM_PRODUCTS = os.getenv("STREAM_PRODUCTS", "1") == "1"
+# Upper bound on concurrent structuring calls within one search.
+STRUCTURE_CONCURRENCY = int(os.getenv("STRUCTURE_CONCURRENCY", "6"))
+# Tavily extract timeout per request.
+EXTRACT_TIMEOUT = 120
+# Time extraction and structuring of a whole search may take before the
+# unfinished pages are dropped. By default: the slowest extract with all
+# its retries, plus three minutes of structuring.
+STRUCTURE_DEADLINE = float(os.getenv("STRUCTURE_DEADLINE", "0")) or retry_budget(EXTRACT_TIMEOUT) + 180
+# Generate the report for the preview products in the background as soon
+# as results are listed (one extra completion per search).
+REPORT_PREFETCH = os.getenv("REPORT_PREFETCH", "0") == "1"
+
+BUSY_MESSAGE = "We're handling a lot of searches right now. Please try again in a minute."
 
 DETAIL_MODE_HINT = "IMPORTANT: This content is a PRODUCT DETAIL PAGE (PDP). Extract exactly 1 rich product."
 LISTING_MODE_HINT = "IMPORTANT: This content is a LISTING. Extract distinct items and ensure each product_url is a PDP."
@@ -674,150 +829,166 @@ def find_target_pdps_in_html(raw: str, base: str) -> List[str]:
             seen.add(u)
     return uniq
 
-def parse_target_structured(raw: str) -> Dict[str, Any]:
+PRODUCTS_SCHEMA_JSON = json.dumps(PRODUCTS_SCHEMA)
+extraction_prompt = PromptTemplate(SYSTEM_MSG, LLM_EXTRACTION_MODEL)
+
+def build_extraction_prompt(raw: str, source_url: str, assist: Optional[Dict[str, Any]] = None, detail_hint: bool = False) -> BuiltPrompt:
     """
-    Best-effort parse of Target’s on-page JSON (ld+json, Redux-like blobs).
-    Returns a lightweight dict with fields we care about to assist the LLM.
+    Extraction prompt with the page fitted to the model's input budget.
+    The schema and hint segments are serialized and counted once.
     """
-    info: Dict[str, Any] = {}
-    soup = None
-    try:
-        soup = BeautifulSoup(raw, "html.parser")
-    except Exception:
-        return info
-
-    # JSON-LD blocks
-    for tag in soup.find_all("script", {"type": "application/ld+json"}):
-        try:
-            data = json.loads(tag.string or "{}")
-        except Exception:
-            continue
-
-        # Some pages wrap in a list
-        candidates = data if isinstance(data, list) else [data]
-        for d in candidates:
-            if not isinstance(d, dict):
-                continue
-            # Product schema
-            if d.get("@type") == "Product":
-                info.setdefault("title", d.get("name"))
-                agg = d.get("aggregateRating") or {}
-                info.setdefault("rating_value", agg.get("ratingValue"))
-                info.setdefault("rating_count", agg.get("reviewCount") or agg.get("ratingCount"))
-                offers = d.get("offers") or {}
-                if isinstance(offers, list) and offers:
-                    offers = offers[0]
-                if isinstance(offers, dict):
-                    info.setdefault("price_text", offers.get("price"))
-                    info.setdefault("price_currency", offers.get("priceCurrency"))
-                    info.setdefault("availability", offers.get("availability"))
-                imgs = d.get("image")
-                if isinstance(imgs, list):
-                    info.setdefault("image_urls", imgs)
-                elif isinstance(imgs, str):
-                    info.setdefault("image_urls", [imgs])
-
-    # Look for Redux/state blobs that include technical specs
-    # Common key names observed: "product", "bullet_points", "attributes", "specifications", "tcin", "dpci"
-    for tag in soup.find_all("script"):
-        txt = (tag.string or "").strip()
-        if not txt or ("{") not in txt:
-            continue
-        if any(k in txt for k in ["specifications", "bullet", "attributes", "tcin", "dpci", "price"]):
-            # Try to extract the largest JSON object
-            start = txt.find("{")
-            end = txt.rfind("}")
-            if start != -1 and end != -1 and end > start:
-                try:
-                    blob = json.loads(txt[start:end+1])
-                    # naive walk for useful bits
-                    def walk(o):
-                        if isinstance(o, dict):
-                            # price
-                            for k in ["current_retail", "price", "formatted_current_price"]:
-                                if k in o and "price_text" not in info:
-                                    v = o[k]
-                                    info["price_text"] = str(v)
-                            # specs
-                            for k in ["specifications", "attributes", "bullets", "bullet_points"]:
-                                if k in o:
-                                    specs = {}
-                                    v = o[k]
-                                    if isinstance(v, dict):
-                                        for kk, vv in v.items():
-                                            specs[str(kk)] = str(vv)
-                                    elif isinstance(v, list):
-                                        for item in v:
-                                            if isinstance(item, dict) and "name" in item and "value" in item:
-                                                specs[str(item["name"])] = str(item["value"])
-                                            elif isinstance(item, str):
-                                                # key: value lines
-                                                if ":" in item:
-                                                    kk, vv = item.split(":", 1)
-                                                    specs[kk.strip()] = vv.strip()
-                                    if specs:
-                                        info.setdefault("specifications", specs)
-                            # ids
-                            for k in ["tcin", "dpci", "upc", "model"]:
-                                if k in o and k not in info:
-                                    info[k] = str(o[k])
-                            # rating
-                            for k in ["average_rating", "rating", "rating_value"]:
-                                if k in o and "rating_value" not in info:
-                                    try:
-                                        info["rating_value"] = float(o[k])
-                                    except Exception:
-                                        pass
-                            for k in ["total_reviews", "rating_count", "review_count"]:
-                                if k in o and "rating_count" not in info:
-                                    try:
-                                        info["rating_count"] = int(o[k])
-                                    except Exception:
-                                        pass
-                            for v in o.values():
-                                walk(v)
-                        elif isinstance(o, list):
-                            for it in o:
-                                walk(it)
-                    walk(blob)
-                except Exception:
-                    pass
-
-    # Normalize some fields
-    if "tcin" in info and "sku" not in info:
-        info["sku"] = info["tcin"]
-    return info
-
-def build_llm_prompt(raw: str, source_url: str, assist: Optional[Dict[str, Any]] = None, detail_hint: bool = False) -> str:
     hint = DETAIL_MODE_HINT if detail_hint else LISTING_MODE_HINT
     assist_str = json.dumps(assist or {}, ensure_ascii=False)
-    return f"""SOURCE_URL: {source_url}
+    return extraction_prompt.build(
+        [
+            f"SOURCE_URL: {source_url}\n\nJSON_SCHEMA:\n",
+            PRODUCTS_SCHEMA_JSON,
+            "\n\nASSIST_STRUCTURED_HINTS:\n",
+            assist_str,
+            "\n\nHINTS:\n",
+            hint,
+            "\n\nRAW_WEB_PAGE:\n",
+        ],
+        raw,
+    )
 
-JSON_SCHEMA:
-{json.dumps(PRODUCTS_SCHEMA)}
+def build_llm_prompt(raw: str, source_url: str, assist: Optional[Dict[str, Any]] = None, detail_hint: bool = False) -> str:
+    return build_extraction_prompt(raw, source_url, assist=assist, detail_hint=detail_hint).text
+
+# Cache entries are versioned on everything that shapes the model output,
+# so editing the prompt or the schema never serves stale structured results.
+EXTRACTION_CACHE_VERSION = content_key(
+    SYSTEM_MSG, SYSTEM_MSG3, PRODUCTS_SCHEMA, ENRICH_SCHEMA, DETAIL_MODE_HINT, LISTING_MODE_HINT, STRUCTURED_DATA_ENRICH
+)
+
+def structured_cache_key(page_text: str, detail_hint: bool, model: str = LLM_EXTRACTION_MODEL) -> str:
+    return content_key(EXTRACTION_CACHE_VERSION, model, detail_hint, page_text)
+
+async def call_llm(
+    prompt: str,
+    model: str = "gpt-4o-mini",
+    on_product: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+) -> Dict[str, Any]:
+    """
+    Run the extraction prompt and return the salvaged PRODUCTS_SCHEMA data.
+    With `on_product`, the completion is streamed and each product is
+    validated and handed to `on_product` as soon as its JSON object closes.
+    A slow call is hedged with a duplicate request and abandoned at its
+    deadline (see hedging.py); DeadlineExceeded then carries the products
+    streamed so far in `partial`.
+    """
+    client = get_openai_client()
+    messages = [
+        {"role": "system", "content": SYSTEM_MSG},
+        {"role": "user", "content": prompt},
+    ]
+    # Only one attempt publishes products: the first to stream one.
+    streaming_attempt: List[int] = []
+    streamed: List[Dict[str, Any]] = []
+
+    async def attempt(i: int) -> str:
+        with llm_call("call_llm", LLM_EXTRACTION_MODEL) as call:
+            if on_product is None:
+                resp = await client.chat.completions.create(
+                    model=LLM_EXTRACTION_MODEL,
+                    response_format={"type": "json_object"},
+                    messages=messages,
+                )
+                call.usage(resp.usage)
+                return resp.choices[0].message.content
+            stream = await client.chat.completions.create(
+                model=LLM_EXTRACTION_MODEL,
+                response_format={"type": "json_object"},
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            parser = StreamingArrayParser("products")
+            parts = []
+            async for chunk in stream:
+                call.usage(chunk.usage)
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                delta = chunk.choices[0].delta.content
+                parts.append(delta)
+                for item in parser.feed(delta):
+                    product = product_salvager.check(item)
+                    if product is None:
+                        continue
+                    if not streaming_attempt:
+                        streaming_attempt.append(i)
+                    if streaming_attempt[0] != i:
+                        # The other attempt is already streaming products.
+                        raise asyncio.CancelledError()
+                    streamed.append(product)
+                    await on_product(product)
+            if streaming_attempt and streaming_attempt[0] != i:
+                raise asyncio.CancelledError()
+            return "".join(parts)
 
-ASSIST_STRUCTURED_HINTS:
-{assist_str}
+    try:
+        # A duplicate of a call that is already streaming products could
+        # only be cancelled at its own first product.
+        content = await hedged("call_llm", attempt, can_hedge=lambda: not streaming_attempt and not openai_limiter.waiting)
+    except DeadlineExceeded as e:
+        e.partial = {"products": list(streamed)}
+        raise
+    data, report = product_salvager.salvage(json.loads(content))
+    if report["repaired"] or report["rejected"]:
+        print(f"Validation: {report['kept']} kept ({report['repaired']} repaired), {report['rejected']} rejected {dict(report['reasons'])}")
+    return data
 
-HINTS:
-{hint}
+async def enrich_products(products: List[Dict[str, Any]], page_text: str) -> List[Dict[str, Any]]:
+    """
+    Add review-derived fields to products taken from structured data.
+    Only the compact product identity goes to the model and only the review
+    fields come back, so this is far cheaper than a full extraction.
+    """
+    compact = [
+        {"index": i, "title": p["title"], "price_text": p["price_text"], "rating_value": p.get("rating_value"), "rating_count": p.get("rating_count")}
+        for i, p in enumerate(products)
+    ]
+    client = get_openai_client()
+
+    async def attempt(i: int):
+        with llm_call("enrich_products", LLM_EXTRACTION_MODEL) as call:
+            resp = await client.chat.completions.create(
+                model=LLM_EXTRACTION_MODEL,
+                response_format={"type": "json_object"},
+                messages=[
+                    {"role": "system", "content": SYSTEM_MSG3},
+                    {"role": "user", "content": f"""JSON_SCHEMA:
+{json.dumps(ENRICH_SCHEMA)}
+
+PRODUCTS:
+{json.dumps(compact, ensure_ascii=False)}
 
 RAW_WEB_PAGE:
-{raw[:200000]}"""
-
-async def call_llm(prompt: str, model: str = "gpt-4o-mini") -> Dict[str, Any]:
-    client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    resp = await client.chat.completions.create(
-        model="gpt-5-mini",
-        response_format={"type": "json_object"},
-        messages=[
-            {"role": "system", "content": SYSTEM_MSG},
-            {"role": "user", "content": prompt},
-        ],
-    )
-    data = json.loads(resp.choices[0].message.content)
-    Draft202012Validator(PRODUCTS_SCHEMA).validate(data)
-    return data
+{page_text[:ENRICH_MAX_CHARS]}"""},
+                ],
+            )
+            call.usage(resp.usage)
+        return resp.choices[0].message.content
+
+    data = json.loads(await hedged("enrich_products", attempt, can_hedge=lambda: not openai_limiter.waiting))
+    ENRICH_VALIDATOR.validate(data)
+    enriched = [dict(p) for p in products]
+    for item in data["products"]:
+        i = item["index"]
+        if 0 <= i < len(enriched):
+            enriched[i].update({k: item[k] for k in REVIEW_FIELDS if k in item})
+    return enriched
+
+def fill_missing_review_fields(products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Give products without review analysis empty review fields so the UI
+    can render them.
+    """
+    for p in products:
+        for k in ["pros", "cons", "key_insights_from_reviews"]:
+            p.setdefault(k, [])
+        p.setdefault("review_sentiment", None)
+    return products
 
 def filter_only_pdps(products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     out = []
@@ -829,9 +1000,6 @@ def filter_only_pdps(products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
 
 
 
-import re
-from urllib.parse import urlsplit
-
 def replace_urls_with_product_and_image_links(
     text: str,
     product_base: str = "https://amzn.com/url{}",
@@ -862,72 +1030,27 @@ def replace_urls_with_product_and_image_links(
     new_text : str
         Text with all replacements applied.
     mappings_list : list[list[str, str]]
-        Pairs of [original_url, replacement_url] for all *non-exempt* URLs
+        Pairs of [replacement_url, original_url] for all *non-exempt* URLs
         (includes both image and non-image mappings).
     final_product_counter : int
         Updated product counter value after processing.
     final_image_counter : int
         Updated image counter value after processing.
     """
-    # Robust-enough matcher for http/https inside natural text
-    url_re = re.compile(r'\bhttps?://[^\s<>()"\']+', re.IGNORECASE)
-    TRAILING_PUNCT = set('),.;:!?]')
-
-    # Common image extensions (lowercased, matched on the URL path)
-    IMAGE_EXTS = (
-        ".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp",
-        ".svg", ".tif", ".tiff", ".avif", ".heic", ".heif", ".jfif"
+    tokenizer = UrlTokenizer(
+        product_base,
+        image_base,
+        exempt_prefixes=exempt_prefixes,
+        product_counter=product_counter,
+        image_counter=image_counter,
     )
+    page = tokenizer.tokenize(text)
+    pairs = [[repl_url, url] for repl_url, url in tokenizer.to_original.items()]
+    return page.text, pairs, tokenizer.product_counter, tokenizer.image_counter
 
-    def _is_image_url(u: str) -> bool:
-        # Strip query/fragment; decide using only the path
-        path = urlsplit(u).path.lower()
-        return any(path.endswith(ext) for ext in IMAGE_EXTS)
-
-    # One mapping table for all URLs (image + non-image)
-    mapping: dict[str, str] = {}
-    pairs: list[list[str, str]] = []
-
-    # Use the passed counter values
-    current_product_counter = product_counter
-    current_image_counter = image_counter
-
-    def _repl(m: re.Match) -> str:
-        nonlocal current_product_counter, current_image_counter
-        token = m.group(0)
-
-        # Separate trailing punctuation often glued to URLs in prose
-        url = token
-        trailing = ""
-        while url and url[-1] in TRAILING_PUNCT:
-            trailing = url[-1] + trailing
-            url = url[:-1]
-
-        # Exemptions: leave untouched
-        if url.startswith(exempt_prefixes):
-            return url + trailing
-
-        # Assign or reuse a replacement
-        if url not in mapping:
-            if _is_image_url(url):
-                current_image_counter += 1
-                repl_url = image_base.format(current_image_counter)
-            else:
-                current_product_counter += 1
-                repl_url = product_base.format(current_product_counter)
-            mapping[url] = repl_url
-            pairs.append([repl_url, url])
-        else:
-            repl_url = mapping[url]
-
-        return repl_url + trailing
-
-    new_text = url_re.sub(_repl, text)
-    return new_text, pairs, current_product_counter, current_image_counter
 
 
-
-def apply_url_mappings_to_products(products: list[dict], mappings: list[list[str, str]]) -> list[dict]:
+def apply_url_mappings_to_products(products: list[dict], mappings: Union[list[list[str, str]], Mapping[str, str]]) -> list[dict]:
     """
     Replace 'product_url' and 'image_urls' values in each product dict 
     using the given URL mappings.
@@ -936,31 +1059,33 @@ def apply_url_mappings_to_products(products: list[dict], mappings: list[list[str
     ----------
     products : list of dict
         Each dict has keys like 'product_url' and 'image_urls'.
-    mappings : list of [original_url, replacement_url]
-        Output from replace_urls_with_product_links.
+    mappings : list of [replacement_url, original_url], or a dict
+        Output from replace_urls_with_product_and_image_links, or
+        SearchUrlIndex.to_original.
 
     Returns
     -------
     updated_products : list of dict
         New list with URLs replaced where possible.
     """
-    mapping_dict = dict(mappings)  # quick lookup
+    mapping_dict = mappings if isinstance(mappings, Mapping) else dict(mappings)  # quick lookup
 
     updated_products = []
     for product in products:
         new_product = product.copy()
 
         # Replace product_url if present in mapping
-        if "product_url" in new_product and new_product["product_url"] in mapping_dict:
-            new_product["product_url"] = next((mapping for mapping in mappings if product['product_url'] in mapping), None )
-            new_product["product_url"] = new_product["product_url"][1]
+        product_url = new_product.get("product_url")
+        if product_url in mapping_dict:
+            new_product["product_url"] = mapping_dict[product_url]
         # Replace each image URL
         if "image_urls" in new_product:
-            if(len(new_product["image_urls"]) > 0):
-                new_product["image_urls"] = next((mapping for mapping in mappings if new_product['image_urls'][0] in mapping), None )
-                new_product["image_urls"] = [new_product["image_urls"][1]]
-            else:
-                new_product["image_urls"] = []
+            image_urls = []
+            for image_url in new_product["image_urls"] or []:
+                image_url = mapping_dict.get(image_url, image_url)
+                if image_url not in image_urls:
+                    image_urls.append(image_url)
+            new_product["image_urls"] = image_urls
 
         updated_products.append(new_product)
 
@@ -1022,6 +1147,9 @@ def combine_products_from_sites(products_from_each_site: Dict[str, List[Dict[str
             if available_products:
                 selected_products.append(random.choice(available_products))
                 break
+        else:
+            # Fewer than 5 products were found in total.
+            break
 
     # Step 4: Randomly shuffle the final 5 products
     random.shuffle(selected_products)
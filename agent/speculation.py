@@ -0,0 +1,91 @@
+import os
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Start the retailer searches (and, with SPECULATIVE_EXTRACT, the
+# extractions) while the model is still classifying the turn.
+SPECULATIVE_SEARCH = os.getenv("SPECULATIVE_SEARCH", "0") == "1"
+SPECULATIVE_EXTRACT = os.getenv("SPECULATIVE_EXTRACT", "0") == "1"
+
+SearchFn = Callable[[], Awaitable[Dict[str, List[str]]]]
+ExtractFn = Callable[[List[str], str], Awaitable[List[Dict[str, Any]]]]
+
+# Process-wide counters of speculative work, for tuning.
+speculation_stats: Counter = Counter()
+
+
+class SpeculativeSearch:
+    """
+    A search started before the turn is known to be a search.
+    `result()` hands over the search URLs (and the per-retailer extraction
+    tasks when `extract` is given) once the model says SEARCH; `discard()`
+    cancels whatever is still running when it does not, and counts the
+    searches and extractions that were wasted. `close()` is for a turn
+    that failed, used or not.
+    """
+
+    def __init__(self, search: SearchFn, extract: Optional[ExtractFn] = None):
+        self._extract = extract
+        self.extract_tasks: Dict[str, asyncio.Task] = {}
+        self.settled = False
+        self._task = asyncio.create_task(self._run(search))
+        speculation_stats["started"] += 1
+
+    async def _run(self, search: SearchFn) -> Dict[str, List[str]]:
+        urls = await search()
+        if self._extract is not None:
+            for retailer, retailer_urls in urls.items():
+                if retailer_urls:
+                    self.extract_tasks[retailer] = asyncio.create_task(self._extract(retailer_urls, retailer))
+        return urls
+
+    async def result(self) -> Dict[str, List[str]]:
+        self.settled = True
+        speculation_stats["used"] += 1
+        return await self._task
+
+    def extraction(self, retailer: str) -> Optional[asyncio.Task]:
+        return self.extract_tasks.get(retailer)
+
+    def discard(self) -> None:
+        """Cancel the speculative work; a no-op once it was used or discarded."""
+        if self.settled:
+            return
+        self.settled = True
+        speculation_stats["discarded"] += 1
+        if self._task.done():
+            speculation_stats["searches_wasted"] += 1
+        else:
+            self._task.cancel()
+            speculation_stats["searches_cancelled"] += 1
+        for task in self.extract_tasks.values():
+            if task.done():
+                speculation_stats["extracts_wasted"] += 1
+            else:
+                task.cancel()
+                speculation_stats["extracts_cancelled"] += 1
+        print(f"Speculative search discarded; {summary()}")
+
+    def close(self) -> None:
+        """
+        Cancel whatever is still running at the end of a failed turn: all
+        of it if unused, otherwise the handed-over extractions the pipeline
+        never got to.
+        """
+        if not self.settled:
+            self.discard()
+            return
+        for task in self.extract_tasks.values():
+            if not task.done():
+                task.cancel()
+                speculation_stats["extracts_cancelled"] += 1
+
+
+def summary() -> str:
+    s = speculation_stats
+    return (
+        f"{s['started']} started, {s['used']} used, {s['discarded']} discarded "
+        f"({s['searches_wasted']} searches wasted, {s['searches_cancelled']} cancelled; "
+        f"{s['extracts_wasted']} extractions wasted, {s['extracts_cancelled']} cancelled)"
+    )
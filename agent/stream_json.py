@@ -0,0 +1,149 @@
+import json
+from typing import Any, List, Optional, Tuple
+
+
+class StreamingArrayParser:
+    """
+    Incrementally pulls complete elements out of the array stored under
+    `key` in a JSON object that arrives in chunks, e.g. the "products" array
+    of a streamed extraction response.
+    Only object elements are emitted; the parser never re-scans text it has
+    already consumed.
+    """
+
+    def __init__(self, key: str = "products"):
+        self.key = key
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start: Optional[int] = None
+        self._last_string: Optional[str] = None
+        self._in_array = False
+        self._done = False
+        self._item_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Consume `chunk` and return the array elements it completed."""
+        items: List[Any] = []
+        text = self._text + chunk
+        i = self._pos
+        n = len(text)
+        while i < n:
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = text[self._string_start + 1:i]
+            elif c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c == "{" or c == "[":
+                if c == "[" and self._depth == 1 and not self._done and self._last_string == self.key:
+                    self._in_array = True
+                elif c == "{" and self._in_array and self._depth == 2:
+                    self._item_start = i
+                self._depth += 1
+            elif c == "}" or c == "]":
+                self._depth -= 1
+                if c == "}" and self._in_array and self._depth == 2 and self._item_start is not None:
+                    try:
+                        items.append(json.loads(text[self._item_start:i + 1]))
+                    except ValueError:
+                        pass
+                    self._item_start = None
+                elif c == "]" and self._in_array and self._depth == 1:
+                    self._in_array = False
+                    self._done = True
+            i += 1
+
+        # Drop consumed text, keeping only an element or key still in progress.
+        if self._item_start is not None:
+            cut = self._item_start
+        elif self._in_string:
+            cut = self._string_start
+        else:
+            cut = i
+        self._text = text[cut:]
+        self._pos = i - cut
+        if self._item_start is not None:
+            self._item_start -= cut
+        if self._in_string:
+            self._string_start -= cut
+        return items
+
+
+class StreamingObjectParser:
+    """
+    Incrementally pulls complete top-level members out of a JSON object
+    that arrives in chunks, e.g. the sections of a streamed report.
+    `feed` returns the (key, value) pairs whose values completed.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start: Optional[int] = None
+        self._key: Optional[str] = None
+        self._value_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        members: List[Tuple[str, Any]] = []
+        text = self._text + chunk
+        i = self._pos
+        n = len(text)
+        while i < n:
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._value_start is None:
+                        self._key = json.loads(text[self._string_start:i + 1])
+            elif c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c == "{" or c == "[":
+                self._depth += 1
+            elif c == ":" and self._depth == 1 and self._value_start is None:
+                self._value_start = i + 1
+            elif c in ",}]" and self._depth == 1:
+                if self._value_start is not None and self._key is not None:
+                    try:
+                        members.append((self._key, json.loads(text[self._value_start:i])))
+                    except ValueError:
+                        pass
+                self._key = None
+                self._value_start = None
+                if c != ",":
+                    self._depth -= 1
+            elif c == "}" or c == "]":
+                self._depth -= 1
+            i += 1
+
+        # Drop consumed text, keeping only a member still in progress.
+        if self._value_start is not None:
+            cut = self._value_start
+        elif self._in_string:
+            cut = self._string_start
+        else:
+            cut = i
+        self._text = text[cut:]
+        self._pos = i - cut
+        if self._value_start is not None:
+            self._value_start -= cut
+        if self._in_string:
+            self._string_start -= cut
+        return members
@@ -0,0 +1,285 @@
+import re
+import json
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+LD_JSON_RE = re.compile(
+    r"""<script[^>]*type\s*=\s*["']application/ld\+json["'][^>]*>(.*?)</script>""",
+    re.IGNORECASE | re.DOTALL,
+)
+
+# Retailer item ids, used as sku when the structured data has none.
+RETAILER_ID_PATTERNS = {
+    "amazon.com": re.compile(r"/(?:dp|gp/product)/([A-Z0-9]{10})"),
+    "ebay.com": re.compile(r"/itm/(?:[^/?#]+/)?(\d{9,})"),
+    "target.com": re.compile(r"/A-(\d+)"),
+}
+RETAILER_ORIGINS = {
+    "amazon.com": "https://www.amazon.com",
+    "ebay.com": "https://www.ebay.com",
+    "target.com": "https://www.target.com",
+}
+CURRENCY_SYMBOLS = {"USD": "$", "GBP": "£", "EUR": "€"}
+
+
+def iter_json_ld(raw: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield every JSON-LD node on the page, flattening top-level lists and
+    @graph containers.
+    """
+    if "ld+json" not in raw:
+        return
+    for m in LD_JSON_RE.finditer(raw):
+        try:
+            data = json.loads(m.group(1).strip())
+        except Exception:
+            continue
+        stack = data if isinstance(data, list) else [data]
+        for node in stack:
+            if not isinstance(node, dict):
+                continue
+            graph = node.get("@graph")
+            if isinstance(graph, list):
+                yield from (g for g in graph if isinstance(g, dict))
+            else:
+                yield node
+
+
+def _has_type(node: Dict[str, Any], name: str) -> bool:
+    t = node.get("@type")
+    if isinstance(t, list):
+        return name in t
+    return t == name
+
+
+def _first(value: Any) -> Any:
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        return float(str(value).replace(",", "").strip())
+    except Exception:
+        return None
+
+
+def _images(value: Any) -> List[str]:
+    out = []
+    for img in value if isinstance(value, list) else [value]:
+        if isinstance(img, dict):
+            img = img.get("url") or img.get("contentUrl")
+        if isinstance(img, str) and img.startswith("http"):
+            out.append(img)
+    return out
+
+
+def _price_text(price: Any, price_value: Optional[float], currency: Optional[str]) -> str:
+    if price is None:
+        return ""
+    if price_value is not None and currency in CURRENCY_SYMBOLS:
+        return f"{CURRENCY_SYMBOLS[currency]}{price_value:,.2f}"
+    return f"{price} {currency or ''}".strip()
+
+
+def product_from_ld(node: Dict[str, Any], page_url: str, retailer: str) -> Optional[Dict[str, Any]]:
+    """
+    Map one schema.org Product node onto a PRODUCTS_SCHEMA item.
+    Review-derived fields (pros, cons, insights, sentiment) are left out;
+    they are not in structured data.
+    """
+    title = node.get("name")
+    if not isinstance(title, str) or not title.strip():
+        return None
+    offers = _first(node.get("offers")) or {}
+    if not isinstance(offers, dict):
+        offers = {}
+    price = offers.get("price", offers.get("lowPrice"))
+    if price is None and isinstance(offers.get("priceSpecification"), dict):
+        price = offers["priceSpecification"].get("price")
+    currency = offers.get("priceCurrency")
+    price_value = _number(price)
+
+    url = node.get("url") or offers.get("url") or page_url
+    if isinstance(url, str) and url and not url.startswith("http"):
+        url = urljoin(RETAILER_ORIGINS.get(retailer, page_url), url)
+
+    agg = node.get("aggregateRating") or {}
+    if not isinstance(agg, dict):
+        agg = {}
+    rating_count = _number(agg.get("reviewCount") or agg.get("ratingCount"))
+    availability = offers.get("availability")
+    if isinstance(availability, str):
+        availability = availability.rsplit("/", 1)[-1]
+
+    sku = node.get("sku") or node.get("gtin13") or node.get("gtin12") or node.get("productID")
+    if not sku and retailer in RETAILER_ID_PATTERNS and isinstance(url, str):
+        m = RETAILER_ID_PATTERNS[retailer].search(url)
+        sku = m.group(1) if m else None
+
+    product: Dict[str, Any] = {
+        "title": title.strip(),
+        "product_url": url,
+        "image_urls": _images(node.get("image")),
+        "price_text": _price_text(price, price_value, currency),
+        "price_value": price_value,
+        "price_currency": currency,
+        "availability": availability,
+        "rating_value": _number(agg.get("ratingValue")),
+        "rating_count": int(rating_count) if rating_count is not None else None,
+        "model": next((str(v) for v in (node.get("model"), node.get("mpn")) if isinstance(v, (str, int))), None),
+        "sku": str(sku) if sku else None,
+    }
+    return product
+
+
+def extract_structured_products(raw: str, page_url: str, retailer: str) -> List[Dict[str, Any]]:
+    """
+    Products from the page's schema.org JSON-LD (Product nodes and
+    ItemLists of Products), for Amazon, eBay and Target PDPs and listings.
+    Only complete products - title, price_text and product_url - are
+    returned, de-duplicated by product_url.
+    """
+    products: List[Dict[str, Any]] = []
+    seen = set()
+
+    def add(node: Dict[str, Any], fallback_url: str) -> None:
+        product = product_from_ld(node, fallback_url, retailer)
+        if not product or not product["price_text"] or not product["product_url"]:
+            return
+        if product["product_url"] in seen:
+            return
+        seen.add(product["product_url"])
+        products.append(product)
+
+    for node in iter_json_ld(raw):
+        if _has_type(node, "Product"):
+            add(node, page_url)
+        elif _has_type(node, "ItemList"):
+            for element in node.get("itemListElement") or []:
+                if not isinstance(element, dict):
+                    continue
+                item = element.get("item") if isinstance(element.get("item"), dict) else element
+                if _has_type(item, "Product"):
+                    # A listing entry without its own url must not inherit the
+                    # listing page's url.
+                    add(item, item.get("url") or element.get("url") or "")
+    return products
+
+
+def parse_target_structured(raw: str) -> Dict[str, Any]:
+    """
+    Best-effort parse of Target’s on-page JSON (ld+json, Redux-like blobs).
+    Returns a lightweight dict with fields we care about to assist the LLM.
+    """
+    info: Dict[str, Any] = {}
+    soup = None
+    try:
+        soup = BeautifulSoup(raw, "html.parser")
+    except Exception:
+        return info
+
+    # JSON-LD blocks
+    for tag in soup.find_all("script", {"type": "application/ld+json"}):
+        try:
+            data = json.loads(tag.string or "{}")
+        except Exception:
+            continue
+
+        # Some pages wrap in a list
+        candidates = data if isinstance(data, list) else [data]
+        for d in candidates:
+            if not isinstance(d, dict):
+                continue
+            # Product schema
+            if d.get("@type") == "Product":
+                info.setdefault("title", d.get("name"))
+                agg = d.get("aggregateRating") or {}
+                info.setdefault("rating_value", agg.get("ratingValue"))
+                info.setdefault("rating_count", agg.get("reviewCount") or agg.get("ratingCount"))
+                offers = d.get("offers") or {}
+                if isinstance(offers, list) and offers:
+                    offers = offers[0]
+                if isinstance(offers, dict):
+                    info.setdefault("price_text", offers.get("price"))
+                    info.setdefault("price_currency", offers.get("priceCurrency"))
+                    info.setdefault("availability", offers.get("availability"))
+                imgs = d.get("image")
+                if isinstance(imgs, list):
+                    info.setdefault("image_urls", imgs)
+                elif isinstance(imgs, str):
+                    info.setdefault("image_urls", [imgs])
+
+    # Look for Redux/state blobs that include technical specs
+    # Common key names observed: "product", "bullet_points", "attributes", "specifications", "tcin", "dpci"
+    for tag in soup.find_all("script"):
+        txt = (tag.string or "").strip()
+        if not txt or ("{") not in txt:
+            continue
+        if any(k in txt for k in ["specifications", "bullet", "attributes", "tcin", "dpci", "price"]):
+            # Try to extract the largest JSON object
+            start = txt.find("{")
+            end = txt.rfind("}")
+            if start != -1 and end != -1 and end > start:
+                try:
+                    blob = json.loads(txt[start:end+1])
+                    # naive walk for useful bits
+                    def walk(o):
+                        if isinstance(o, dict):
+                            # price
+                            for k in ["current_retail", "price", "formatted_current_price"]:
+                                if k in o and "price_text" not in info:
+                                    v = o[k]
+                                    info["price_text"] = str(v)
+                            # specs
+                            for k in ["specifications", "attributes", "bullets", "bullet_points"]:
+                                if k in o:
+                                    specs = {}
+                                    v = o[k]
+                                    if isinstance(v, dict):
+                                        for kk, vv in v.items():
+                                            specs[str(kk)] = str(vv)
+                                    elif isinstance(v, list):
+                                        for item in v:
+                                            if isinstance(item, dict) and "name" in item and "value" in item:
+                                                specs[str(item["name"])] = str(item["value"])
+                                            elif isinstance(item, str):
+                                                # key: value lines
+                                                if ":" in item:
+                                                    kk, vv = item.split(":", 1)
+                                                    specs[kk.strip()] = vv.strip()
+                                    if specs:
+                                        info.setdefault("specifications", specs)
+                            # ids
+                            for k in ["tcin", "dpci", "upc", "model"]:
+                                if k in o and k not in info:
+                                    info[k] = str(o[k])
+                            # rating
+                            for k in ["average_rating", "rating", "rating_value"]:
+                                if k in o and "rating_value" not in info:
+                                    try:
+                                        info["rating_value"] = float(o[k])
+                                    except Exception:
+                                        pass
+                            for k in ["total_reviews", "rating_count", "review_count"]:
+                                if k in o and "rating_count" not in info:
+                                    try:
+                                        info["rating_count"] = int(o[k])
+                                    except Exception:
+                                        pass
+                            for v in o.values():
+                                walk(v)
+                        elif isinstance(o, list):
+                            for it in o:
+                                walk(it)
+                    walk(blob)
+                except Exception:
+                    pass
+
+    # Normalize some fields
+    if "tcin" in info and "sku" not in info:
+        info["sku"] = info["tcin"]
+    return info
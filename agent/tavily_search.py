@@ -0,0 +1,218 @@
+import os
+import time
+import asyncio
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from tavily.errors import (
+    UsageLimitExceededError,
+    InvalidAPIKeyError,
+    BadRequestError,
+    ForbiddenError,
+    TimeoutError as TavilyTimeoutError,
+)
+
+from clients import get_tavily_http
+from cache import extract_cache, content_key
+from metrics import span, tavily_requests, tavily_seconds
+from ratelimit import RETRY_MAX_DELAY, TAVILY_MAX_RETRIES, backoff_delay, provider_retries, tavily_limiter
+
+SEARCH_TIMEOUT = float(os.getenv("TAVILY_SEARCH_TIMEOUT", "30"))
+
+# Extract cache lookups by (retailer, "hit" | "miss"), exported with
+# agent_cache_requests_total.
+extract_cache_requests: Dict[Tuple[str, str], int] = defaultdict(int)
+
+
+async def _send(path: str, payload: Dict[str, Any], timeout: float) -> httpx.Response:
+    """
+    One POST through the rate limiter. 429, 5xx and connection errors are
+    retried up to TAVILY_MAX_RETRIES times with jittered backoff.
+    """
+    client = get_tavily_http()
+    endpoint = path.strip("/")
+    attempt = 0
+    while True:
+        await tavily_limiter.acquire()
+        start = time.perf_counter()
+        response = None
+        try:
+            response = await client.post(path, json=payload, timeout=timeout)
+        except httpx.TimeoutException:
+            tavily_requests.inc(endpoint=endpoint, status="timeout")
+            raise TavilyTimeoutError(timeout)
+        except httpx.TransportError:
+            tavily_requests.inc(endpoint=endpoint, status="error")
+            if attempt == TAVILY_MAX_RETRIES:
+                raise
+        except Exception:
+            tavily_requests.inc(endpoint=endpoint, status="error")
+            raise
+        finally:
+            tavily_seconds.observe(time.perf_counter() - start, endpoint=endpoint)
+        if response is not None:
+            tavily_requests.inc(endpoint=endpoint, status=response.status_code)
+            if response.status_code != 429 and response.status_code < 500 or attempt == TAVILY_MAX_RETRIES:
+                if response.status_code == 429:
+                    tavily_limiter.throttled(backoff_delay(attempt, response))
+                return response
+        provider_retries.inc(provider="tavily")
+        if response is not None and response.status_code == 429:
+            # Every Tavily call of the worker waits this out in the limiter.
+            tavily_limiter.throttled(backoff_delay(attempt, response))
+        else:
+            await asyncio.sleep(backoff_delay(attempt, response))
+        attempt += 1
+
+
+def retry_budget(timeout: float) -> float:
+    """Longest a `_send` with per-attempt `timeout` can take: every attempt plus the longest backoffs."""
+    return (TAVILY_MAX_RETRIES + 1) * timeout + TAVILY_MAX_RETRIES * RETRY_MAX_DELAY
+
+
+async def _post(path: str, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+    """
+    POST to the Tavily API over the shared pooled client and map error
+    responses onto the same exceptions TavilyClient raises.
+    """
+    response = await _send(path, payload, timeout)
+
+    if response.status_code == 200:
+        return response.json()
+
+    detail = ""
+    try:
+        detail = response.json().get("detail", {}).get("error", None)
+    except Exception:
+        pass
+    if response.status_code == 429:
+        raise UsageLimitExceededError(detail)
+    elif response.status_code in [403, 432, 433]:
+        raise ForbiddenError(detail)
+    elif response.status_code == 401:
+        raise InvalidAPIKeyError(detail)
+    elif response.status_code == 400:
+        raise BadRequestError(detail)
+    response.raise_for_status()
+    return response.json()
+
+
+async def tavily_search(query: str, timeout: float = SEARCH_TIMEOUT, **params: Any) -> Dict[str, Any]:
+    """
+    Async equivalent of TavilyClient.search. Keyword arguments are sent
+    as-is in the request body; None values are dropped.
+    """
+    payload = {"query": query, **{k: v for k, v in params.items() if v is not None}}
+    return await _post("/search", payload, timeout)
+
+
+async def search_retailers(
+    query: str,
+    retailers: List[str],
+    max_results: int = 6,
+    timeout: float = SEARCH_TIMEOUT,
+) -> Dict[str, List[str]]:
+    """
+    Run one advanced search per retailer concurrently and return the result
+    URLs keyed by retailer.
+    Each retailer has its own timeout per request, with room for the
+    retries of `_send` on top; a retailer that fails or times out maps to
+    an empty list so the remaining retailers still go through.
+    """
+    async def search_one(retailer: str) -> List[str]:
+        try:
+            with span("search", retailer=retailer):
+                search = await asyncio.wait_for(
+                    tavily_search(
+                        query,
+                        timeout=timeout,
+                        include_domains=[retailer],
+                        include_answer=False,
+                        include_images=False,
+                        include_raw_content=False,
+                        search_depth="advanced",
+                        max_results=max_results,
+                    ),
+                    retry_budget(timeout),
+                )
+        except Exception as e:
+            print(f"Search failed for {retailer}: {e!r}")
+            return []
+        return [r["url"] for r in search.get("results", []) if r.get("url")]
+
+    results = await asyncio.gather(*(search_one(retailer) for retailer in retailers))
+    return dict(zip(retailers, results))
+
+
+async def tavily_extract(urls: List[str], timeout: float = 120, **params: Any) -> Dict[str, Any]:
+    """
+    Async equivalent of TavilyClient.extract.
+    """
+    payload = {"urls": urls, "timeout": timeout, **{k: v for k, v in params.items() if v is not None}}
+    return await _post("/extract", payload, timeout)
+
+
+def _url_match_key(url: str) -> str:
+    parts = urlsplit(url)
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return f"{host}{parts.path.rstrip('/')}?{parts.query}"
+
+
+def requested_urls(requested: List[str], items: List[Dict[str, Any]], failed: List[str]) -> List[Optional[str]]:
+    """
+    The requested URL each extract result belongs to, or None. Tavily may
+    return a normalized or redirected URL: exact matches come first, then
+    matches ignoring scheme, "www." and trailing slashes. Result order is
+    not guaranteed, so anything else stays unmatched rather than risk
+    caching one page under another's URL.
+    """
+    failed_urls = set(failed)
+    pending = [url for url in requested if url not in failed_urls]
+    matched: List[Optional[str]] = [item.get("url") if item.get("url") in pending else None for item in items]
+    by_key: Dict[str, str] = {}
+    for url in pending:
+        if url not in matched:
+            by_key.setdefault(_url_match_key(url), url)
+    for i, item in enumerate(items):
+        if matched[i] is None and item.get("url"):
+            matched[i] = by_key.pop(_url_match_key(item["url"]), None)
+    return matched
+
+
+async def extract_with_cache(urls: List[str], retailer: str, timeout: float = 120, **params: Any) -> List[Dict[str, Any]]:
+    """
+    Extract `urls`, serving pages from extract_cache where possible and only
+    sending the misses to Tavily.
+    The cache key covers the URL and the extract parameters, so an
+    "advanced" extraction is never served for a "basic" request.
+    """
+    keys = {url: content_key(url, params) for url in urls}
+    cached = await asyncio.gather(*(extract_cache.get(keys[url]) for url in urls))
+    hits = {url: item for url, item in zip(urls, cached) if item is not None}
+    misses = [url for url in urls if url not in hits]
+    extract_cache_requests[retailer, "hit"] += len(hits)
+    extract_cache_requests[retailer, "miss"] += len(misses)
+    print(f"Extract cache for {retailer}: {len(hits)} hits, {len(misses)} misses")
+
+    fetched: Dict[str, Dict[str, Any]] = {}
+    if misses:
+        ext = await tavily_extract(misses, timeout=timeout, **params)
+        items = ext.get("results", [])
+        failed = [f.get("url") for f in ext.get("failed_results", []) if isinstance(f, dict)]
+        # Cached under the requested URL, which is what the next lookup uses.
+        for item, url in zip(items, requested_urls(misses, items, failed)):
+            fetched[url or item["url"]] = item
+            if url is not None and item.get("raw_content"):
+                await extract_cache.set(keys[url], item)
+
+    results = []
+    for url in urls:
+        item = hits.get(url) or fetched.pop(url, None)
+        if item is not None:
+            results.append(item)
+    results.extend(fetched.values())
+    return results
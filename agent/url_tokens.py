@@ -0,0 +1,247 @@
+import re
+import sys
+from typing import Dict, List, NamedTuple, Optional
+
+# Robust-enough matcher for http/https inside natural text
+URL_RE = re.compile(r'\bhttps?://[^\s<>()"\']+', re.IGNORECASE)
+TRAILING_PUNCT = '),.;:!?]'
+
+# Common image extensions (lowercased, matched on the URL path)
+IMAGE_EXTS = (
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp",
+    ".svg", ".tif", ".tiff", ".avif", ".heic", ".heif", ".jfif"
+)
+
+# Placeholder URL templates per retailer: (product_base, image_base)
+PLACEHOLDER_BASES = {
+    "target.com": ("https://tgt.com/url{}", "https://tgt.com/img/url{}"),
+    "amazon.com": ("https://amzn.com/url{}", "https://amzn.com/img/url{}"),
+    "ebay.com": ("https://ebay.com/url{}", "https://ebay.com/img/url{}"),
+}
+
+
+def is_image_url(url: str) -> bool:
+    """
+    True if the URL path (ignoring query and fragment) ends with an image
+    extension.
+    """
+    end = len(url)
+    for sep in "?#":
+        i = url.find(sep)
+        if i != -1 and i < end:
+            end = i
+    slash = url.find("/", url.find("://") + 3)
+    if slash == -1 or slash >= end:
+        return False
+    return url[slash:end].lower().endswith(IMAGE_EXTS)
+
+
+class PagePlaceholders(NamedTuple):
+    """
+    Global placeholders of one page, by local number: products[i] is the
+    global placeholder of the page's local product placeholder i + 1.
+    """
+    product_base: str
+    image_base: str
+    products: List[str]
+    images: List[str]
+
+    def to_local(self, text: str) -> str:
+        """Rewrite global placeholders in `text` to this page's local numbering."""
+        lookup = {p: self.product_base.format(i + 1) for i, p in enumerate(self.products)}
+        lookup.update({p: self.image_base.format(i + 1) for i, p in enumerate(self.images)})
+        return _placeholder_re(self.product_base, self.image_base).sub(
+            lambda m: lookup.get(m.group(0), m.group(0)), text
+        )
+
+    def to_global(self, text: str) -> str:
+        """Rewrite this page's local placeholders in `text` back to global ones."""
+        image_prefix = self.image_base.format("")
+
+        def _sub(m: re.Match) -> str:
+            table = self.images if m.group(1) == image_prefix else self.products
+            i = int(m.group(2)) - 1
+            return table[i] if 0 <= i < len(table) else m.group(0)
+
+        return _placeholder_re(self.product_base, self.image_base).sub(_sub, text)
+
+
+class TokenizedPage(NamedTuple):
+    """
+    One page after URL tokenization.
+
+    text        - page with placeholders numbered across the whole search
+    local_text  - same page with placeholders renumbered from 1 in order of
+                  first appearance; identical for identical pages, so it is
+                  what cache keys are built from
+    products    - global product placeholder for local number i + 1
+    images      - global image placeholder for local number i + 1
+    """
+    text: str
+    local_text: str
+    product_base: str
+    image_base: str
+    products: List[str]
+    images: List[str]
+
+    @property
+    def placeholders(self) -> PagePlaceholders:
+        return PagePlaceholders(self.product_base, self.image_base, self.products, self.images)
+
+    def to_local(self, text: str) -> str:
+        """Rewrite global placeholders in `text` to this page's local numbering."""
+        return self.placeholders.to_local(text)
+
+    def to_global(self, text: str) -> str:
+        """Rewrite this page's local placeholders in `text` back to global ones."""
+        return self.placeholders.to_global(text)
+
+
+class LocalPage(NamedTuple):
+    """
+    A page tokenized on its own, e.g. in a worker process: placeholders
+    numbered from 1 in order of first appearance, and the original URL of
+    each local product and image placeholder.
+    """
+    text: str
+    product_urls: List[str]
+    image_urls: List[str]
+
+
+_placeholder_res: Dict[tuple, "re.Pattern[str]"] = {}
+
+
+def _placeholder_re(product_base: str, image_base: str) -> "re.Pattern[str]":
+    key = (product_base, image_base)
+    rx = _placeholder_res.get(key)
+    if rx is None:
+        prefixes = sorted({product_base.format(""), image_base.format("")}, key=len, reverse=True)
+        rx = re.compile("(" + "|".join(re.escape(p) for p in prefixes) + r")(\d+)")
+        _placeholder_res[key] = rx
+    return rx
+
+
+class UrlTokenizer:
+    """
+    Replaces URLs with short placeholders for one retailer.
+    The same original URL always gets the same placeholder for the lifetime
+    of the tokenizer, and every placeholder is registered in the shared
+    `to_original` index so it can be restored in O(1).
+    """
+
+    def __init__(
+        self,
+        product_base: str,
+        image_base: str,
+        to_original: Optional[Dict[str, str]] = None,
+        exempt_prefixes: tuple = (),
+        product_counter: int = 0,
+        image_counter: int = 0,
+    ):
+        self.product_base = product_base
+        self.image_base = image_base
+        self.exempt_prefixes = exempt_prefixes
+        self.product_counter = product_counter
+        self.image_counter = image_counter
+        self.to_original: Dict[str, str] = to_original if to_original is not None else {}
+        self.to_placeholder: Dict[str, str] = {}
+        self._image_prefix = image_base.format("")
+
+    def placeholder_for(self, url: str) -> str:
+        repl_url = self.to_placeholder.get(url)
+        if repl_url is None:
+            url = sys.intern(url)
+            if is_image_url(url):
+                self.image_counter += 1
+                repl_url = self.image_base.format(self.image_counter)
+            else:
+                self.product_counter += 1
+                repl_url = self.product_base.format(self.product_counter)
+            self.to_placeholder[url] = repl_url
+            self.to_original[repl_url] = url
+        return repl_url
+
+    def tokenize(self, text: str) -> TokenizedPage:
+        """
+        Replace every non-exempt URL in `text` with its placeholder.
+        Trailing punctuation like '),.;:!?]' is kept outside the placeholder.
+        """
+        out: List[str] = []
+        local_out: List[str] = []
+        local: Dict[str, str] = {}
+        products: List[str] = []
+        images: List[str] = []
+        pos = 0
+        for m in URL_RE.finditer(text):
+            start, end = m.span()
+            token = m.group(0)
+            url = token.rstrip(TRAILING_PUNCT)
+            if url.startswith(self.exempt_prefixes):
+                continue
+            trailing = token[len(url):]
+            chunk = text[pos:start]
+            out.append(chunk)
+            local_out.append(chunk)
+            repl_url = self.placeholder_for(url)
+            local_url = local.get(repl_url)
+            if local_url is None:
+                if repl_url.startswith(self._image_prefix):
+                    images.append(repl_url)
+                    local_url = self.image_base.format(len(images))
+                else:
+                    products.append(repl_url)
+                    local_url = self.product_base.format(len(products))
+                local[repl_url] = local_url
+            out.append(repl_url + trailing)
+            local_out.append(local_url + trailing)
+            pos = end
+        tail = text[pos:]
+        out.append(tail)
+        local_out.append(tail)
+        return TokenizedPage("".join(out), "".join(local_out), self.product_base, self.image_base, products, images)
+
+    def adopt(self, page: LocalPage) -> PagePlaceholders:
+        """
+        Give a page tokenized with `tokenize_local` its placeholders in this
+        tokenizer, without rewriting the page text itself.
+        """
+        return PagePlaceholders(
+            self.product_base,
+            self.image_base,
+            [self.placeholder_for(url) for url in page.product_urls],
+            [self.placeholder_for(url) for url in page.image_urls],
+        )
+
+
+def tokenize_local(text: str, product_base: str, image_base: str) -> LocalPage:
+    """Tokenize one page with local numbering; see UrlTokenizer.adopt."""
+    tokenizer = UrlTokenizer(product_base, image_base)
+    page = tokenizer.tokenize(text)
+    return LocalPage(
+        page.local_text,
+        [tokenizer.to_original[p] for p in page.products],
+        [tokenizer.to_original[p] for p in page.images],
+    )
+
+
+class SearchUrlIndex:
+    """
+    Bidirectional placeholder index shared by all retailers of one search.
+    Placeholders carry a retailer-specific base, so one flat
+    placeholder -> original table serves every retailer.
+    """
+
+    def __init__(self):
+        self.to_original: Dict[str, str] = {}
+        self._tokenizers: Dict[str, UrlTokenizer] = {}
+
+    def tokenizer(self, retailer: str) -> UrlTokenizer:
+        tokenizer = self._tokenizers.get(retailer)
+        if tokenizer is None:
+            product_base, image_base = PLACEHOLDER_BASES.get(retailer, PLACEHOLDER_BASES["amazon.com"])
+            tokenizer = UrlTokenizer(product_base, image_base, to_original=self.to_original)
+            self._tokenizers[retailer] = tokenizer
+        return tokenizer
+
+    def restore(self, url: str) -> str:
+        return self.to_original.get(url, url)
@@ -0,0 +1,150 @@
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from jsonschema import Draft202012Validator
+from jsonschema.exceptions import best_match
+
+NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def _types(schema: Dict[str, Any]) -> List[str]:
+    t = schema.get("type", [])
+    return t if isinstance(t, list) else [t]
+
+
+def _parse_number(value: str):
+    m = NUMBER_RE.search(value.replace(",", ""))
+    return float(m.group(0)) if m else None
+
+
+def coerce(value: Any, schema: Dict[str, Any]) -> Any:
+    """
+    Best-effort repair of `value` towards `schema`: numeric strings to
+    numbers, floats to integers, scalars to strings or one-item arrays,
+    objects trimmed to their declared properties. Values that cannot be
+    repaired come back unchanged so validation reports them.
+    """
+    types = _types(schema)
+    if value is None:
+        if "null" in types:
+            return None
+        if "array" in types:
+            return []
+        return value
+    if "integer" in types and not isinstance(value, bool):
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, str):
+            n = _parse_number(value)
+            if n is not None:
+                return int(n)
+            return None if "null" in types else value
+    if "number" in types and not isinstance(value, bool):
+        if isinstance(value, str):
+            n = _parse_number(value)
+            if n is not None:
+                return n
+            return None if "null" in types else value
+    if "string" in types and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    if "array" in types:
+        items = schema.get("items", {})
+        if not isinstance(value, list):
+            value = [value]
+        return [coerce(v, items) for v in value if v is not None]
+    if "object" in types and isinstance(value, dict):
+        props = schema.get("properties")
+        if props is not None and schema.get("additionalProperties") is False:
+            value = {k: v for k, v in value.items() if k in props}
+        if props:
+            value = {k: coerce(v, props[k]) if k in props else v for k, v in value.items()}
+        if "null" in types and any(k not in value for k in schema.get("required", [])):
+            return None
+        return value
+    if "object" in types and "null" in types:
+        return None
+    return value
+
+
+class ProductSalvager:
+    """
+    Validates an extraction response product by product against a
+    PRODUCTS_SCHEMA-shaped schema. Invalid products are repaired where the
+    problem is a type mismatch and dropped otherwise, instead of failing
+    the whole page. Validators are compiled once.
+    Rejection statistics accumulate in `stats` and `rejections`.
+    """
+
+    def __init__(self, schema: Dict[str, Any]):
+        self.schema = schema
+        self.item_schema = schema["properties"]["products"]["items"]
+        self.item_validator = Draft202012Validator(self.item_schema)
+        self.stats: Counter = Counter()
+        self.rejections: Counter = Counter()
+
+    def salvage(self, data: Any) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Returns (data, report). `data` always has a `products` list holding
+        only valid products; unknown top-level keys are dropped. `report`
+        counts kept, repaired and rejected products and the rejection
+        reasons for this response.
+        """
+        report = {"kept": 0, "repaired": 0, "rejected": 0, "reasons": Counter()}
+        if not isinstance(data, dict):
+            data = {}
+        top_props = self.schema.get("properties", {})
+        clean = {k: v for k, v in data.items() if k in top_props and k != "products" and isinstance(v, str)}
+        products = data.get("products")
+        if isinstance(products, dict):
+            products = [products]
+        if not isinstance(products, list):
+            products = []
+            report["reasons"]["products: missing"] += 1
+
+        kept = []
+        for product in products:
+            if not isinstance(product, dict):
+                report["rejected"] += 1
+                report["reasons"]["product: not an object"] += 1
+                continue
+            if self.item_validator.is_valid(product):
+                kept.append(product)
+                report["kept"] += 1
+                continue
+            repaired = self.repair(product)
+            if self.item_validator.is_valid(repaired):
+                kept.append(repaired)
+                report["kept"] += 1
+                report["repaired"] += 1
+                continue
+            error = best_match(self.item_validator.iter_errors(repaired))
+            field = "/".join(str(p) for p in error.absolute_path) or (
+                error.message.split("'")[1] if error.validator == "required" else "product"
+            )
+            report["rejected"] += 1
+            report["reasons"][f"{field}: {error.validator}"] += 1
+
+        clean["products"] = kept
+        self.stats.update({"responses": 1, "kept": report["kept"], "repaired": report["repaired"], "rejected": report["rejected"]})
+        self.rejections.update(report["reasons"])
+        return clean, report
+
+    def check(self, product: Any) -> Optional[Dict[str, Any]]:
+        """
+        The product, repaired if needed, or None if it is not valid.
+        Used for products seen mid-stream; does not touch the statistics.
+        """
+        if not isinstance(product, dict):
+            return None
+        if self.item_validator.is_valid(product):
+            return product
+        repaired = self.repair(product)
+        return repaired if self.item_validator.is_valid(repaired) else None
+
+    def repair(self, product: Dict[str, Any]) -> Dict[str, Any]:
+        props = self.item_schema.get("properties", {})
+        repaired = {}
+        for key, value in product.items():
+            repaired[key] = coerce(value, props[key]) if key in props else value
+        return repaired
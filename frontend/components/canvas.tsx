@@ -42,6 +42,7 @@ interface Product {
 
 interface CanvasProps {
   products: Product[]
+  previewProducts?: Product[]
   isLoading: boolean
   query: string
   wishlist: string[]
@@ -61,6 +62,7 @@ interface CanvasProps {
 
 export function Canvas({
   products,
+  previewProducts = [],
   canvasLogs,
   isLoading,
   query,  
@@ -74,6 +76,44 @@ export function Canvas({
   start,
   report,
 }: CanvasProps) {
+  if (isLoading && previewProducts.length > 0) {
+    // Products streamed by the agent while the search is still running;
+    // they join the canvas once the user accepts the results.
+    return (
+      <div className="flex-1 p-6 bg-[#F7F7F9] overflow-y-auto">
+        <div className="flex justify-between items-center mb-6">
+          <div className="flex items-center gap-3 min-w-0">
+            <Loader2 className="w-6 h-6 text-[#86ECE4] animate-spin shrink-0" />
+            <div className="min-w-0">
+              <h2 className="text-lg font-semibold text-[#030507] break-words">{canvasLogs?.title || "Processing your request..."}</h2>
+              <p className="text-[#575758] break-words">{canvasLogs?.subtitle || ""}</p>
+            </div>
+          </div>
+          <Button
+            onClick={onGoToWishlist}
+            variant="outline"
+            className="border-[#D8D8E5] hover:bg-[#E8E8EF] bg-white flex items-center gap-2"
+          >
+            <Heart className="w-4 h-4" />
+            Wishlist ({wishlistLength})
+          </Button>
+        </div>
+
+        <div className="grid grid-cols-1 lg:grid-cols-2 xl:grid-cols-3 gap-6">
+          {previewProducts.map((product) => (
+            <ProductCard
+              key={product.id}
+              product={product}
+              isWishlisted={false}
+              onToggleWishlist={() => {}}
+              onDeleteProduct={() => {}}
+            />
+          ))}
+        </div>
+      </div>
+    )
+  }
+
   if (isLoading) {
     return (
       <div className="flex-1 flex items-center justify-center bg-[#F7F7F9] relative">
@@ -40,7 +40,8 @@ export function ReportView({ products, onExit, searchQuery, report, isLoading }:
   return (
     <div className="flex-1 bg-[#F7F7F9] overflow-y-auto">
       {/* Header */}
-      {isLoading ? (
+      {/* Report sections stream in; keep the loader only until the first one arrives */}
+      {isLoading && !report?.top_pick ? (
         <div className="min-h-screen flex items-center justify-center bg-[#F7F7F9]">
           <div className="text-center">
             <Loader2 className="w-12 h-12 text-[#86ECE4] animate-spin mx-auto mb-4" />
@@ -122,7 +123,7 @@ export function ReportView({ products, onExit, searchQuery, report, isLoading }:
                     <thead>
                       <tr className="border-b border-[#D8D8E5]">
                         <th className="text-left p-3 text-[#030507] font-semibold">Title</th>
-                        {Object.entries(report?.products_specifications[0]?.specifications).map(([key, value]: any) => (
+                        {Object.entries(report?.products_specifications?.[0]?.specifications || {}).map(([key, value]: any) => (
                           <th className="text-left p-3 text-[#030507] font-semibold">{value.split(":")[0]}</th>
                         ))}
 
@@ -144,7 +145,7 @@ export function ReportView({ products, onExit, searchQuery, report, isLoading }:
                               </div>
                             </div>
                           </td>
-                          {Object.entries(product?.specifications).map(([key, value]: any) => (
+                          {Object.entries(product?.specifications || {}).map(([key, value]: any) => (
                             <td className="p-3">
                               {value.split(":")[1]}
                             </td>
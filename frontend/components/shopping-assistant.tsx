@@ -1,6 +1,6 @@
 "use client"
 
-import { useEffect, useState } from "react"
+import { useEffect, useRef, useState } from "react"
 import { Sidebar } from "@/components/sidebar"
 import { Canvas } from "@/components/canvas"
 import { WishlistView } from "@/components/wishlist-view"
@@ -191,6 +191,15 @@ export function ShoppingAssistant() {
     }
   })
   const { messages, setMessages } = useCopilotMessagesContext();
+  // Every product seen in this session, by id. Accept, Show-more and deletes
+  // rewrite buffer_products, so list_products ids are resolved here; entries
+  // are only ever added, never removed.
+  const productsById = useRef(new Map<string, any>())
+  for (const product of [...(state?.buffer_products || []), ...(state?.products || []), ...(state?.favorites || [])]) {
+    if (product?.id && !productsById.current.has(product.id)) {
+      productsById.current.set(product.id, product)
+    }
+  }
   useEffect(() => {
     // debugger
     console.log(conversationHistory[0], "conversationHistory");
@@ -373,10 +382,11 @@ export function ShoppingAssistant() {
     if (!productToDelete) return
 
     if (state?.buffer_products?.length > 0) {
-      let a = state?.buffer_products.pop()
+      let a = state?.buffer_products[state?.buffer_products.length - 1]
       setState({
         ...state,
-        products: [...state?.products?.filter((p: any) => p.id !== productId), ...(a ? [a] : [])]
+        products: [...state?.products?.filter((p: any) => p.id !== productId), ...(a ? [a] : [])],
+        buffer_products: state?.buffer_products.slice(0, -1)
       })
     }
     else {
@@ -500,10 +510,11 @@ export function ShoppingAssistant() {
         debugger
         let itemsToRemove = args?.remove_from_canvas?.map((product: any) => product?.product_id)
         if (state?.buffer_products?.length > 0) {
-          let a = state?.buffer_products.pop()
+          let a = state?.buffer_products[state?.buffer_products.length - 1]
           setState({
             ...state,
-            products: [...state?.products?.filter((p: any) => !itemsToRemove?.includes(p?.id)), ...(a ? [a] : [])]
+            products: [...state?.products?.filter((p: any) => !itemsToRemove?.includes(p?.id)), ...(a ? [a] : [])],
+            buffer_products: state?.buffer_products.slice(0, -1)
           })
         }
         else {
@@ -527,6 +538,11 @@ export function ShoppingAssistant() {
     description: "A list of products that are scraped from web",
     renderAndWaitForResponse: ({ status, respond, args }) => {
       // console.log(args, "argsargsargsargs")
+      // The agent sends product ids; the products themselves arrive in the
+      // agent state's buffer_products. Older chats embed them in the args.
+      const resultProducts: any[] = args?.product_ids
+        ? args.product_ids.map((id: string) => productsById.current.get(id)).filter(Boolean)
+        : (args?.buffer_products || [])
 
       return <DialogBox isDisabled={respond == undefined} contentList={args?.products?.map((product: any) => ({ title: product.title, url: product.product_url }))}
         onAccept={() => {
@@ -535,8 +551,8 @@ export function ShoppingAssistant() {
             respond("Accepted")
             setState({
               ...state,
-              products: args?.products,
-              buffer_products: args?.buffer_products.slice(5, args?.buffer_products.length),
+              products: resultProducts.slice(0, 5),
+              buffer_products: resultProducts.slice(5, resultProducts.length),
               logs: []
             })
             let conversations = conversationHistory
@@ -567,8 +583,8 @@ export function ShoppingAssistant() {
             respond("Show more products")
             setState({
               ...state,
-              products: args?.buffer_products?.slice(0, 10),
-              buffer_products: args?.buffer_products.slice(10, args?.buffer_products.length),
+              products: resultProducts.slice(0, 10),
+              buffer_products: resultProducts.slice(10, resultProducts.length),
               logs: []
             })
 
@@ -659,6 +675,7 @@ export function ShoppingAssistant() {
             show_results={state?.show_results}
             report={state?.report}
             products={state?.products}
+            previewProducts={state?.preview_products}
             isLoading={isLoading && !state?.show_results}
             query={query}
             wishlistLength={state?.favorites?.length}